@@ -0,0 +1,272 @@
+import argparse
+import json
+import math
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+from batch_processor import list_images
+from cartoonizer import Cartoonizer, save_preset, scale_parameters
+from fidelity import line_mask
+from image_io import read_image
+from parameter_sweep import expand_grid
+
+# Search space of the tuner by default, in the grid format of parameter_sweep.expand_grid
+DEFAULT_SPACE = {
+    'bilateral_filter_d': [5, 7, 9, 11, 13],
+    ('bilateral_sigma_color', 'bilateral_sigma_space'): [(50, 50), (75, 75), (100, 100), (150, 150)],
+    ('edge_threshold1', 'edge_threshold2'): [(30, 100), (50, 150), (70, 200), (90, 250)],
+    'line_size': [5, 7, 9],
+    'total_color_levels': [6, 8, 10, 12],
+}
+
+# Parameters applied before every candidate, so that evaluations are reproducible
+BASE_PARAMS = {'random_seed': 0}
+
+
+def edge_density_score(img, cartoon, seconds, target=0.06):
+    """
+    Score how close the fraction of edge-line pixels is to a target.
+
+    Returns:
+        Minus the absolute difference between the line fraction and target
+    """
+    lines = line_mask(cartoon)
+    return -abs(np.count_nonzero(lines) / lines.size - target)
+
+
+def color_fidelity_score(img, cartoon, seconds):
+    """
+    Score how closely the cartoon's fill colors follow the original image.
+
+    Returns:
+        Minus the mean CIELAB color difference (CIE76 delta E) between the
+        cartoon and the original, over the pixels not covered by edge lines
+    """
+    fill = ~line_mask(cartoon)
+    original = cv2.cvtColor(np.float32(img) / 255.0, cv2.COLOR_BGR2Lab)[fill]
+    colors = cv2.cvtColor(np.float32(cartoon) / 255.0, cv2.COLOR_BGR2Lab)[fill]
+    if len(colors) == 0:
+        return -float('inf')
+    return -float(np.linalg.norm(original - colors, axis=1).mean())
+
+
+def runtime_score(img, cartoon, seconds):
+    """
+    Score the speed of the cartoonization.
+
+    Returns:
+        Minus the seconds per megapixel
+    """
+    return -seconds / (img.shape[0] * img.shape[1] / 1e6)
+
+
+# Objectives by name; each takes (img, cartoon, seconds) and returns a score, higher is better
+OBJECTIVES = {
+    'edge_density': edge_density_score,
+    'color_fidelity': color_fidelity_score,
+    'runtime': runtime_score,
+}
+
+
+def sample_candidates(space, max_candidates=None, seed=0):
+    """
+    List the candidate parameter sets of a search space.
+
+    Args:
+        space: Parameter grid, see parameter_sweep.expand_grid
+        max_candidates: Draw at most this many combinations at random (None keeps all)
+        seed: Seed of the random draw
+
+    Returns:
+        List of parameter dictionaries
+    """
+    candidates = expand_grid(space)
+    if max_candidates is not None and len(candidates) > max_candidates:
+        candidates = random.Random(seed).sample(candidates, max_candidates)
+    return candidates
+
+
+def rung_scales(img, rungs, eta, min_megapixels):
+    """
+    Linear downscaling factor of an image at every rung of successive halving.
+
+    Each rung has eta times the pixels of the previous one and the last rung
+    is at full resolution; no rung goes below min_megapixels.
+    """
+    megapixels = img.shape[0] * img.shape[1] / 1e6
+    floor = math.sqrt(min(1.0, min_megapixels / megapixels))
+    return [max(floor, math.sqrt(eta ** (rung - rungs + 1))) for rung in range(rungs)]
+
+
+def successive_halving(images, candidates, objective='color_fidelity', budget_seconds=300.0,
+                       eta=3, min_megapixels=0.1, base_params=None,
+                       max_seconds_per_megapixel=None, verbose=True):
+    """
+    Find the best candidate parameters with successive halving.
+
+    All candidates are first evaluated on strongly downscaled images, with
+    their spatial parameters scaled to match (see scale_parameters). Only
+    the best 1/eta advance to the next rung, which uses eta times more
+    pixels, and the last rung evaluates the few survivors at full
+    resolution. Most of the work is thus spent on small images. A candidate
+    is only evaluated when its expected time, from the candidates timed so
+    far, fits in the remaining budget; once it does not, the best candidate
+    of the highest rung reached is returned.
+
+    Args:
+        images: List of images the candidates are scored on
+        candidates: List of parameter dictionaries, see sample_candidates
+        objective: Name in OBJECTIVES, or a callable (img, cartoon, seconds) -> score
+        budget_seconds: Time budget of the search
+        eta: Reduction factor between rungs
+        min_megapixels: Smallest image size evaluated
+        base_params: Parameters applied before each candidate (defaults to BASE_PARAMS)
+        max_seconds_per_megapixel: Rank candidates slower than this after all others
+        verbose: Print one line per rung
+
+    Returns:
+        Dictionary with the best parameters, its score and resolution, and the
+        history of every evaluation
+    """
+    score_fn = OBJECTIVES[objective] if isinstance(objective, str) else objective
+    base_params = BASE_PARAMS if base_params is None else base_params
+    timing_matters = score_fn is runtime_score or max_seconds_per_megapixel is not None
+    # Candidates sharing stage parameters share cached stages, unless times are compared
+    cartoonizer = Cartoonizer(cache_bytes=0 if timing_matters else 256 * 1024 * 1024)
+    # Every parameter is set for each candidate, so that the defaults are scaled too
+    # and no scaled value is left over from the previous candidate
+    defaults = cartoonizer.get_parameters()
+    rungs = max(1, math.ceil(math.log(len(candidates), eta))) if len(candidates) > 1 else 1
+    scales = [rung_scales(img, rungs, eta, min_megapixels) for img in images]
+
+    start = time.perf_counter()
+    history = []
+    survivors = list(candidates)
+    ranked = []
+    # Mean seconds of one candidate evaluation in the last rung completed
+    rung_seconds = None
+    for rung in range(rungs):
+        small_images = [cv2.resize(img, None, fx=image_scales[rung], fy=image_scales[rung],
+                                   interpolation=cv2.INTER_AREA) if image_scales[rung] < 1 else img
+                        for img, image_scales in zip(images, scales)]
+        results = []
+        for params in survivors:
+            # A rung has eta times the pixels of the previous one
+            if results:
+                estimate = np.mean([r['seconds'] for r in results])
+            else:
+                estimate = rung_seconds * eta if rung_seconds is not None else 0.0
+            if time.perf_counter() - start + estimate > budget_seconds and (results or ranked):
+                break
+            candidate_start = time.perf_counter()
+            effective = {**defaults, **base_params, **params}
+            scores, seconds_per_megapixel = [], []
+            for img, image_scales in zip(small_images, scales):
+                cartoonizer.update_parameters(**scale_parameters(effective, image_scales[rung]))
+                evaluation_start = time.perf_counter()
+                cartoon = cartoonizer.cartoonize(img)
+                seconds = time.perf_counter() - evaluation_start
+                scores.append(score_fn(img, cartoon, seconds))
+                seconds_per_megapixel.append(seconds / (img.shape[0] * img.shape[1] / 1e6))
+            result = {'rung': rung, 'scale': float(np.mean([s[rung] for s in scales])),
+                      'params': params, 'score': float(np.mean(scores)),
+                      'seconds': time.perf_counter() - candidate_start,
+                      'seconds_per_megapixel': float(np.mean(seconds_per_megapixel))}
+            result['feasible'] = (max_seconds_per_megapixel is None
+                                  or result['seconds_per_megapixel'] <= max_seconds_per_megapixel)
+            results.append(result)
+            history.append(result)
+        if not results:
+            break
+        rung_seconds = float(np.mean([r['seconds'] for r in results]))
+        ranked = sorted(results, key=lambda r: (r['feasible'], r['score']), reverse=True)
+        if verbose:
+            print(f"Rung {rung + 1}/{rungs}: {len(results)} candidates at "
+                  f"{ranked[0]['scale']:.2f}x scale, best score {ranked[0]['score']:.4f} "
+                  f"({time.perf_counter() - start:.1f}s)")
+        if len(results) < len(survivors):
+            # Out of time
+            break
+        survivors = [r['params'] for r in ranked[:max(1, len(ranked) // eta)]]
+
+    best = ranked[0]
+    return {
+        'params': dict(base_params, **best['params']),
+        'score': best['score'],
+        'scale': best['scale'],
+        'feasible': best['feasible'],
+        'objective': objective if isinstance(objective, str) else getattr(objective, '__name__', 'custom'),
+        'evaluations': len(history),
+        'candidates': len(candidates),
+        'elapsed_seconds': time.perf_counter() - start,
+        'history': history,
+    }
+
+
+def load_space(path):
+    """
+    Read a search space from a JSON file.
+
+    Keys naming several parameters separated by commas vary them together,
+    e.g. {"edge_threshold1,edge_threshold2": [[30, 100], [50, 150]]}.
+    """
+    with open(path) as f:
+        space = json.load(f)
+    return {tuple(key.split(',')) if ',' in key else key: values for key, values in space.items()}
+
+
+def main(argv=None):
+    """Command line entry point for the auto-tuner."""
+    parser = argparse.ArgumentParser(description="Tune cartoonization parameters with successive halving.")
+    parser.add_argument('dataset_dir', nargs='?', default='dataset',
+                        help="Directory of images representative of the content (default: dataset)")
+    parser.add_argument('--objective', choices=sorted(OBJECTIVES), default='color_fidelity',
+                        help="Score to maximize (default: color_fidelity)")
+    parser.add_argument('--edge-density', type=float, default=0.06,
+                        help="Target fraction of edge-line pixels of the edge_density objective")
+    parser.add_argument('--max-seconds-per-megapixel', type=float, default=None,
+                        help="Prefer candidates at most this slow")
+    parser.add_argument('--budget', type=float, default=300.0, help="Time budget in seconds (default: 300)")
+    parser.add_argument('--space', default=None, help="JSON file with the search space")
+    parser.add_argument('--max-candidates', type=int, default=None,
+                        help="Draw at most this many candidates from the search space")
+    parser.add_argument('--max-images', type=int, default=3,
+                        help="Number of images to tune on (default: 3)")
+    parser.add_argument('--eta', type=int, default=3, help="Reduction factor between rungs (default: 3)")
+    parser.add_argument('--min-megapixels', type=float, default=0.1,
+                        help="Image size of the first rung (default: 0.1)")
+    parser.add_argument('--params', default=None,
+                        help="JSON object of fixed Cartoonizer parameters applied to every candidate")
+    parser.add_argument('--output', default='preset.json', help="Preset file (default: preset.json)")
+    args = parser.parse_args(argv)
+
+    space = load_space(args.space) if args.space else DEFAULT_SPACE
+    candidates = sample_candidates(space, args.max_candidates)
+    images = [img for img in map(read_image, list_images(args.dataset_dir)[:args.max_images])
+              if img is not None]
+    if not images:
+        print(f"No readable images in {args.dataset_dir}")
+        return 1
+    objective = args.objective
+    if objective == 'edge_density':
+        def objective(img, cartoon, seconds):
+            return edge_density_score(img, cartoon, seconds, args.edge_density)
+        objective.__name__ = 'edge_density'
+    base_params = dict(BASE_PARAMS, **(json.loads(args.params) if args.params else {}))
+
+    result = successive_halving(images, candidates, objective, args.budget, args.eta,
+                                args.min_megapixels, base_params, args.max_seconds_per_megapixel)
+    info = {name: result[name] for name in ('objective', 'score', 'scale', 'evaluations',
+                                            'candidates', 'elapsed_seconds')}
+    save_preset(result['params'], args.output, info)
+    print(f"Best parameters after {result['evaluations']} evaluations of {result['candidates']} "
+          f"candidates ({result['elapsed_seconds']:.1f}s): {result['params']}")
+    print(f"Preset saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,749 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from cartoonizer import Cartoonizer, load_preset
+from comparison import save_comparison
+from image_io import WRITE_FORMATS, ImageWriter, output_path, read_image
+from instrumentation import format_stages
+from quantizers import load_palette, save_palette
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+MANIFEST_VERSION = 1
+
+# Cartoonizer parameters that affect speed but not the output
+EXECUTION_PARAMETERS = ('concurrent_branches', 'num_threads')
+
+# Per-process cartoonizer, created once by the pool initializer
+_worker_cartoonizer = None
+
+
+def list_images(directory):
+    """
+    List the image files in a directory.
+
+    Args:
+        directory: Directory to scan
+
+    Returns:
+        Sorted list of image paths
+    """
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+            if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Hash the contents of a file.
+
+    Args:
+        path: Path of the file
+        chunk_size: Bytes read at a time
+
+    Returns:
+        Hexadecimal BLAKE2b digest of the file contents
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parameter_fingerprint(params=None, prefix='cartoon_', comparison_writer=None,
+                          output_format=None, quality=None, max_size=None):
+    """
+    Fingerprint everything besides the input that determines a batch output.
+
+    The fingerprint covers the effective value of every Cartoonizer parameter,
+    so a run with explicit default values matches a run relying on them.
+
+    Args:
+        params: Keyword arguments for Cartoonizer.update_parameters
+        prefix: File name prefix of the cartoon outputs
+        comparison_writer: Comparison writer of the run, or None
+        output_format: Output format of the run, or None
+        quality: Output quality of the run, or None
+        max_size: Input size limit of the run, or None
+
+    Returns:
+        Hexadecimal digest
+    """
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(**(params or {}))
+    writer = None
+    if comparison_writer is not None:
+        writer = f"{comparison_writer.__module__}.{comparison_writer.__qualname__}"
+    params = cartoonizer.get_parameters()
+    # Execution settings do not change the output
+    for name in EXECUTION_PARAMETERS:
+        params.pop(name)
+    settings = {'params': params, 'prefix': prefix, 'comparison_writer': writer}
+    # Output options are only recorded when set, so older manifests stay valid
+    output = {'output_format': output_format, 'quality': quality, 'max_size': max_size}
+    output = {name: value for name, value in output.items() if value is not None}
+    if output:
+        settings['output'] = output
+    # Arrays such as a shared palette are encoded as nested lists
+    encoded = json.dumps(settings, sort_keys=True, default=lambda v: np.asarray(v).tolist()).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def load_manifest(manifest_path):
+    """
+    Load an incremental-processing manifest.
+
+    Args:
+        manifest_path: Path of the manifest file
+
+    Returns:
+        Dictionary mapping absolute input paths to manifest entries (empty if
+        the file does not exist or has an unknown version)
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['entries']
+
+
+def save_manifest(entries, manifest_path):
+    """
+    Write an incremental-processing manifest atomically.
+
+    Args:
+        entries: Dictionary as returned by load_manifest
+        manifest_path: Path of the manifest file
+    """
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'entries': entries}, f, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+def plan_incremental(image_paths, entries, fingerprint):
+    """
+    Split a batch into the images that need processing and those up to date.
+
+    An image is up to date when its manifest entry has the same content hash
+    and parameter fingerprint and its output still exists. Files whose size
+    and modification time match the manifest are not re-hashed.
+
+    Args:
+        image_paths: Paths of the candidate images
+        entries: Manifest entries as returned by load_manifest
+        fingerprint: Parameter fingerprint of the current run
+
+    Returns:
+        Tuple (pending, up_to_date, states): the paths to process, the paths
+        to skip, and the (size, mtime, digest) of every readable candidate
+    """
+    pending, up_to_date, states = [], [], {}
+    for image_path in image_paths:
+        key = os.path.abspath(image_path)
+        entry = entries.get(key)
+        try:
+            stat = os.stat(image_path)
+            if entry and (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                digest = entry['digest']
+            else:
+                digest = file_digest(image_path)
+        except OSError:
+            # Let the batch report the unreadable file
+            pending.append(image_path)
+            continue
+        states[key] = (stat.st_size, stat.st_mtime_ns, digest)
+        if (entry and entry['digest'] == digest and entry['fingerprint'] == fingerprint
+                and entry['output'] and os.path.exists(entry['output'])):
+            up_to_date.append(image_path)
+        else:
+            pending.append(image_path)
+    return pending, up_to_date, states
+
+
+def fit_batch_palette(image_paths, params=None, max_images=None, max_size=None):
+    """
+    Fit one palette shared by every image of a batch.
+
+    Args:
+        image_paths: Paths of the images of the batch
+        params: Keyword arguments for Cartoonizer.update_parameters
+        max_images: Fit on at most this many images, evenly spaced over the batch
+        max_size: Downscale the images to at most this many pixels per side, as
+            the batch does
+
+    Returns:
+        float32 array of shape (total_color_levels, 3) with the palette colors
+    """
+    if max_images and len(image_paths) > max_images:
+        image_paths = [image_paths[int(i * len(image_paths) / max_images)] for i in range(max_images)]
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(**(params or {}))
+    cartoonizer.clear_palette()
+
+    # Images are decoded one at a time; unreadable files are left to the batch to report
+    images = (img for img in (read_image(path, max_size, fit=True) for path in image_paths)
+              if img is not None)
+    samples_per_image = max(1, cartoonizer.sample_size // max(1, len(image_paths)))
+    return cartoonizer.fit_palette(images, samples_per_image)
+
+
+def thread_budget(workers, cpu_count=None):
+    """
+    Split the machine's cores between worker processes.
+
+    Every worker process runs its own OpenCV thread pool, so letting each of
+    them use all the cores oversubscribes the machine.
+
+    Args:
+        workers: Number of worker processes
+        cpu_count: Number of cores to share (defaults to os.cpu_count())
+
+    Returns:
+        Number of OpenCV threads per worker, at least 1
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // max(1, workers))
+
+
+def _init_worker(params, num_threads=None, output=None):
+    """Create the cartoonizer and image writer used by a worker process."""
+    global _worker_cartoonizer, _worker_output, _worker_writer
+    # Every image in a batch is distinct, so stage caching would only cost memory
+    _worker_cartoonizer = Cartoonizer(cache_bytes=0, reuse_buffers=True)
+    _worker_cartoonizer.update_parameters(**params)
+    if num_threads is not None and 'num_threads' not in params:
+        _worker_cartoonizer.update_parameters(num_threads=num_threads)
+    _worker_output = dict(output or {})
+    _worker_writer = ImageWriter(workers=2, quality=_worker_output.get('quality'))
+
+
+def _new_record(image_path):
+    """Result record of an image, before it is processed."""
+    return {'input': image_path, 'output': None, 'status': 'ok', 'error': None,
+            'seconds': 0.0, 'megapixels': 0.0, 'stages': {}}
+
+
+def _failed_record(image_path, exc):
+    """Result record of an image whose processing failed outside of its worker code."""
+    record = _new_record(image_path)
+    record['status'] = 'error'
+    record['error'] = f"{type(exc).__name__}: {exc}"
+    return record
+
+
+def _start_image(image_path, output_dir, prefix, comparison_writer):
+    """
+    Cartoonize one image and queue its outputs on the worker's image writer.
+
+    Returns:
+        Tuple (record, futures) for _finish_image
+    """
+    record = _new_record(image_path)
+    start = time.perf_counter()
+    futures = []
+    try:
+        max_size = _worker_output.get('max_size')
+        img = read_image(image_path, max_size, fit=True)
+        if img is None:
+            raise ValueError("could not read image")
+        record['megapixels'] = img.shape[0] * img.shape[1] / 1e6
+
+        with _worker_cartoonizer.instrument() as report:
+            cartoon = _worker_cartoonizer.cartoonize(img)
+        record['stages'] = report.per_stage()
+
+        image_file = os.path.basename(image_path)
+        output_format = _worker_output.get('output_format')
+        record['output'] = output_path(os.path.join(output_dir, f"{prefix}{image_file}"),
+                                       output_format)
+        futures.append(_worker_writer.submit(record['output'], cartoon))
+
+        if comparison_writer is not None:
+            comparison_path = output_path(os.path.join(output_dir, f"comparison_{image_file}"),
+                                          output_format)
+            futures.append(_worker_writer.call(comparison_writer, img, cartoon, comparison_path))
+    except Exception as exc:
+        record['status'] = 'error'
+        record['error'] = f"{type(exc).__name__}: {exc}"
+    # Encoding runs on the writer threads and is not included
+    record['seconds'] = time.perf_counter() - start
+    return record, futures
+
+
+def _finish_image(record, futures):
+    """Wait for the queued outputs of an image and complete its record."""
+    for future in futures:
+        try:
+            future.result()
+        except Exception as exc:
+            if record['status'] == 'ok':
+                record['status'] = 'error'
+                record['error'] = f"{type(exc).__name__}: {exc}"
+    if record['status'] == 'error':
+        record['output'] = None
+    return record
+
+
+def _process_image(image_path, output_dir, prefix, comparison_writer):
+    """
+    Cartoonize one image and write the result.
+
+    Errors are caught and reported in the returned record so that a single bad
+    file does not abort the batch.
+
+    Returns:
+        Dictionary describing the outcome for this image
+    """
+    return _finish_image(*_start_image(image_path, output_dir, prefix, comparison_writer))
+
+
+class WorkerPool:
+    """
+    A pool of batch worker processes, replaced when a worker dies.
+
+    The worker processes are spawned on the first submission and kept until
+    shutdown, so several batches, e.g. the polls of watch_directory, share
+    them instead of each paying for starting the interpreters and importing
+    OpenCV.
+    """
+
+    def __init__(self, workers, params=None, threads_per_worker=None, output=None):
+        """
+        Initialize the pool.
+
+        Args:
+            workers: Number of worker processes
+            params: Keyword arguments for Cartoonizer.update_parameters
+            threads_per_worker: OpenCV threads of each worker process (defaults
+                to the CPU count divided among the workers)
+            output: Dictionary with the output_format, quality and max_size options
+        """
+        self.workers = workers
+        self.initargs = (dict(params or {}), threads_per_worker or thread_budget(workers),
+                         dict(output or {}))
+        self.executor = None
+
+    def submit(self, function, *args):
+        """
+        Run a function in a worker process.
+
+        Returns:
+            Tuple (future, executor): the future of the call, failed with
+            BrokenProcessPool if the pool is broken, and the executor it was
+            submitted to, for recover
+        """
+        if self.executor is None:
+            # Spawned rather than forked: a fork copies OpenCV's thread pool in
+            # whatever state the parent left it, which can hang the workers
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_init_worker, initargs=self.initargs)
+        executor = self.executor
+        try:
+            future = executor.submit(function, *args)
+        except BrokenProcessPool as exc:
+            # The pool broke since the last result was collected
+            future = Future()
+            future.set_exception(exc)
+        return future, executor
+
+    def recover(self, executor):
+        """Replace a broken executor; later submissions start new worker processes."""
+        if executor is self.executor:
+            executor.shutdown(wait=False)
+            self.executor = None
+
+    def shutdown(self):
+        """Wait for the submitted calls and stop the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def iter_batch(image_paths, output_dir, params=None, workers=None, max_in_flight=None,
+               prefix='cartoon_', comparison_writer=None, threads_per_worker=None,
+               output_format=None, quality=None, max_size=None, pool=None):
+    """
+    Cartoonize images across a process pool, yielding results in input order.
+
+    At most max_in_flight images are submitted at any time, which bounds the
+    number of decoded images held in memory regardless of the batch size.
+    Outputs are encoded on writer threads; with a single worker the next
+    image is processed while the previous ones are being written. If a
+    worker process dies, e.g. killed for running out of memory, the images
+    in flight are reported as failed and the rest of the batch runs on a
+    new pool.
+
+    Args:
+        image_paths: Paths of the images to process
+        output_dir: Directory the results are written to
+        params: Keyword arguments for Cartoonizer.update_parameters
+        workers: Number of worker processes (defaults to the CPU count; 1 runs inline)
+        max_in_flight: Maximum number of images submitted but not yet collected
+            (defaults to twice the worker count)
+        prefix: File name prefix of the cartoon outputs
+        comparison_writer: Optional picklable callable (img, cartoon, path) used to
+            write a comparison image next to each result
+        threads_per_worker: OpenCV threads of each worker process (defaults to the
+            CPU count divided among the workers; a num_threads parameter takes
+            precedence)
+        output_format: 'jpg', 'png' or 'webp' for every output (None keeps the
+            format of each input)
+        quality: Quality (0-100) for JPEG and WebP, compression level (0-9) for PNG
+        max_size: Downscale the inputs to at most this many pixels per side,
+            decoding JPEG images at reduced resolution
+        pool: WorkerPool created with the same parameters and output options, to
+            reuse its processes (by default a pool is started for this batch)
+
+    Yields:
+        One result dictionary per image, in the order of image_paths
+    """
+    params = params or {}
+    workers = pool.workers if pool is not None else workers or os.cpu_count() or 1
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+    threads_per_worker = threads_per_worker or thread_budget(workers)
+    output = {'output_format': output_format, 'quality': quality, 'max_size': max_size}
+    os.makedirs(output_dir, exist_ok=True)
+
+    if pool is None and workers == 1:
+        _init_worker(params, threads_per_worker, output)
+        started = deque()
+        try:
+            for image_path in image_paths:
+                started.append(_start_image(image_path, output_dir, prefix, comparison_writer))
+                if len(started) >= max_in_flight:
+                    yield _finish_image(*started.popleft())
+            while started:
+                yield _finish_image(*started.popleft())
+        finally:
+            _worker_writer.close()
+        return
+
+    own_pool = pool is None
+    if own_pool:
+        pool = WorkerPool(workers, params, threads_per_worker, output)
+    try:
+        # (image path, future, executor) of the submitted images, in input order
+        pending = deque()
+        paths = iter(image_paths)
+
+        def submit_next():
+            image_path = next(paths, None)
+            if image_path is None:
+                return False
+            pending.append((image_path,) + pool.submit(_process_image, image_path, output_dir,
+                                                       prefix, comparison_writer))
+            return True
+
+        while len(pending) < max_in_flight and submit_next():
+            pass
+        while pending:
+            image_path, future, executor = pending.popleft()
+            try:
+                record = future.result()
+            except (BrokenProcessPool, CancelledError) as exc:
+                record = _failed_record(image_path, exc)
+                if isinstance(exc, BrokenProcessPool):
+                    # A worker died: every image in flight on its executor is lost
+                    pool.recover(executor)
+            # Refill the window before handing the result back so the pool stays busy
+            submit_next()
+            yield record
+    finally:
+        if own_pool:
+            pool.shutdown()
+
+
+def summarize(records, elapsed, workers):
+    """
+    Build a summary of a batch run.
+
+    Args:
+        records: Result dictionaries produced by iter_batch
+        elapsed: Wall time of the run in seconds
+        workers: Number of worker processes used
+
+    Returns:
+        Dictionary with counts, throughput, total time per stage and the
+        per-image records (up-to-date images skipped by an incremental run
+        are counted separately and excluded from the throughput)
+    """
+    succeeded = [r for r in records if r['status'] == 'ok']
+    skipped = [r for r in records if r['status'] == 'skipped']
+    megapixels = sum(r['megapixels'] for r in succeeded)
+    stage_seconds = {}
+    for record in succeeded:
+        for stage, totals in record['stages'].items():
+            stage_seconds[stage] = stage_seconds.get(stage, 0.0) + totals['seconds']
+    return {
+        'total': len(records),
+        'succeeded': len(succeeded),
+        'skipped': len(skipped),
+        'failed': len(records) - len(succeeded) - len(skipped),
+        'workers': workers,
+        'elapsed_seconds': elapsed,
+        'images_per_second': len(succeeded) / elapsed if elapsed > 0 else 0.0,
+        'megapixels_per_second': megapixels / elapsed if elapsed > 0 else 0.0,
+        'stage_seconds': stage_seconds,
+        'images': records,
+    }
+
+
+def process_batch(image_paths, output_dir, params=None, workers=None, max_in_flight=None,
+                  prefix='cartoon_', comparison_writer=None, summary_path=None, verbose=True,
+                  manifest_path=None, threads_per_worker=None, output_format=None, quality=None,
+                  max_size=None, pool=None):
+    """
+    Cartoonize a batch of images and optionally write a JSON summary.
+
+    With a manifest, the batch is incremental: images whose content and
+    parameters are unchanged since they were last processed are skipped, and
+    the manifest is updated with every image processed successfully.
+
+    Args:
+        image_paths: Paths of the images to process
+        output_dir: Directory the results are written to
+        params: Keyword arguments for Cartoonizer.update_parameters
+        workers: Number of worker processes (defaults to the CPU count)
+        max_in_flight: Maximum number of images in flight at once
+        prefix: File name prefix of the cartoon outputs
+        comparison_writer: Optional callable writing a comparison image per result
+        summary_path: Path of the JSON summary file, or None to skip writing it
+        verbose: Print one line per image
+        manifest_path: Path of the manifest file enabling incremental
+            processing, or None to process every image
+        threads_per_worker: OpenCV threads of each worker process (defaults to
+            the CPU count divided among the workers)
+        output_format: Format of every output (None keeps the input format)
+        quality: Format-specific output quality, see iter_batch
+        max_size: Downscale the inputs to at most this many pixels per side
+        pool: WorkerPool to run on, see iter_batch
+
+    Returns:
+        Summary dictionary as produced by summarize
+    """
+    workers = pool.workers if pool is not None else workers or os.cpu_count() or 1
+    records = []
+    start = time.perf_counter()
+
+    entries, states = {}, {}
+    if manifest_path is not None:
+        fingerprint = parameter_fingerprint(params, prefix, comparison_writer, output_format,
+                                            quality, max_size)
+        entries = load_manifest(manifest_path)
+        image_paths, up_to_date, states = plan_incremental(image_paths, entries, fingerprint)
+        for image_path in up_to_date:
+            entry = entries[os.path.abspath(image_path)]
+            records.append({'input': image_path, 'output': entry['output'], 'status': 'skipped',
+                            'error': None, 'seconds': 0.0, 'megapixels': 0.0, 'stages': {}})
+        if verbose and up_to_date:
+            print(f"Skipped {len(up_to_date)} up-to-date images")
+
+    try:
+        for record in iter_batch(image_paths, output_dir, params, workers, max_in_flight,
+                                 prefix, comparison_writer, threads_per_worker,
+                                 output_format, quality, max_size, pool):
+            records.append(record)
+            key = os.path.abspath(record['input'])
+            if manifest_path is not None and record['status'] == 'ok' and key in states:
+                size, mtime_ns, digest = states[key]
+                entries[key] = {'digest': digest, 'size': size, 'mtime_ns': mtime_ns,
+                                'fingerprint': fingerprint, 'output': record['output']}
+            if verbose:
+                name = os.path.basename(record['input'])
+                if record['status'] == 'ok':
+                    print(f"Processed {name} in {record['seconds']:.2f}s "
+                          f"({format_stages(record['stages'])}) - Result saved to {record['output']}")
+                else:
+                    print(f"Failed {name}: {record['error']}")
+    finally:
+        # Keep the progress of an interrupted run
+        if manifest_path is not None:
+            save_manifest(entries, manifest_path)
+    summary = summarize(records, time.perf_counter() - start, workers)
+
+    if summary_path is not None:
+        with open(summary_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def watch_directory(input_dir, output_dir, params=None, workers=None, interval=2.0,
+                    settle_seconds=1.0, manifest_path=None, prefix='cartoon_',
+                    comparison_writer=None, max_polls=None, verbose=True,
+                    threads_per_worker=None, output_format=None, quality=None, max_size=None):
+    """
+    Cartoonize new and modified images as they arrive in a directory.
+
+    The directory is polled every interval seconds and each poll runs an
+    incremental batch, so only files not yet processed with the current
+    parameters are cartoonized. Files modified less than settle_seconds ago
+    are left for a later poll, so partially copied files are not read. The
+    worker processes are started once and shared by every poll.
+
+    Args:
+        input_dir: Directory to watch
+        output_dir: Directory the results are written to
+        params: Keyword arguments for Cartoonizer.update_parameters
+        workers: Number of worker processes (defaults to the CPU count)
+        interval: Seconds between polls
+        settle_seconds: Minimum age of a file's last modification before it is processed
+        manifest_path: Path of the manifest (default: OUTPUT_DIR/manifest.json)
+        prefix: File name prefix of the cartoon outputs
+        comparison_writer: Optional callable writing a comparison image per result
+        max_polls: Stop after this many polls (None watches until interrupted)
+        verbose: Print one line per processed image
+        threads_per_worker: OpenCV threads of each worker process
+        output_format: Format of every output (None keeps the input format)
+        quality: Format-specific output quality, see iter_batch
+        max_size: Downscale the inputs to at most this many pixels per side
+
+    Returns:
+        Number of images processed successfully
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, 'manifest.json')
+    workers = workers or os.cpu_count() or 1
+    output = {'output_format': output_format, 'quality': quality, 'max_size': max_size}
+    # Workers run inline in the calling process when there is only one
+    pool = WorkerPool(workers, params, threads_per_worker, output) if workers > 1 else None
+    try:
+        processed = 0
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            now = time.time()
+            ready = []
+            for image_path in list_images(input_dir):
+                try:
+                    if now - os.stat(image_path).st_mtime >= settle_seconds:
+                        ready.append(image_path)
+                except OSError:
+                    # Deleted or renamed since the listing
+                    continue
+            if ready:
+                summary = process_batch(ready, output_dir, params, workers, prefix=prefix,
+                                        comparison_writer=comparison_writer, verbose=False,
+                                        manifest_path=manifest_path,
+                                        threads_per_worker=threads_per_worker,
+                                        output_format=output_format, quality=quality,
+                                        max_size=max_size, pool=pool)
+                processed += summary['succeeded']
+                if verbose:
+                    for record in summary['images']:
+                        name = os.path.basename(record['input'])
+                        if record['status'] == 'ok':
+                            print(f"Processed {name} in {record['seconds']:.2f}s - "
+                                  f"Result saved to {record['output']}")
+                        elif record['status'] == 'error':
+                            print(f"Failed {name}: {record['error']}")
+            polls += 1
+            if max_polls is None or polls < max_polls:
+                time.sleep(interval)
+        return processed
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def main(argv=None):
+    """Command line entry point for batch cartoonization."""
+    parser = argparse.ArgumentParser(description="Cartoonize a directory of images in parallel.")
+    parser.add_argument('input_dir', help="Directory containing the input images")
+    parser.add_argument('output_dir', help="Directory the results are written to")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help="Maximum number of images in flight (default: 2 x workers)")
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help="OpenCV threads of each worker (default: CPU count / workers)")
+    parser.add_argument('--params', default=None,
+                        help="JSON object of Cartoonizer parameters, e.g. '{\"total_color_levels\": 6}'")
+    parser.add_argument('--preset', default=None,
+                        help="Parameter preset file, e.g. from auto_tuner.py (--params override it)")
+    parser.add_argument('--summary', default=None,
+                        help="Path of the JSON summary (default: OUTPUT_DIR/summary.json)")
+    parser.add_argument('--format', default=None, choices=sorted(WRITE_FORMATS),
+                        help="Output format (default: the format of each input)")
+    parser.add_argument('--quality', type=int, default=None,
+                        help="Quality 0-100 for JPEG and WebP, compression level 0-9 for PNG")
+    parser.add_argument('--max-size', type=int, default=None,
+                        help="Downscale inputs to at most this many pixels per side, "
+                             "decoding JPEGs at reduced resolution")
+    parser.add_argument('--comparisons', action='store_true',
+                        help="Also write a side-by-side original/cartoon comparison per image")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Skip images already processed with the same content and parameters")
+    parser.add_argument('--manifest', default=None,
+                        help="Path of the incremental manifest (default: OUTPUT_DIR/manifest.json)")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep watching INPUT_DIR and cartoonize new or modified images")
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help="Seconds between directory polls in watch mode (default: 2)")
+    parser.add_argument('--palette', default=None,
+                        help="Palette file giving every output the same colors")
+    parser.add_argument('--fit-palette', default=None, metavar='PATH',
+                        help="Fit one palette for all input images, save it to PATH and use it")
+    parser.add_argument('--palette-images', type=int, default=None,
+                        help="Fit the shared palette on at most this many images")
+    args = parser.parse_args(argv)
+
+    params = load_preset(args.preset) if args.preset else {}
+    params.update(json.loads(args.params) if args.params else {})
+    if args.fit_palette:
+        palette = fit_batch_palette(list_images(args.input_dir), params, args.palette_images,
+                                    args.max_size)
+        save_palette(palette, args.fit_palette)
+        print(f"Fitted a {len(palette)}-color palette, saved to {args.fit_palette}")
+    palette_path = args.fit_palette or args.palette
+    if palette_path:
+        # Use the saved colors, so later runs with --palette match this one
+        params['palette'] = load_palette(palette_path)
+    comparison_writer = save_comparison if args.comparisons else None
+    manifest_path = args.manifest or os.path.join(args.output_dir, 'manifest.json')
+    if args.watch:
+        print(f"Watching {args.input_dir} (Ctrl+C to stop)")
+        try:
+            watch_directory(args.input_dir, args.output_dir, params, args.workers, args.interval,
+                            manifest_path=manifest_path, comparison_writer=comparison_writer,
+                            threads_per_worker=args.threads_per_worker, output_format=args.format,
+                            quality=args.quality, max_size=args.max_size)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    summary_path = args.summary or os.path.join(args.output_dir, 'summary.json')
+    summary = process_batch(list_images(args.input_dir), args.output_dir, params,
+                            args.workers, args.max_in_flight,
+                            comparison_writer=comparison_writer, summary_path=summary_path,
+                            manifest_path=manifest_path if args.incremental else None,
+                            threads_per_worker=args.threads_per_worker, output_format=args.format,
+                            quality=args.quality, max_size=args.max_size)
+
+    print(f"{summary['succeeded']}/{summary['total']} images processed, "
+          f"{summary['skipped']} up to date, {summary['failed']} failed, "
+          f"{summary['elapsed_seconds']:.1f}s "
+          f"({summary['images_per_second']:.2f} images/s, "
+          f"{summary['megapixels_per_second']:.2f} MP/s). Summary saved to {summary_path}")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Unix only; peak RSS is then reported as unavailable
+    resource = None
+
+import cv2
+import numpy as np
+from batch_processor import list_images
+from cartoonizer import Cartoonizer
+
+# Named configurations compared by default
+CONFIGS = {
+    'reference': {},
+    'sampled': {'quantization_mode': 'sampled'},
+    'median_cut': {'quantization_mode': 'median_cut'},
+    'octree': {'quantization_mode': 'octree'},
+    'iterative_smoothing': {'smoothing_engine': 'iterative'},
+    'layered_smoothing': {'smoothing_engine': 'layered'},
+    'multiscale': {'multiscale_megapixels': 1},
+    'tiled': {'tile_size': 1024},
+    'sequential_branches': {'concurrent_branches': False},
+    'reused_buffers': {'reuse_buffers': True},
+}
+
+# Configurations computing the reference output, only differently
+EXECUTION_CONFIGS = ('sequential_branches', 'reused_buffers')
+
+# Cartoonizer constructor options accepted in configurations next to its parameters
+CONSTRUCTOR_OPTIONS = ('reuse_buffers',)
+
+
+def synthetic_image(megapixels, seed=0):
+    """
+    Generate a deterministic test image of a given size.
+
+    The image combines smooth gradients, flat shapes with sharp borders and
+    mild noise, so every stage of the pipeline has realistic work to do.
+
+    Args:
+        megapixels: Approximate image size in megapixels (4:3 aspect ratio)
+        seed: Seed of the noise and shape placement
+
+    Returns:
+        uint8 BGR image
+    """
+    rng = np.random.default_rng(seed)
+    width = int(np.sqrt(megapixels * 1e6 * 4 / 3))
+    height = int(width * 3 / 4)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.empty((height, width, 3), np.uint8)
+    img[..., 0] = 255 * x / width
+    img[..., 1] = 255 * y / height
+    img[..., 2] = 128 + 127 * np.sin(x / width * 6.0) * np.cos(y / height * 4.0)
+    for _ in range(12):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        radius = int(rng.integers(min(width, height) // 20, min(width, height) // 5))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(img, center, radius, color, -1)
+    noise = rng.normal(0, 6, img.shape).astype(np.int16)
+    return np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def make_cartoonizer(params):
+    """
+    Create a Cartoonizer for a benchmark configuration, without caching.
+
+    Args:
+        params: Cartoonizer parameters, plus any of CONSTRUCTOR_OPTIONS
+
+    Returns:
+        Configured Cartoonizer
+    """
+    options = {name: params[name] for name in CONSTRUCTOR_OPTIONS if name in params}
+    cartoonizer = Cartoonizer(cache_bytes=0, palette_cache_entries=0, **options)
+    cartoonizer.update_parameters(**{name: value for name, value in params.items()
+                                     if name not in CONSTRUCTOR_OPTIONS})
+    return cartoonizer
+
+
+def benchmark_image(cartoonizer, img, repeat=1):
+    """
+    Time the pipeline on one image, in total and per stage.
+
+    The image goes through cartoonize, so every mode (multiscale, tiled,
+    concurrent branches, reused buffers) is measured as it runs, and stage
+    times come from the stage events. Stage times are summed per call (a
+    tiled call runs each stage once per tile) and the minimum over the
+    repeats is kept; the total is the wall time of the call, which is less
+    than the sum of the stages when branches run concurrently. Peak memory
+    is measured in a separate, untimed call, as the peak of allocations
+    traced by tracemalloc; it covers NumPy arrays and OpenCV outputs but not
+    OpenCV's internal scratch buffers.
+
+    Args:
+        cartoonizer: Configured Cartoonizer, preferably without caching
+        img: Input image
+        repeat: Number of timed runs
+
+    Returns:
+        Dictionary with per-stage seconds, total seconds, throughput and peak memory
+    """
+    # Memory pass, kept out of the timings because tracing slows allocations down
+    tracemalloc.start()
+    try:
+        cartoonizer.cartoonize(img)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    stages = {}
+    total = float('inf')
+    for _ in range(repeat):
+        with cartoonizer.instrument() as report:
+            start = time.perf_counter()
+            cartoonizer.cartoonize(img)
+            total = min(total, time.perf_counter() - start)
+        for stage, totals in report.per_stage().items():
+            stages[stage] = min(stages.get(stage, float('inf')), totals['seconds'])
+
+    megapixels = img.shape[0] * img.shape[1] / 1e6
+    return {
+        'stages': stages,
+        'total_seconds': total,
+        'megapixels_per_second': megapixels / total if total > 0 else 0.0,
+        'peak_traced_bytes': peak,
+    }
+
+
+def run_benchmarks(images, configs, repeat=1, verbose=True):
+    """
+    Benchmark every configuration on every image.
+
+    Args:
+        images: Iterable of (name, loader) pairs, where loader returns the image
+        configs: Dictionary mapping configuration names to Cartoonizer parameters
+            (see make_cartoonizer)
+        repeat: Number of runs per measurement
+        verbose: Print one line per measurement
+
+    Returns:
+        Dictionary with run metadata and a list of per-measurement results
+    """
+    results = []
+    for image_name, load in images:
+        img = load()
+        megapixels = img.shape[0] * img.shape[1] / 1e6
+        for config_name, params in configs.items():
+            result = benchmark_image(make_cartoonizer(params), img, repeat)
+            result.update(config=config_name, image=image_name, width=img.shape[1],
+                          height=img.shape[0], megapixels=megapixels, params=params)
+            results.append(result)
+            if verbose:
+                stage_times = ", ".join(f"{stage} {seconds:.3f}s"
+                                        for stage, seconds in result['stages'].items())
+                print(f"{image_name} ({megapixels:.1f} MP) [{config_name}]: "
+                      f"{result['total_seconds']:.3f}s, {result['megapixels_per_second']:.2f} MP/s "
+                      f"({stage_times})")
+        del img
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'opencv_threads': cv2.getNumThreads(),
+            'repeat': repeat,
+            'peak_rss_kb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                            if resource is not None else None),
+        },
+        'results': results,
+    }
+
+
+def compare_to_baseline(current, baseline, threshold=0.10):
+    """
+    Compare benchmark results against a baseline run.
+
+    Measurements are matched by configuration and image name.
+
+    Args:
+        current: Results of run_benchmarks
+        baseline: Results of an earlier run_benchmarks
+        threshold: Relative slowdown reported as a regression (0.10 = 10%)
+
+    Returns:
+        List of comparison dictionaries, one per matched measurement
+    """
+    previous = {(r['config'], r['image']): r for r in baseline['results']}
+    comparisons = []
+    for result in current['results']:
+        before = previous.get((result['config'], result['image']))
+        if before is None:
+            continue
+        ratio = result['total_seconds'] / before['total_seconds'] if before['total_seconds'] else 1.0
+        comparisons.append({
+            'config': result['config'],
+            'image': result['image'],
+            'baseline_seconds': before['total_seconds'],
+            'current_seconds': result['total_seconds'],
+            'ratio': ratio,
+            'stage_ratios': {stage: (result['stages'][stage] / before['stages'][stage]
+                                     if before['stages'].get(stage) else None)
+                             for stage in result['stages']},
+            'regression': ratio > 1.0 + threshold,
+        })
+    return comparisons
+
+
+def benchmark_inputs(dataset_dir=None, resolutions=(), max_megapixels=None):
+    """
+    List the benchmark inputs as lazily loaded images.
+
+    Args:
+        dataset_dir: Directory of real images to include, or None
+        resolutions: Sizes in megapixels of the synthetic images to include
+        max_megapixels: Skip dataset images larger than this
+
+    Returns:
+        List of (name, loader) pairs
+    """
+    inputs = []
+    if dataset_dir:
+        for path in list_images(dataset_dir):
+            img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            if img is None:
+                continue
+            # Reduced decoding gives the size cheaply; 8x per side is 64x in area
+            if max_megapixels is not None and img.size * 64 / 1e6 > max_megapixels * 1.1:
+                continue
+            inputs.append((os.path.basename(path), lambda path=path: cv2.imread(path)))
+    for megapixels in resolutions:
+        inputs.append((f"synthetic_{megapixels:g}MP",
+                       lambda megapixels=megapixels: synthetic_image(megapixels)))
+    return inputs
+
+
+def main(argv=None):
+    """Command line entry point for the benchmark suite."""
+    parser = argparse.ArgumentParser(description="Benchmark the cartoonization pipeline.")
+    parser.add_argument('--dataset', default='dataset',
+                        help="Directory of real images ('' to skip, default: dataset)")
+    parser.add_argument('--max-megapixels', type=float, default=None,
+                        help="Skip dataset images larger than this")
+    parser.add_argument('--resolutions', type=float, nargs='*', default=[0.25, 1, 4],
+                        help="Synthetic image sizes in megapixels (default: 0.25 1 4)")
+    parser.add_argument('--configs', nargs='*', default=list(CONFIGS),
+                        help=f"Configurations to compare (default: {' '.join(CONFIGS)})")
+    parser.add_argument('--config-file', default=None,
+                        help="JSON file mapping extra configuration names to parameters")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per measurement (minimum is kept)")
+    parser.add_argument('--output', default='benchmark.json', help="Results file (default: benchmark.json)")
+    parser.add_argument('--baseline', default=None, help="Earlier results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Relative slowdown reported as a regression (default: 0.10)")
+    args = parser.parse_args(argv)
+
+    available = dict(CONFIGS)
+    if args.config_file:
+        with open(args.config_file) as f:
+            available.update(json.load(f))
+    configs = {name: available[name] for name in args.configs}
+
+    inputs = benchmark_inputs(args.dataset, args.resolutions, args.max_megapixels)
+    report = run_benchmarks(inputs, configs, args.repeat)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['comparison'] = compare_to_baseline(report, baseline, args.threshold)
+        for comparison in report['comparison']:
+            marker = "REGRESSION" if comparison['regression'] else "ok"
+            print(f"{comparison['image']} [{comparison['config']}]: {comparison['baseline_seconds']:.3f}s -> "
+                  f"{comparison['current_seconds']:.3f}s (x{comparison['ratio']:.2f}) {marker}")
+        if any(c['regression'] for c in report['comparison']):
+            status = 1
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to {args.output}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,15 @@ import cv2
 import numpy as np
 from PIL import Image, ImageTk
 import os
-from cartoonizer import Cartoonizer
+import queue
+import threading
+from cartoonizer import Cartoonizer, scale_parameters
+from image_io import read_image, read_reduced, write_image
+from viewport import DisplayPyramid, Viewport
+
+
+class RenderCancelled(Exception):
+    """Raised inside the render worker when a newer render has been requested."""
 
 class CartoonGUI:
     """
@@ -32,9 +40,24 @@ class CartoonGUI:
         # Initialize variables
         self.original_image = None
         self.cartoon_image = None
+        self.preview_image = None
+        self.preview_scale = 1.0
+        self.cartoon_generation = None
         self.current_image_path = None
         self.tk_original = None
         self.tk_cartoon = None
+        self.last_timing = ""
+        
+        # Zoomable view shared by both panes: each pane keeps a display pyramid of
+        # its image and the key of the view it last drew, so it is only redrawn
+        # when its image or the view changes
+        self.image_size = None
+        self.viewport = Viewport()
+        self.original_pyramid = None
+        self.cartoon_pyramid = None
+        self.drawn_views = {}
+        self.redraw_id = None
+        self.drag_position = None
         
         # Create main frames
         self.create_frames()
@@ -52,6 +75,26 @@ class CartoonGUI:
                                   bg="#34495e", fg="white")
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
         
+        # Background rendering: slider changes are debounced, rendered on a
+        # worker thread and only the result of the latest request is shown
+        self.debounce_ms = 150
+        self.debounce_id = None
+        
+        # Progressive rendering: a display-sized preview is rendered first and
+        # the full-resolution render only once the sliders rest for a while
+        self.full_render_delay_ms = 700
+        self.full_render_id = None
+        self.render_generation = 0
+        self.pending_job = None
+        # Path a requested save is written to once a full-resolution render of the
+        # current parameters is ready, whichever generation that render belongs to
+        self.pending_save_path = None
+        self.render_condition = threading.Condition()
+        self.render_results = queue.Queue()
+        self.render_thread = threading.Thread(target=self.render_worker, daemon=True)
+        self.render_thread.start()
+        self.root.after(50, self.poll_render_results)
+        
     def create_frames(self):
         """Create the main frames for the GUI."""
         # Top frame for menu and buttons
@@ -125,6 +168,16 @@ class CartoonGUI:
                                        highlightthickness=0)
         self.cartoon_canvas.pack(fill=tk.BOTH, expand=True)
         
+        # Zoom with the mouse wheel, pan by dragging, double-click to fit
+        for canvas in (self.original_canvas, self.cartoon_canvas):
+            canvas.bind("<Configure>", lambda event: self.schedule_redraw())
+            canvas.bind("<ButtonPress-1>", self.start_drag)
+            canvas.bind("<B1-Motion>", self.drag)
+            canvas.bind("<Double-Button-1>", self.fit_view)
+            canvas.bind("<MouseWheel>", self.zoom_view)
+            canvas.bind("<Button-4>", self.zoom_view)
+            canvas.bind("<Button-5>", self.zoom_view)
+        
     def create_controls(self):
         """Create the control panel with sliders."""
         # Create a frame for each row of controls
@@ -217,11 +270,24 @@ class CartoonGUI:
             filetypes=[("Image files", "*.jpg *.jpeg *.png *.bmp *.gif")])
         
         if file_path:
+            # Decode a display-sized copy for fast previews, at reduced resolution for
+            # large JPEGs; the render worker decodes the full image when it is needed
+            image, factor = read_reduced(file_path, (500, 400))
+            if image is None:
+                self.status_var.set(f"Could not open {os.path.basename(file_path)}")
+                return
             self.current_image_path = file_path
+            self.pending_save_path = None
             self.status_var.set(f"Opened: {os.path.basename(file_path)}")
-            
-            # Load the image
-            self.original_image = cv2.imread(file_path)
+            self.original_image = image if factor == 1 else None
+            self.preview_image, self.preview_scale = self.make_preview(image)
+            self.preview_scale /= factor
+            self.cartoon_image = None
+            self.cartoon_generation = None
+            self.image_size = (round(self.preview_image.shape[1] / self.preview_scale),
+                               round(self.preview_image.shape[0] / self.preview_scale))
+            self.viewport.fitted = True
+            self.cartoon_pyramid = None
             
             # Display the original image
             self.display_original()
@@ -230,49 +296,254 @@ class CartoonGUI:
             self.process_cartoon()
             
     def display_original(self):
-        """Display the original image on the canvas."""
+        """Display the original image, at full resolution once it has been decoded."""
         if self.original_image is not None:
-            # Convert from BGR to RGB
-            img_rgb = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2RGB)
+            self.original_pyramid = DisplayPyramid(self.original_image)
+        elif self.preview_image is not None:
+            self.original_pyramid = DisplayPyramid(self.preview_image, self.preview_scale)
+        self.schedule_redraw()
             
-            # Resize to fit the canvas
-            img_resized = self.resize_image(img_rgb)
+    def make_preview(self, img):
+        """
+        Create the display-sized copy used for interactive previews.
+        
+        Args:
+            img: Full-resolution image
             
-            # Convert to PhotoImage
-            self.tk_original = ImageTk.PhotoImage(image=Image.fromarray(img_resized))
+        Returns:
+            Tuple (preview, scale) with the preview image and its scale factor
+        """
+        height, width = img.shape[:2]
+        if min(500 / width, 400 / height) >= 1:
+            return img, 1.0
+        preview = self.resize_image(img)
+        return preview, preview.shape[1] / width
+        
+    def process_cartoon(self):
+        """Request cartoonization of the image; the result is displayed when ready."""
+        if self.preview_image is not None:
+            if self.debounce_id is not None:
+                self.root.after_cancel(self.debounce_id)
+                self.debounce_id = None
+            if self.full_render_id is not None:
+                self.root.after_cancel(self.full_render_id)
+                self.full_render_id = None
             
-            # Update canvas
-            self.original_canvas.config(width=self.tk_original.width(), height=self.tk_original.height())
-            self.original_canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_original)
+            # Supersede any render that is queued or running, then preview first
+            self.render_generation += 1
+            self.submit_render('preview')
             
-    def process_cartoon(self):
-        """Process the image with cartoonization and display it."""
-        if self.original_image is not None:
-            # Update cartoonizer parameters
-            self.update_cartoonizer_params()
+            self.status_var.set("Processing...")
             
-            # Apply cartoonization
-            self.cartoon_image = self.cartoonizer.cartoonize(self.original_image)
+    def submit_render(self, kind):
+        """
+        Queue a render of the current parameters for the worker thread.
+        
+        Args:
+            kind: 'preview' to render the display-sized copy with scaled
+                parameters, or 'full' to render the original image
+        """
+        params = self.get_slider_params()
+        if kind == 'preview':
+            image = self.preview_image
+            params = scale_parameters(params, self.preview_scale)
+        elif self.original_image is not None:
+            image = self.original_image
+        else:
+            # Not decoded yet: the worker loads it from the path
+            image = self.current_image_path
+        
+        job = (self.render_generation, kind, image, params)
+        with self.render_condition:
+            self.pending_job = job
+            self.render_condition.notify()
             
-            # Display the cartoon image
-            self.display_cartoon()
+    def render_full(self):
+        """Render the full-resolution cartoon in the background."""
+        self.full_render_id = None
+        self.submit_render('full')
+        
+    def render_worker(self):
+        """Render requested jobs on the worker thread, skipping superseded ones."""
+        while True:
+            with self.render_condition:
+                while self.pending_job is None:
+                    self.render_condition.wait()
+                generation, kind, image, params = self.pending_job
+                self.pending_job = None
             
-    def display_cartoon(self):
-        """Display the cartoon image on the canvas."""
-        if self.cartoon_image is not None:
-            # Convert from BGR to RGB
-            img_rgb = cv2.cvtColor(self.cartoon_image, cv2.COLOR_BGR2RGB)
+            cartoonizer = self.cartoonizer
             
-            # Resize to fit the canvas
-            img_resized = self.resize_image(img_rgb)
+            def cancel_if_stale(event):
+                # Called after every stage; completed stages stay in the stage cache.
+                # cartoonize waits for its edge branch before the exception leaves
+                # it, so the next job's parameter update cannot race with the branch
+                if generation != self.render_generation:
+                    raise RenderCancelled()
             
-            # Convert to PhotoImage
-            self.tk_cartoon = ImageTk.PhotoImage(image=Image.fromarray(img_resized))
+            try:
+                if isinstance(image, str):
+                    image = self.load_original(image)
+                cartoonizer.update_parameters(**params)
+                cartoonizer.add_observer(cancel_if_stale)
+                try:
+                    with cartoonizer.instrument() as report:
+                        cartoon = cartoonizer.cartoonize(image)
+                finally:
+                    cartoonizer.remove_observer(cancel_if_stale)
+                self.render_results.put((generation, kind, cartoon, report.format()))
+            except RenderCancelled:
+                continue
+            except Exception as exc:
+                self.render_results.put((generation, kind, None, f"Error: {exc}"))
             
-            # Update canvas
-            self.cartoon_canvas.config(width=self.tk_cartoon.width(), height=self.tk_cartoon.height())
-            self.cartoon_canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_cartoon)
+    def load_original(self, file_path):
+        """
+        Decode the full-resolution image; runs on the render worker thread.
+        
+        Args:
+            file_path: Path of the image
             
+        Returns:
+            Full-resolution image
+        """
+        image = read_image(file_path)
+        if image is None:
+            raise IOError(f"could not read {os.path.basename(file_path)}")
+        if file_path == self.current_image_path:
+            self.original_image = image
+        return image
+        
+    def poll_render_results(self):
+        """Display the latest finished render; runs periodically on the Tk main thread."""
+        latest = None
+        while True:
+            try:
+                result = self.render_results.get_nowait()
+            except queue.Empty:
+                break
+            if result[0] == self.render_generation:
+                latest = result
+        
+        if latest is not None:
+            generation, kind, cartoon, timing = latest
+            if cartoon is None:
+                if self.pending_save_path is not None:
+                    timing += f" ({os.path.basename(self.pending_save_path)} not saved)"
+                    self.pending_save_path = None
+                self.status_var.set(timing)
+            elif kind == 'preview' and self.preview_scale < 1:
+                self.display_cartoon(cartoon)
+                self.status_var.set(f"Preview ready - {timing}")
+                # Render full resolution once the sliders have rested
+                self.full_render_id = self.root.after(self.full_render_delay_ms, self.render_full)
+            else:
+                self.cartoon_image = cartoon
+                self.cartoon_generation = generation
+                self.last_timing = timing
+                self.display_cartoon()
+                if self.original_image is not None and self.original_pyramid.scale < 1:
+                    # The full-resolution original has been decoded for this render
+                    self.display_original()
+                self.status_var.set(f"Ready - {timing}")
+                if self.pending_save_path is not None:
+                    file_path, self.pending_save_path = self.pending_save_path, None
+                    self.write_cartoon(file_path)
+        
+        self.root.after(50, self.poll_render_results)
+        
+    def display_cartoon(self, image=None):
+        """
+        Display the cartoon image on the canvas.
+        
+        Args:
+            image: Preview to show instead of the full-resolution cartoon
+        """
+        if image is not None:
+            self.cartoon_pyramid = DisplayPyramid(image, self.preview_scale)
+        elif self.cartoon_image is not None:
+            self.cartoon_pyramid = DisplayPyramid(self.cartoon_image)
+        self.schedule_redraw()
+        
+    def schedule_redraw(self):
+        """Redraw the panes once the pending events have been handled."""
+        if self.redraw_id is None:
+            self.redraw_id = self.root.after_idle(self.redraw)
+            
+    def redraw(self):
+        """Draw the visible region of both panes at the current zoom."""
+        self.redraw_id = None
+        if self.image_size is None:
+            return
+        view_size = self.view_size()
+        if self.viewport.fitted:
+            self.viewport.fit(self.image_size, view_size)
+        self.tk_original = self.draw_pane(self.original_canvas, self.original_pyramid,
+                                          view_size, self.tk_original)
+        self.tk_cartoon = self.draw_pane(self.cartoon_canvas, self.cartoon_pyramid,
+                                         view_size, self.tk_cartoon)
+        
+    def draw_pane(self, canvas, pyramid, view_size, photo):
+        """
+        Draw a pane unless it already shows this image and view.
+        
+        Args:
+            canvas: Canvas of the pane
+            pyramid: DisplayPyramid of the pane's image, or None
+            view_size: Tuple (width, height) of the view
+            photo: PhotoImage currently shown by the pane
+            
+        Returns:
+            PhotoImage shown by the pane (kept referenced so Tk keeps displaying it)
+        """
+        left, top = self.viewport.origin(view_size)
+        key = (pyramid, self.viewport.zoom, left, top, view_size)
+        if self.drawn_views.get(canvas) == key:
+            return photo
+        self.drawn_views[canvas] = key
+        canvas.delete("all")
+        if pyramid is None:
+            return None
+        rgb = pyramid.render(self.viewport.zoom, left, top, view_size[0], view_size[1],
+                             background=(44, 62, 80))
+        photo = ImageTk.PhotoImage(image=Image.fromarray(rgb))
+        canvas.create_image(0, 0, anchor=tk.NW, image=photo)
+        return photo
+        
+    def view_size(self):
+        """Size of the image panes in pixels (both panes have the same size)."""
+        width = self.original_canvas.winfo_width()
+        height = self.original_canvas.winfo_height()
+        # Before the window is mapped, Tk reports a 1x1 canvas
+        return (width, height) if width > 1 and height > 1 else (500, 400)
+        
+    def start_drag(self, event):
+        """Remember where a pan drag started."""
+        self.drag_position = (event.x, event.y)
+        
+    def drag(self, event):
+        """Pan both panes with the mouse."""
+        if self.image_size is None or self.drag_position is None:
+            return
+        dx, dy = event.x - self.drag_position[0], event.y - self.drag_position[1]
+        self.drag_position = (event.x, event.y)
+        self.viewport.pan(dx, dy, self.image_size)
+        self.schedule_redraw()
+        
+    def zoom_view(self, event):
+        """Zoom both panes around the mouse pointer with the mouse wheel."""
+        if self.image_size is None:
+            return
+        zoom_in = event.num == 4 or getattr(event, 'delta', 0) > 0
+        self.viewport.zoom_at(1.25 if zoom_in else 0.8, event.x, event.y,
+                              self.image_size, self.view_size())
+        self.schedule_redraw()
+        
+    def fit_view(self, event=None):
+        """Fit the whole image in the panes again."""
+        self.viewport.fitted = True
+        self.schedule_redraw()
+        
     def resize_image(self, img, max_width=500, max_height=400):
         """
         Resize the image to fit within the specified dimensions while maintaining aspect ratio.
@@ -297,9 +568,9 @@ class CartoonGUI:
         
         return resized
     
-    def update_cartoonizer_params(self):
-        """Update the cartoonizer parameters from the sliders."""
-        self.cartoonizer.update_parameters(
+    def get_slider_params(self):
+        """Read the cartoonizer parameters from the sliders."""
+        return dict(
             line_size=self.line_size_var.get(),
             bilateral_filter_d=self.bilateral_d_var.get(),
             bilateral_sigma_color=self.bilateral_color_var.get(),
@@ -311,18 +582,15 @@ class CartoonGUI:
         
     def update_cartoon(self, event=None):
         """Update the cartoon image when sliders are adjusted."""
-        if self.original_image is not None:
-            self.status_var.set("Processing...")
-            self.root.update_idletasks()  # Update the GUI
-            
-            # Process and display the cartoon image
-            self.process_cartoon()
-            
-            self.status_var.set("Ready")
+        if self.preview_image is not None:
+            # Wait until the slider has been still for debounce_ms before rendering
+            if self.debounce_id is not None:
+                self.root.after_cancel(self.debounce_id)
+            self.debounce_id = self.root.after(self.debounce_ms, self.process_cartoon)
             
     def save_cartoon(self):
-        """Save the cartoon image to a file."""
-        if self.cartoon_image is not None:
+        """Save the full-resolution cartoon image to a file."""
+        if self.preview_image is not None:
             # Get the file path
             file_path = filedialog.asksaveasfilename(
                 defaultextension=".jpg",
@@ -330,10 +598,27 @@ class CartoonGUI:
                           ("All files", "*.*")])
             
             if file_path:
-                # Save the image
-                cv2.imwrite(file_path, self.cartoon_image)
-                self.status_var.set(f"Saved: {os.path.basename(file_path)}")
+                if self.cartoon_generation == self.render_generation:
+                    self.write_cartoon(file_path)
+                else:
+                    # Only a preview is available: render full resolution, then save.
+                    # If the sliders move meanwhile, the next full render is saved
+                    if self.full_render_id is not None:
+                        self.root.after_cancel(self.full_render_id)
+                        self.full_render_id = None
+                    self.pending_save_path = file_path
+                    self.submit_render('full')
+                    self.status_var.set("Rendering full resolution for saving...")
                 
+    def write_cartoon(self, file_path):
+        """Write the full-resolution cartoon image to a file."""
+        try:
+            write_image(file_path, self.cartoon_image)
+        except IOError as exc:
+            self.status_var.set(f"Error: {exc}")
+            return
+        self.status_var.set(f"Saved: {os.path.basename(file_path)}")
+        
     def reset_parameters(self):
         """Reset all parameters to default values."""
         # Reset cartoonizer
@@ -349,7 +634,7 @@ class CartoonGUI:
         self.color_levels_var.set(self.cartoonizer.total_color_levels)
         
         # Update the cartoon image
-        if self.original_image is not None:
+        if self.preview_image is not None:
             self.process_cartoon()
             
         self.status_var.set("Parameters reset to default values")
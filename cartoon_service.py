@@ -0,0 +1,594 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import cv2
+import numpy as np
+from cartoonizer import Cartoonizer
+from image_io import encoded_image_size
+from smoothing import SMOOTHING_ENGINES
+
+# Output formats accepted in the 'format' query parameter
+OUTPUT_FORMATS = {'png': ('.png', 'image/png'), 'jpg': ('.jpg', 'image/jpeg'),
+                  'jpeg': ('.jpg', 'image/jpeg'), 'webp': ('.webp', 'image/webp')}
+
+# Accepted ranges of the numeric parameters a request may set. The knobs that
+# multiply the processing time (filter diameter, K-means restarts, histogram
+# size) are capped so that a single request cannot hold a worker for minutes.
+INTEGER_PARAMETERS = {
+    'line_size': (1, 31), 'blur_value': (1, 31), 'bilateral_filter_d': (1, 15),
+    'total_color_levels': (2, 64), 'sample_size': (1, 1000000), 'kmeans_attempts': (1, 10),
+    'random_seed': (0, 2 ** 32 - 1), 'histogram_bits': (2, 6), 'tile_size': (64, 16384),
+    'tile_halo': (0, 256),
+}
+NUMBER_PARAMETERS = {
+    'bilateral_sigma_color': (0, 500), 'bilateral_sigma_space': (0, 200),
+    'edge_threshold1': (0, 1000), 'edge_threshold2': (0, 1000), 'multiscale_megapixels': (0.01, 50),
+}
+CHOICE_PARAMETERS = {
+    'quantization_mode': ('full', 'sampled', 'median_cut', 'octree'),
+    'sample_method': ('random', 'stratified'),
+    'smoothing_engine': SMOOTHING_ENGINES,
+}
+MAX_PALETTE_COLORS = 64
+
+# Marks the end of the job queue for a worker
+_STOP = object()
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the service queue is full."""
+
+
+class ServiceUnavailableError(Exception):
+    """Raised when a job is submitted to a service that is not running."""
+
+
+class RequestError(ValueError):
+    """Raised for invalid requests, such as unknown parameters or undecodable images."""
+
+
+class ServiceMetrics:
+    """
+    Thread-safe request counters and latency statistics of the service.
+
+    Latency percentiles are computed over the most recent requests only, so
+    they follow the current load rather than the whole lifetime.
+    """
+
+    def __init__(self, window=1000):
+        """
+        Initialize empty metrics.
+
+        Args:
+            window: Number of recent requests kept for latency percentiles
+        """
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counts = {'accepted': 0, 'completed': 0, 'failed': 0, 'bad_requests': 0,
+                       'rejected_full': 0, 'rejected_unavailable': 0, 'timed_out': 0}
+        self.latencies = deque(maxlen=window)
+        self.queue_waits = deque(maxlen=window)
+        self.completion_times = deque(maxlen=window)
+        self.megapixels = 0.0
+
+    def count(self, name):
+        """Increment a counter."""
+        with self.lock:
+            self.counts[name] += 1
+
+    def record(self, latency, queue_wait, megapixels):
+        """Record a completed request."""
+        with self.lock:
+            self.counts['completed'] += 1
+            self.latencies.append(latency)
+            self.queue_waits.append(queue_wait)
+            self.completion_times.append(time.time())
+            self.megapixels += megapixels
+
+    def snapshot(self, queue_depth, in_flight):
+        """
+        Summarize the metrics.
+
+        Args:
+            queue_depth: Number of jobs waiting in the queue
+            in_flight: Number of jobs being processed
+
+        Returns:
+            JSON-serializable dictionary of counters, latency percentiles and throughput
+        """
+        with self.lock:
+            now = time.time()
+            uptime = now - self.started
+            latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+            waits = np.array(self.queue_waits) if self.queue_waits else np.zeros(1)
+            recent = [t for t in self.completion_times if now - t <= 60.0]
+            return {
+                'uptime_seconds': uptime,
+                'queue_depth': queue_depth,
+                'in_flight': in_flight,
+                'requests': dict(self.counts),
+                'latency_seconds': {
+                    'p50': float(np.percentile(latencies, 50)),
+                    'p95': float(np.percentile(latencies, 95)),
+                    'p99': float(np.percentile(latencies, 99)),
+                    'max': float(latencies.max()),
+                },
+                'queue_wait_seconds': {
+                    'p50': float(np.percentile(waits, 50)),
+                    'p95': float(np.percentile(waits, 95)),
+                },
+                'throughput': {
+                    'requests_per_second': self.counts['completed'] / uptime if uptime > 0 else 0.0,
+                    'requests_last_minute': len(recent),
+                    'megapixels_per_second': self.megapixels / uptime if uptime > 0 else 0.0,
+                },
+            }
+
+
+def parse_parameters(query, allowed):
+    """
+    Parse Cartoonizer parameters from URL query pairs.
+
+    Values are read as JSON literals where possible (so '6' is an integer and
+    'null' is None) and as plain strings otherwise.
+
+    Args:
+        query: List of (name, value) pairs
+        allowed: Names of the accepted parameters
+
+    Returns:
+        Dictionary of parameters
+
+    Raises:
+        RequestError: If a parameter is not accepted or its value is invalid
+    """
+    params = {}
+    for name, value in query:
+        if name not in allowed:
+            raise RequestError(f"unknown parameter: {name}")
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    check_parameters(params)
+    return params
+
+
+def check_parameters(params):
+    """
+    Check the types and ranges of request parameters.
+
+    None is accepted for every parameter and keeps the service default.
+
+    Args:
+        params: Dictionary of Cartoonizer parameters
+
+    Raises:
+        RequestError: If a value has the wrong type or is out of range
+    """
+    for name, value in params.items():
+        if value is None:
+            continue
+        if name in INTEGER_PARAMETERS:
+            low, high = INTEGER_PARAMETERS[name]
+            if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+                raise RequestError(f"{name} must be an integer from {low} to {high}")
+            if name == 'line_size' and value % 2 == 0:
+                raise RequestError("line_size must be odd")
+        elif name in NUMBER_PARAMETERS:
+            low, high = NUMBER_PARAMETERS[name]
+            if (not isinstance(value, (int, float)) or isinstance(value, bool)
+                    or not low <= value <= high):
+                raise RequestError(f"{name} must be a number from {low:g} to {high:g}")
+        elif name in CHOICE_PARAMETERS:
+            if value not in CHOICE_PARAMETERS[name]:
+                raise RequestError(f"{name} must be one of {', '.join(CHOICE_PARAMETERS[name])}")
+        elif name == 'concurrent_branches':
+            if not isinstance(value, bool):
+                raise RequestError("concurrent_branches must be true or false")
+        elif name == 'palette':
+            if (not isinstance(value, list) or not 1 <= len(value) <= MAX_PALETTE_COLORS
+                    or not all(isinstance(color, list) and len(color) == 3
+                               and all(isinstance(c, (int, float)) and not isinstance(c, bool)
+                                       and 0 <= c <= 255 for c in color)
+                               for color in value)):
+                raise RequestError(f"palette must be a list of 1 to {MAX_PALETTE_COLORS} "
+                                   f"[b, g, r] colors with values from 0 to 255")
+
+
+class CartoonService:
+    """
+    A pool of worker threads cartoonizing submitted images from a bounded queue.
+
+    Every job gets its own Cartoonizer configured from the base parameters
+    and the job's parameters, so concurrent requests never share mutable
+    state. When the queue is full, submit fails immediately instead of
+    buffering more uploads in memory, and images whose header exceeds the
+    size limit are rejected before they are decoded.
+    """
+
+    def __init__(self, workers=2, queue_size=8, base_params=None, max_megapixels=50.0):
+        """
+        Initialize the service.
+
+        Args:
+            workers: Number of worker threads
+            queue_size: Maximum number of jobs waiting for a worker
+            base_params: Parameters applied to every job before its own
+            max_megapixels: Largest accepted image size
+        """
+        self.workers = workers
+        self.base_params = dict(base_params or {})
+        self.max_megapixels = max_megapixels
+        # The OpenCV thread count is process-wide, so requests may not change it
+        self.allowed_params = set(Cartoonizer(cache_bytes=0).get_parameters()) - {'num_threads'}
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.metrics = ServiceMetrics()
+        self.threads = []
+        self.running = False
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads."""
+        self.running = True
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Stop accepting jobs, cancel the queued ones and wait for the workers."""
+        self.running = False
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not _STOP:
+                job[0].cancel()
+        for _ in self.threads:
+            self.jobs.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def check_capacity(self):
+        """
+        Check that a job submitted now would be queued, e.g. before reading an upload.
+
+        Raises:
+            QueueFullError: If the queue is full
+            ServiceUnavailableError: If the service is not running
+        """
+        if not self.running:
+            raise ServiceUnavailableError("service is not running")
+        if self.jobs.full():
+            raise QueueFullError("queue is full")
+
+    def check_image_size(self, width, height):
+        """
+        Check an image size against the megapixel limit.
+
+        Raises:
+            RequestError: If the image is too large
+        """
+        megapixels = width * height / 1e6
+        if megapixels > self.max_megapixels:
+            raise RequestError(f"image too large ({megapixels:.1f} MP, limit {self.max_megapixels:g} MP)")
+
+    def submit(self, data, params=None, output_format='png'):
+        """
+        Queue an encoded image for cartoonization.
+
+        Args:
+            data: Encoded image bytes
+            params: Cartoonizer parameters of this job
+            output_format: Key of OUTPUT_FORMATS
+
+        Returns:
+            Future resolving to a tuple (encoded cartoon bytes, input megapixels)
+
+        Raises:
+            QueueFullError: If the queue is full
+            ServiceUnavailableError: If the service is not running
+            RequestError: If the image header shows an image over the size limit
+        """
+        if not self.running:
+            raise ServiceUnavailableError("service is not running")
+        # JPEG, PNG and WebP sizes are known before decoding; other formats are checked after
+        size = encoded_image_size(data)
+        if size is not None:
+            self.check_image_size(*size)
+        future = Future()
+        try:
+            self.jobs.put_nowait((future, data, dict(params or {}), output_format, time.perf_counter()))
+        except queue.Full:
+            raise QueueFullError("queue is full") from None
+        return future
+
+    def _work(self):
+        """Worker loop: process jobs until the stop marker."""
+        while True:
+            job = self.jobs.get()
+            if job is _STOP:
+                return
+            future, data, params, output_format, queued = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            future.queue_wait = time.perf_counter() - queued
+            with self.lock:
+                self.in_flight += 1
+            try:
+                future.set_result(self._cartoonize(data, params, output_format))
+            except Exception as exc:
+                future.set_exception(exc)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+
+    def _cartoonize(self, data, params, output_format):
+        """Decode, cartoonize and encode one image with its own Cartoonizer."""
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise RequestError("could not decode image")
+        self.check_image_size(img.shape[1], img.shape[0])
+        megapixels = img.shape[0] * img.shape[1] / 1e6
+
+        cartoonizer = Cartoonizer(cache_bytes=0)
+        cartoonizer.update_parameters(**self.base_params)
+        cartoonizer.update_parameters(**params)
+        cartoon = cartoonizer.cartoonize(img)
+
+        extension, _ = OUTPUT_FORMATS[output_format]
+        ok, encoded = cv2.imencode(extension, cartoon)
+        if not ok:
+            raise IOError(f"could not encode {output_format}")
+        return encoded.tobytes(), megapixels
+
+    def snapshot(self):
+        """Current metrics, see ServiceMetrics.snapshot."""
+        with self.lock:
+            in_flight = self.in_flight
+        return self.metrics.snapshot(self.jobs.qsize(), in_flight)
+
+
+class CartoonRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP front end of a CartoonService.
+
+    POST /cartoonize with the image as the request body; Cartoonizer
+    parameters and the output format ('format', default png) go in the query
+    string, e.g. /cartoonize?total_color_levels=6&format=jpg.
+    GET /metrics returns the service metrics as JSON and GET /health reports
+    whether the service accepts jobs.
+    """
+
+    # Set by make_server
+    service = None
+    max_upload_bytes = 32 * 1024 * 1024
+    request_timeout = 60.0
+    processing_timeout = 120.0
+    retry_after = 1
+    # Socket timeout, so a stalled client cannot hold a connection thread
+    timeout = 30.0
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self._send_json(200, self.service.snapshot())
+        elif path == '/health':
+            running = self.service.running
+            self._send_json(200 if running else 503, {'status': 'ok' if running else 'stopping'})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        if url.path != '/cartoonize':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0:
+            self.service.metrics.count('bad_requests')
+            self._send_json(400, {'error': 'empty request body'})
+            return
+        if length > self.max_upload_bytes:
+            self.service.metrics.count('bad_requests')
+            self.close_connection = True
+            self._send_json(413, {'error': f"upload larger than {self.max_upload_bytes} bytes"})
+            return
+
+        query = parse_qsl(url.query)
+        output_format = dict(query).get('format', 'png').lower()
+        query = [(name, value) for name, value in query if name != 'format']
+        try:
+            if output_format not in OUTPUT_FORMATS:
+                raise RequestError(f"unsupported format: {output_format}")
+            params = parse_parameters(query, self.service.allowed_params)
+        except RequestError as exc:
+            self.service.metrics.count('bad_requests')
+            self._send_json(400, {'error': str(exc)})
+            return
+
+        try:
+            # Reject before reading the upload, so a full service does not buffer it
+            self.service.check_capacity()
+            data = self.rfile.read(length)
+            future = self.service.submit(data, params, output_format)
+        except QueueFullError as exc:
+            self.service.metrics.count('rejected_full')
+            self.close_connection = True
+            self._send_json(429, {'error': str(exc)}, retry=True)
+            return
+        except ServiceUnavailableError as exc:
+            self.service.metrics.count('rejected_unavailable')
+            self.close_connection = True
+            self._send_json(503, {'error': str(exc)}, retry=True)
+            return
+        except RequestError as exc:
+            self.service.metrics.count('bad_requests')
+            self._send_json(400, {'error': str(exc)})
+            return
+        self.service.metrics.count('accepted')
+
+        try:
+            try:
+                encoded, megapixels = future.result(timeout=self.request_timeout)
+            except FutureTimeoutError:
+                if future.cancel():
+                    # Never started: give up rather than hold the connection any longer
+                    self.service.metrics.count('timed_out')
+                    self._send_json(503, {'error': 'timed out waiting for a worker'}, retry=True)
+                    return
+                # Running jobs cannot be interrupted; wait a bounded time for them to finish
+                encoded, megapixels = future.result(timeout=self.processing_timeout)
+        except FutureTimeoutError:
+            self.service.metrics.count('timed_out')
+            self._send_json(504, {'error': 'timed out processing the image'})
+            return
+        except CancelledError:
+            self.service.metrics.count('rejected_unavailable')
+            self._send_json(503, {'error': 'service is stopping'}, retry=True)
+            return
+        except RequestError as exc:
+            self.service.metrics.count('bad_requests')
+            self._send_json(400, {'error': str(exc)})
+            return
+        except Exception as exc:
+            self.service.metrics.count('failed')
+            self._send_json(500, {'error': f"{type(exc).__name__}: {exc}"})
+            return
+
+        latency = time.perf_counter() - start
+        self.service.metrics.record(latency, future.queue_wait, megapixels)
+        self.send_response(200)
+        self.send_header('Content-Type', OUTPUT_FORMATS[output_format][1])
+        self.send_header('Content-Length', str(len(encoded)))
+        self.send_header('X-Processing-Seconds', f"{latency:.3f}")
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _send_json(self, status, payload, retry=False):
+        body = json.dumps(payload, indent=2).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if retry:
+            self.send_header('Retry-After', str(self.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests are reported through /metrics rather than one log line each
+        pass
+
+
+class BoundedThreadingHTTPServer(ThreadingHTTPServer):
+    """
+    A ThreadingHTTPServer handling at most max_connections connections at once.
+
+    Further connections wait in the listen backlog until a handler thread
+    finishes, so the number of threads, and of uploads held in memory, stays
+    bounded under load.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, max_connections=16):
+        self.slots = threading.BoundedSemaphore(max_connections)
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+
+def make_server(service, host='127.0.0.1', port=8080, max_upload_bytes=32 * 1024 * 1024,
+                request_timeout=60.0, processing_timeout=120.0, max_connections=None):
+    """
+    Create an HTTP server in front of a service.
+
+    Args:
+        service: Started CartoonService
+        host: Interface to listen on
+        port: Port to listen on (0 picks a free port)
+        max_upload_bytes: Largest accepted request body
+        request_timeout: Seconds a request may wait for a worker before a 503
+        processing_timeout: Seconds a request waits for a started job before a 504
+        max_connections: Connections handled at once (default: enough for every
+            worker and queue slot, plus a few for metrics and rejections)
+
+    Returns:
+        BoundedThreadingHTTPServer; call serve_forever() to run it
+    """
+    if max_connections is None:
+        max_connections = service.workers + service.jobs.maxsize + 4
+    handler = type('BoundCartoonRequestHandler', (CartoonRequestHandler,),
+                   {'service': service, 'max_upload_bytes': max_upload_bytes,
+                    'request_timeout': request_timeout, 'processing_timeout': processing_timeout})
+    return BoundedThreadingHTTPServer((host, port), handler, max_connections)
+
+
+def main(argv=None):
+    """Command line entry point for the cartoonization service."""
+    parser = argparse.ArgumentParser(description="Serve cartoonization over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument('--workers', type=int, default=2, help="Number of worker threads (default: 2)")
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help="Jobs waiting for a worker before requests get a 429 (default: 8)")
+    parser.add_argument('--params', default=None,
+                        help="JSON object of default Cartoonizer parameters, e.g. '{\"total_color_levels\": 6}'")
+    parser.add_argument('--max-upload-mb', type=float, default=32.0,
+                        help="Largest accepted upload in megabytes (default: 32)")
+    parser.add_argument('--max-megapixels', type=float, default=50.0,
+                        help="Largest accepted image in megapixels (default: 50)")
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help="Seconds a request may wait for a worker before a 503 (default: 60)")
+    parser.add_argument('--processing-timeout', type=float, default=120.0,
+                        help="Seconds a request waits for a started job before a 504 (default: 120)")
+    parser.add_argument('--max-connections', type=int, default=None,
+                        help="Connections handled at once (default: workers + queue size + 4)")
+    args = parser.parse_args(argv)
+
+    service = CartoonService(args.workers, args.queue_size,
+                             json.loads(args.params) if args.params else {}, args.max_megapixels)
+    service.start()
+    server = make_server(service, args.host, args.port, int(args.max_upload_mb * 1024 * 1024),
+                         args.timeout, args.processing_timeout, args.max_connections)
+    print(f"Serving on http://{args.host}:{server.server_port} "
+          f"(POST /cartoonize, GET /metrics, GET /health)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,139 @@
+import inspect
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
 import cv2
 import numpy as np
+from instrumentation import StageEvent, TimingReport
+from quantizers import (apply_lut, assign_to_palette, histogram_bins, histogram_totals,
+                        image_palette, kmeans_palette, median_cut_palette, octree_palette,
+                        palette_lut, resize_palette, sample_pixels, warm_start_kmeans)
+from smoothing import guided_upsample, iterative_bilateral, layered_bilateral, smoothing_radius
+from stage_cache import PaletteCache, StageCache, image_key
+from tiling import iter_tiles
+
+
+def scale_parameters(params, scale):
+    """
+    Adapt the spatial parameters to an image resized by a given factor.
+    
+    Kernel sizes and the spatial sigma are measured in pixels, so they are
+    scaled with the image to keep the look of the full-resolution result.
+    Color and threshold parameters do not depend on resolution.
+    
+    Args:
+        params: Dictionary of Cartoonizer parameters
+        scale: Resize factor of the image (e.g. 0.25 for a quarter-size copy)
+        
+    Returns:
+        New dictionary with the scaled parameters
+    """
+    scaled = dict(params)
+    if 'bilateral_filter_d' in scaled and scaled['bilateral_filter_d'] > 0:
+        scaled['bilateral_filter_d'] = max(1, int(round(scaled['bilateral_filter_d'] * scale)))
+    if 'bilateral_sigma_space' in scaled:
+        scaled['bilateral_sigma_space'] = max(1.0, scaled['bilateral_sigma_space'] * scale)
+    if 'line_size' in scaled:
+        # Median blur needs an odd kernel size
+        scaled['line_size'] = max(1, int(round(scaled['line_size'] * scale))) | 1
+    return scaled
+
+def save_preset(params, path, info=None):
+    """
+    Write a parameter preset to a JSON file.
+    
+    Args:
+        params: Keyword arguments for Cartoonizer.update_parameters
+        path: Path of the preset file
+        info: Optional dictionary stored alongside, e.g. how the preset was found
+    """
+    preset = dict(info or {}, params=params)
+    with open(path, 'w') as f:
+        # Arrays such as a palette are stored as nested lists
+        json.dump(preset, f, indent=2, default=lambda v: np.asarray(v).tolist())
+
+
+def load_preset(path):
+    """
+    Read the parameters of a preset written by save_preset.
+    
+    Args:
+        path: Path of the preset file
+        
+    Returns:
+        Dictionary of keyword arguments for Cartoonizer.update_parameters
+    """
+    with open(path) as f:
+        return json.load(f)['params']
+
+# Structuring element thickening the Canny edges
+DILATION_KERNEL = np.ones((2, 2), np.uint8)
+
+# Input bytes per chunk of Cartoonizer.cartoonize_batch when no chunk size is given
+BATCH_CHUNK_BYTES = 64 * 1024 * 1024
+
+# Threads running the edge branch of cartoonize concurrently with the color branch,
+# shared by every Cartoonizer of the process and created on first use
+_branch_pool = None
+_branch_pool_lock = threading.Lock()
+_BRANCH_THREAD_PREFIX = 'cartoonizer-branch'
+
+
+def branch_pool():
+    """Return the thread pool running independent pipeline branches."""
+    global _branch_pool
+    with _branch_pool_lock:
+        if _branch_pool is None:
+            _branch_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1,
+                                              thread_name_prefix=_BRANCH_THREAD_PREFIX)
+        return _branch_pool
+
+
+def _copy_into(result, target):
+    """Copy a result into its target buffer unless it was computed there."""
+    if not np.may_share_memory(result, target):
+        target[...] = result
+
+
+@contextmanager
+def _joining(branch):
+    """
+    Cancel or wait for a started branch when the block raises.
+    
+    A branch left running would outlive the failed call: it could race with
+    the next call on the workspace buffers, and store its result in the stage
+    cache after the caller has moved on.
+    """
+    try:
+        yield
+    except BaseException:
+        branch.cancel()
+        wait([branch])
+        raise
+
 
 class Cartoonizer:
     """
     A class that implements image cartoonization using classical computer vision techniques.
     """
     
-    def __init__(self):
-        """Initialize the Cartoonizer with default parameters."""
+    def __init__(self, cache_bytes=256 * 1024 * 1024, cache_entries=64, reuse_buffers=False,
+                 palette_cache_entries=8):
+        """
+        Initialize the Cartoonizer with default parameters.
+        
+        Args:
+            cache_bytes: Memory budget in bytes for cached stage results (0 disables caching)
+            cache_entries: Maximum number of cached stage results
+            reuse_buffers: Keep the temporary buffers of a call for the next call of
+                the same size, trading resident memory for fewer allocations
+            palette_cache_entries: Number of recent K-means palettes kept to
+                warm-start the clustering of similar images (0 disables it)
+        """
         # Default parameters
         self.line_size = 7
         self.blur_value = 7
@@ -18,6 +144,50 @@ class Cartoonizer:
         self.edge_threshold2 = 150
         self.total_color_levels = 8
         
+        # Edge-preserving smoothing engine: 'bilateral' (exact), 'iterative' or 'layered'
+        self.smoothing_engine = 'bilateral'
+        
+        # Color quantization settings
+        self.quantization_mode = 'full'
+        self.sample_size = 100000
+        self.sample_method = 'random'
+        self.kmeans_attempts = 10
+        self.random_seed = None
+        self.histogram_bits = 5
+        
+        # Fixed palette applied to every image, e.g. shared by a batch (None fits one per image)
+        self.palette = None
+        
+        # Multiscale processing of large images: smoothing and palette fitting run on
+        # an image of about this many megapixels (None processes at full resolution)
+        self.multiscale_megapixels = None
+        
+        # Tiled processing for very large images (None processes the whole image at once)
+        self.tile_size = None
+        self.tile_halo = None
+        
+        # Run the edge branch in a thread alongside the bilateral and quantization branch
+        self.concurrent_branches = True
+        
+        # OpenCV worker threads, set with cv2.setNumThreads before each call (None keeps
+        # OpenCV's setting; use 1 when several processes share the machine)
+        self.num_threads = None
+        
+        # Intermediate results reused across calls with unchanged stage inputs
+        self.stage_cache = StageCache(max_bytes=cache_bytes, max_entries=cache_entries)
+        self.palette_cache = PaletteCache(max_entries=palette_cache_entries)
+        
+        # Temporary buffers kept between calls, by name
+        self.reuse_buffers = reuse_buffers
+        self.workspace = {}
+        
+        # Instrumentation: callbacks receiving a StageEvent per stage, and cumulative counters
+        self.observers = []
+        self.counters = {'calls': 0, 'cache_hits': 0, 'cache_misses': 0,
+                         'total_seconds': 0.0, 'stage_seconds': {}}
+        # Guards the stage cache and counters against concurrent branches and callers
+        self._stage_lock = threading.Lock()
+        
     def edge_detection(self, img):
         """
         Detect edges in the image using Canny edge detector.
@@ -28,96 +198,790 @@ class Cartoonizer:
         Returns:
             Edge mask
         """
+        # Convert back to 3-channel image
+        return cv2.cvtColor(self.edge_mask(img), cv2.COLOR_GRAY2BGR)
+    
+    def edge_mask(self, img, out=None, params=None):
+        """
+        Detect edges as a single-channel mask, 0 on the lines and 255 elsewhere.
+        
+        Args:
+            img: Input image
+            out: Optional uint8 array of the image's height and width to write into
+            params: Tuple from edge_parameters to use instead of the current
+                parameters, e.g. captured when a concurrent branch was started
+            
+        Returns:
+            Edge mask
+        """
+        height, width = img.shape[:2]
+        
         # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY,
+                            dst=self.workspace_buffer('gray', (height, width)))
+        return self._gray_edge_mask(gray, out, params)
+    
+    def edge_parameters(self):
+        """
+        Get the parameters edge detection depends on.
+        
+        Returns:
+            Tuple (line_size, edge_threshold1, edge_threshold2)
+        """
+        return (self.line_size, self.edge_threshold1, self.edge_threshold2)
+    
+    def _gray_edge_mask(self, gray, out=None, params=None):
+        """Edge mask of a grayscale image, which is overwritten as scratch space."""
+        height, width = gray.shape[:2]
+        line_size, threshold1, threshold2 = params or self.edge_parameters()
         
         # Apply median blur to reduce noise
-        gray_blur = cv2.medianBlur(gray, self.line_size)
+        gray_blur = cv2.medianBlur(gray, line_size,
+                                   dst=self.workspace_buffer('gray_blur', (height, width)))
         
         # Apply Canny edge detector
-        edges = cv2.Canny(gray_blur, self.edge_threshold1, self.edge_threshold2)
+        edges = cv2.Canny(gray_blur, threshold1, threshold2, edges=gray)
         
         # Dilate edges to make them more visible
-        kernel = np.ones((2, 2), np.uint8)
-        edges = cv2.dilate(edges, kernel, iterations=1)
+        edges = cv2.dilate(edges, DILATION_KERNEL, dst=out, iterations=1)
         
         # Invert edges to get black lines on white background
-        edges = cv2.bitwise_not(edges)
-        
-        # Convert back to 3-channel image
-        edges = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
+        return cv2.bitwise_not(edges, dst=edges)
+    
+    def apply_edges(self, img, mask, out=None):
+        """
+        Draw the edge lines of a mask onto an image.
         
-        return edges
+        Args:
+            img: Color image
+            mask: Edge mask from edge_mask
+            out: Optional array of the image's shape to write into (must not be img)
+            
+        Returns:
+            Image with black lines where the mask is 0
+        """
+        out = np.empty_like(img) if out is None else out
+        out.fill(0)
+        return cv2.copyTo(img, mask, out)
     
-    def color_quantization(self, img):
+    def color_quantization(self, img, out=None):
         """
         Reduce the number of colors in the image.
         
+        In 'full' mode K-means is run over every pixel. In 'sampled' mode the
+        palette is fitted on a subset of sample_size pixels and all pixels are
+        then assigned to their nearest palette color in one vectorized pass.
+        The 'median_cut' and 'octree' modes derive the palette from a
+        reduced-bit color histogram instead of iterative clustering and map
+        pixels through a precomputed 3D lookup table. When a fixed palette is
+        set, no palette is fitted and pixels are only mapped to it.
+        
         Args:
             img: Input image
+            out: Optional contiguous uint8 array of the image's shape to write into
             
         Returns:
             Image with reduced colors
         """
-        # Convert to float32 for processing
-        data = np.float32(img).reshape((-1, 3))
+        if self.palette is not None:
+            # Shared palette: only nearest-color assignment is left to do
+            return self._apply_palette(img, self.palette, out)
+        if self.quantization_mode == 'sampled':
+            rng = np.random.default_rng(self.random_seed)
+            samples = sample_pixels(img, self.sample_size, self.sample_method, rng)
+            signature, seed, iterations = self._warm_start_palette(img, samples)
+            if seed is not None:
+                center = warm_start_kmeans(samples, seed, iterations)[1]
+            else:
+                center = kmeans_palette(samples, self.total_color_levels,
+                                        self.kmeans_attempts, self.random_seed)
+            self._remember_palette(signature, center)
+            return assign_to_palette(img, center, out=out)
+        if self.quantization_mode in ('median_cut', 'octree'):
+            center = self._histogram_palette(*histogram_totals(img, self.histogram_bits))
+            return self._apply_palette(img, center, out)
+        if self.quantization_mode != 'full':
+            raise ValueError(f"Unknown quantization mode: {self.quantization_mode}")
         
-        # Define criteria for K-means
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.001)
+        # Convert to float32 for processing
+        pixels = img.shape[0] * img.shape[1]
+        data = self.workspace_buffer('kmeans_data', (pixels, 3), np.float32)
+        if data is None:
+            data = np.float32(img).reshape((-1, 3))
+        else:
+            np.copyto(data, img.reshape((-1, 3)))
+        labels = self.workspace_buffer('kmeans_labels', (pixels, 1), np.int32)
         
-        # Apply K-means clustering
-        ret, label, center = cv2.kmeans(data, self.total_color_levels, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+        # Continue from the palette of a similar recent image when there is one
+        samples = data[::max(1, pixels // self.sample_size)]
+        signature, seed, iterations = self._warm_start_palette(img, samples)
+        if seed is not None:
+            label, center = warm_start_kmeans(data, seed, iterations)
+        else:
+            # Define criteria for K-means
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.001)
+            
+            # Apply K-means clustering
+            if self.random_seed is not None:
+                cv2.setRNGSeed(self.random_seed)
+            ret, label, center = cv2.kmeans(data, self.total_color_levels, labels, criteria,
+                                            self.kmeans_attempts, cv2.KMEANS_RANDOM_CENTERS)
+        self._remember_palette(signature, center)
         center = np.uint8(center)
         
         # Map back to original image dimensions
-        result = center[label.flatten()]
-        result = result.reshape(img.shape)
+        result = np.take(center, label.ravel(), axis=0,
+                         out=None if out is None else out.reshape((-1, 3)))
+        return result.reshape(img.shape)
+    
+    def _warm_start_palette(self, img, samples):
+        """
+        Look up a K-means starting palette fitted on a similar recent image.
         
-        return result
+        A cached palette with a different number of colors is grown or shrunk
+        to total_color_levels and given more iterations to settle. Warm starts
+        are skipped when a random seed is set, so seeded results do not depend
+        on earlier calls.
+        
+        Args:
+            img: Image being quantized
+            samples: float32 pixels of the image, used to grow a palette
+            
+        Returns:
+            Tuple (signature, palette, iterations): the image signature to store
+            the fitted palette under (None when warm starts are disabled), the
+            starting palette (None when there is no similar image) and the
+            maximum number of K-means iterations from it
+        """
+        if self.random_seed is not None or self.palette_cache.max_entries <= 0:
+            return None, None, 0
+        signature = self.palette_cache.signature(img)
+        # K-means cannot fit more colors than there are samples
+        levels = min(self.total_color_levels, len(samples))
+        palette = self.palette_cache.get(signature, levels)
+        if palette is None or len(palette) == levels:
+            return signature, palette, 5
+        return signature, resize_palette(palette, levels, samples), 20
+    
+    def _remember_palette(self, signature, palette):
+        """Store a fitted palette for warm-starting later calls on similar images."""
+        if signature is not None:
+            self.palette_cache.put(signature, palette)
+    
+    def _histogram_palette(self, counts, sums):
+        """Derive the palette of the histogram quantization modes from histogram totals."""
+        bins, counts, means = histogram_bins(counts, sums)
+        if self.quantization_mode == 'median_cut':
+            return median_cut_palette(counts, means, self.total_color_levels)
+        return octree_palette(bins, counts, means, self.total_color_levels,
+                              self.histogram_bits)
     
-    def apply_bilateral_filter(self, img):
+    def _apply_palette(self, img, palette, out=None):
+        """Map every pixel to its nearest palette color, through a LUT in the histogram modes."""
+        if self.quantization_mode in ('median_cut', 'octree'):
+            lut = palette_lut(palette, self.histogram_bits)
+            return apply_lut(img, lut, self.histogram_bits, out)
+        return assign_to_palette(img, palette, out=out)
+    
+    def apply_bilateral_filter(self, img, out=None):
         """
         Apply bilateral filter to smooth the image while preserving edges.
         
+        The 'iterative' and 'layered' smoothing engines approximate the
+        bilateral filter from the same parameters at a lower cost for large
+        diameters: 'iterative' with repeated small-diameter passes, 'layered'
+        with a piecewise-linear approximation whose cost does not depend on
+        the diameter.
+        
         Args:
             img: Input image
+            out: Optional array of the image's shape to write into (only used by
+                the 'bilateral' engine, so always use the returned image)
             
         Returns:
             Filtered image
         """
+        return self._smooth(img, self.bilateral_filter_d, self.bilateral_sigma_space, out)
+    
+    def _smooth(self, img, d, sigma_space, out=None, intensity_range=None, origin=(0, 0)):
+        """
+        Run the smoothing engine with the given spatial parameters, see apply_bilateral_filter.
+        
+        A tile of a larger image passes the image's gray level range and its
+        own position, which the 'layered' engine needs to match the whole image.
+        """
+        if self.smoothing_engine == 'iterative':
+            return iterative_bilateral(img, d, self.bilateral_sigma_color, sigma_space)
+        if self.smoothing_engine == 'layered':
+            return layered_bilateral(img, d, self.bilateral_sigma_color, sigma_space,
+                                     intensity_range=intensity_range, origin=origin)
+        if self.smoothing_engine != 'bilateral':
+            raise ValueError(f"Unknown smoothing engine: {self.smoothing_engine}")
+        
         # Apply bilateral filter
-        filtered = cv2.bilateralFilter(img, self.bilateral_filter_d, 
+        filtered = cv2.bilateralFilter(img, d, 
                                       self.bilateral_sigma_color, 
-                                      self.bilateral_sigma_space)
+                                      sigma_space, dst=out)
         return filtered
     
-    def cartoonize(self, img):
+    def cartoonize(self, img, out=None):
         """
         Apply cartoonization effect to the image.
         
         Args:
             img: Input image
+            out: Optional uint8 array of the image's shape the cartoon is written
+                into, e.g. a buffer reused across the frames of a video
             
         Returns:
             Cartoonized image
         """
-        # Apply bilateral filter for smoothing
-        filtered = self.apply_bilateral_filter(img)
+        start = time.perf_counter()
+        self._apply_thread_budget()
+        if self.multiscale_scale(img.shape) < 1.0:
+            cartoon = self.cartoonize_multiscale(img, out)
+        elif self.tile_size and max(img.shape[:2]) > self.tile_size:
+            cartoon = self.cartoonize_tiled(img, out)
+        else:
+            key = self._image_key(img)
+            
+            # Detect edges, independent of the color branch, with the parameters of this call
+            edge_params = self.edge_parameters()
+            edge_buffer = self._stage_buffer('edges', img.shape[:2])
+            edges = self._run_branch('edge_detection', img,
+                                     lambda: self.edge_mask(img, edge_buffer, edge_params),
+                                     self._edge_key(key, edge_params))
+            
+            with _joining(edges):
+                # Apply bilateral filter for smoothing
+                bilateral_key = self._bilateral_key(key)
+                filtered = self._run_stage('apply_bilateral_filter', img,
+                                           lambda: self.apply_bilateral_filter(
+                                               img, self._stage_buffer('filtered', img.shape)),
+                                           bilateral_key)
+                
+                # Apply color quantization
+                color_quantized = self._run_stage('color_quantization', filtered,
+                                                  lambda: self.color_quantization(
+                                                      filtered, self._stage_buffer('quantized', img.shape)),
+                                                  self._quantization_key(bilateral_key))
+                edges = edges.result()
+            
+            # Combine edges with color quantized image
+            cartoon = self._run_stage('bitwise_and', color_quantized,
+                                      lambda: self.apply_edges(color_quantized, edges, out))
         
-        # Apply color quantization
-        color_quantized = self.color_quantization(filtered)
+        self._count_calls(1, time.perf_counter() - start)
+        return cartoon
+    
+    def cartoonize_batch(self, images, out=None, chunk_size=None):
+        """
+        Cartoonize a stack of same-sized images, e.g. frames from a data pipeline.
         
-        # Detect edges
-        edges = self.edge_detection(img)
+        The stack is processed in chunks, and only one chunk of input and
+        intermediate results is in memory at a time, so arrays memory-mapped
+        from .npy files larger than the available memory can be processed.
+        Within a chunk, the pixel-wise steps (grayscale conversion, mapping to
+        a fixed palette and drawing the edges) run once over the whole chunk;
+        the neighborhood filters and per-image palette fitting run per image.
+        Each output equals cartoonize of the same image. Stage results are not
+        cached.
         
-        # Combine edges with color quantized image
-        cartoon = cv2.bitwise_and(color_quantized, edges)
+        Args:
+            images: uint8 array of shape (N, H, W, 3), e.g. np.load(path, mmap_mode='r')
+            out: Optional C-contiguous uint8 array of the same shape to write
+                into, e.g. a memory map from np.lib.format.open_memmap
+            chunk_size: Number of images per chunk (defaults to about
+                BATCH_CHUNK_BYTES of input)
+            
+        Returns:
+            The cartoons, in out if it was given
+        """
+        if images.ndim != 4 or images.shape[3] != 3 or images.dtype != np.uint8:
+            raise ValueError(f"Expected a uint8 array of shape (N, H, W, 3), "
+                             f"got {images.dtype} {images.shape}")
+        if out is None:
+            out = np.empty(images.shape, np.uint8)
+        elif out.shape != images.shape or out.dtype != np.uint8 or not out.flags.c_contiguous:
+            raise ValueError(f"Expected a C-contiguous uint8 output of shape {images.shape}")
+        count, height, width = images.shape[:3]
+        
+        if self.multiscale_scale(images.shape[1:]) < 1.0 or (
+                self.tile_size and max(height, width) > self.tile_size):
+            # Large images take the multiscale or tiled path one at a time
+            for i in range(count):
+                self.cartoonize(np.ascontiguousarray(images[i]), out[i])
+            return out
+        
+        start = time.perf_counter()
+        self._apply_thread_budget()
+        chunk_size = max(1, min(count, chunk_size or BATCH_CHUNK_BYTES // (height * width * 3)))
+        # Chunk buffers, allocated once for the whole stack
+        gray = np.empty((chunk_size, height, width), np.uint8)
+        edges = np.empty((chunk_size, height, width), np.uint8)
+        filtered = np.empty((chunk_size, height, width, 3), np.uint8)
+        quantized = np.empty((chunk_size, height, width, 3), np.uint8)
+        
+        for first in range(0, count, chunk_size):
+            # Slicing a memory map only reads this chunk
+            chunk = np.ascontiguousarray(images[first:first + chunk_size])
+            n = len(chunk)
+            edge_params = self.edge_parameters()
+            
+            def detect_edges():
+                cv2.cvtColor(chunk.reshape((-1, width, 3)), cv2.COLOR_BGR2GRAY,
+                             dst=gray[:n].reshape((-1, width)))
+                for i in range(n):
+                    self._gray_edge_mask(gray[i], edges[i], edge_params)
+                return edges[:n]
+            
+            def smooth():
+                for i in range(n):
+                    _copy_into(self.apply_bilateral_filter(chunk[i], filtered[i]), filtered[i])
+                return filtered[:n]
+            
+            def quantize():
+                if self.palette is not None:
+                    # One shared palette: map the whole chunk at once
+                    stacked = quantized[:n].reshape((-1, width, 3))
+                    _copy_into(self._apply_palette(filtered[:n].reshape((-1, width, 3)),
+                                                   self.palette, stacked), stacked)
+                else:
+                    for i in range(n):
+                        _copy_into(self.color_quantization(filtered[i], quantized[i]), quantized[i])
+                return quantized[:n]
+            
+            edge_masks = self._run_branch('edge_detection', chunk, detect_edges)
+            with _joining(edge_masks):
+                self._run_stage('apply_bilateral_filter', chunk, smooth)
+                self._run_stage('color_quantization', filtered[:n], quantize)
+                edge_masks = edge_masks.result()
+            self._run_stage('bitwise_and', quantized[:n],
+                            lambda: self.apply_edges(quantized[:n].reshape((-1, width, 3)),
+                                                     edge_masks.reshape((-1, width)),
+                                                     out[first:first + n].reshape((-1, width, 3))))
+        
+        self._count_calls(count, time.perf_counter() - start)
+        return out
+    
+    def fit_palette(self, images, samples_per_image=None):
+        """
+        Fit one palette of total_color_levels colors for a collection of images.
+        
+        Each image is bilateral filtered like in cartoonize. In the histogram
+        modes the histograms of all images are added up; otherwise K-means runs
+        on pixels sampled from every image, each image contributing equally.
+        Set the result with update_parameters(palette=...) to give every
+        output the same colors without clustering each image.
+        
+        Args:
+            images: Sequence of images (any iterable if samples_per_image is given)
+            samples_per_image: Pixels sampled per image in the K-means modes
+                (defaults to sample_size divided among the images)
+            
+        Returns:
+            float32 array of shape (total_color_levels, 3) with the palette colors
+        """
+        if self.quantization_mode in ('median_cut', 'octree'):
+            counts, sums = 0, 0
+            for img in images:
+                image_counts, image_sums = histogram_totals(self.apply_bilateral_filter(img),
+                                                            self.histogram_bits)
+                counts, sums = counts + image_counts, sums + image_sums
+            return np.float32(self._histogram_palette(counts, sums))
+        if self.quantization_mode not in ('full', 'sampled'):
+            raise ValueError(f"Unknown quantization mode: {self.quantization_mode}")
+        
+        if samples_per_image is None:
+            samples_per_image = max(1, self.sample_size // max(1, len(images)))
+        rng = np.random.default_rng(self.random_seed)
+        samples = [sample_pixels(self.apply_bilateral_filter(img), samples_per_image,
+                                 self.sample_method, rng)
+                   for img in images]
+        return kmeans_palette(np.concatenate(samples), self.total_color_levels,
+                              self.kmeans_attempts, self.random_seed)
+    
+    def clear_palette(self):
+        """Go back to fitting a palette per image."""
+        self.palette = None
+    
+    def workspace_buffer(self, name, shape, dtype=np.uint8):
+        """
+        Get a named temporary buffer, reallocated only when the shape changes.
+        
+        Code composing the stages itself, like VideoCartoonizer, passes these
+        buffers as the out arguments of the stages to reuse them too.
+        
+        Args:
+            name: Buffer name; cartoonize uses 'gray', 'gray_blur', 'kmeans_data'
+                and 'kmeans_labels', and 'filtered', 'quantized' and 'edges' for
+                the stage outputs
+            shape: Array shape
+            dtype: Array dtype
+            
+        Returns:
+            The buffer, or None when buffers are not reused (OpenCV then allocates)
+        """
+        if not self.reuse_buffers:
+            return None
+        buffer = self.workspace.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype)
+            self.workspace[name] = buffer
+        return buffer
+    
+    def _stage_buffer(self, name, shape):
+        """Workspace buffer for a stage output, or None while stage outputs may be cached."""
+        if not self.stage_cache.enabled:
+            return self.workspace_buffer(name, shape)
+        return None
+    
+    def release_workspace(self):
+        """Free the buffers kept for reuse between calls."""
+        self.workspace.clear()
+    
+    def _run_stage(self, stage, img, compute, key=None):
+        """
+        Run one pipeline stage, through the stage cache when a key is given.
+        
+        Updates the counters and notifies the observers with a StageEvent.
+        Observers are called without holding the stage lock, so they may be
+        slow or call back into the cartoonizer.
+        
+        Args:
+            stage: Stage name
+            img: Stage input, reported in the event
+            compute: Callable computing the stage output
+            key: Stage cache key, or None to bypass the cache
+            
+        Returns:
+            Stage output
+        """
+        start = time.perf_counter()
+        with self._stage_lock:
+            result = self.stage_cache.get(key) if key is not None else None
+        cached = result is not None
+        if not cached:
+            result = compute()
+            if key is not None:
+                with self._stage_lock:
+                    result = self.stage_cache.put(key, result)
+        seconds = time.perf_counter() - start
+        
+        with self._stage_lock:
+            if key is not None:
+                self.counters['cache_hits' if cached else 'cache_misses'] += 1
+            stage_seconds = self.counters['stage_seconds']
+            stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+            observers = list(self.observers)
+        if observers:
+            event = StageEvent(stage, seconds, img.shape, result.nbytes, cached)
+            for observer in observers:
+                observer(event)
+        return result
+    
+    def _count_calls(self, calls, seconds):
+        """Add finished calls and their wall time to the counters."""
+        with self._stage_lock:
+            self.counters['calls'] += calls
+            self.counters['total_seconds'] += seconds
+    
+    def _run_branch(self, stage, img, compute, key=None):
+        """
+        Start a pipeline stage that does not depend on the other branch.
+        
+        With concurrent_branches the stage runs on the branch thread pool
+        while the caller carries on; otherwise it runs immediately. It also
+        runs immediately on a branch thread, e.g. when an observer of a
+        branch stage calls cartoonize, since waiting there for another
+        branch thread could exhaust the pool.
+        
+        Args:
+            stage: Stage name
+            img: Stage input
+            compute: Callable computing the stage output
+            key: Stage cache key, or None to bypass the cache
+            
+        Returns:
+            Future of the stage output; callers must wait for it before
+            returning, also when they fail (see _joining)
+        """
+        if (not self.concurrent_branches
+                or threading.current_thread().name.startswith(_BRANCH_THREAD_PREFIX)):
+            future = Future()
+            future.set_result(self._run_stage(stage, img, compute, key))
+            return future
+        return branch_pool().submit(self._run_stage, stage, img, compute, key)
+    
+    def _apply_thread_budget(self):
+        """Set OpenCV's thread count to num_threads (a process-wide setting)."""
+        if self.num_threads is not None and cv2.getNumThreads() != max(1, self.num_threads):
+            cv2.setNumThreads(self.num_threads)
+    
+    def add_observer(self, observer):
+        """
+        Register a callback receiving a StageEvent after every stage.
+        
+        Args:
+            observer: Callable taking a StageEvent
+        """
+        self.observers.append(observer)
+    
+    def remove_observer(self, observer):
+        """Unregister a callback added with add_observer."""
+        self.observers.remove(observer)
+    
+    @contextmanager
+    def instrument(self):
+        """
+        Collect the stage events of the calls made inside a with block.
+        
+        Yields:
+            TimingReport filled with the events of the block
+        """
+        report = TimingReport()
+        self.add_observer(report)
+        try:
+            yield report
+        finally:
+            self.remove_observer(report)
+    
+    def cartoonize_tiled(self, img, out=None):
+        """
+        Apply cartoonization tile by tile to bound peak memory.
+        
+        Each tile is filtered together with a halo wide enough for the bilateral
+        filter, median blur and dilation to match the untiled result, and for
+        Canny's hysteresis to follow edges across tile borders in practice. A
+        first pass smooths every tile into the output buffer and fits one
+        palette for the whole image, from sampled pixels (or the accumulated
+        histogram in the histogram modes), so colors stay consistent across
+        tiles. A second pass quantizes and outlines the smoothed tiles in
+        place, so each tile is smoothed only once. Temporary buffers scale
+        with the tile size; only the output is image-sized. The input may be a
+        memory-mapped array. In the K-means modes the palette is always fitted
+        on samples.
+        
+        Args:
+            img: Input image
+            out: Optional uint8 array of the image's shape to write into
+            
+        Returns:
+            Cartoonized image
+        """
+        tile_size = self.tile_size or max(img.shape[:2])
+        tiles = list(iter_tiles(img.shape[0], img.shape[1], tile_size, self._tile_halo()))
+        
+        # First pass: smooth each tile into the output and fit one palette for the whole image
+        cartoon = np.empty(img.shape, np.uint8) if out is None else out
+        palette = self._smooth_tiles(img, tiles, cartoon)
+        
+        # Second pass: quantize and outline each smoothed tile
+        for core, padded, inner in tiles:
+            block = img[padded]
+            filtered = cartoon[core]
+            color_quantized = self._run_stage('color_quantization', filtered,
+                                              lambda: self._apply_palette(filtered, palette))
+            edges = self._run_stage('edge_detection', block,
+                                    lambda: self.edge_mask(block))[inner]
+            cartoon[core] = self._run_stage('bitwise_and', color_quantized,
+                                            lambda: self.apply_edges(color_quantized, edges))
         
         return cartoon
     
+    def multiscale_scale(self, shape):
+        """
+        Choose the downscaling factor of multiscale processing for an image size.
+        
+        The factor brings the image to about multiscale_megapixels. Images
+        that would shrink by less than 10% are processed at full resolution.
+        
+        Args:
+            shape: Image shape
+            
+        Returns:
+            Factor between 0 and 1, or 1.0 to process at full resolution
+        """
+        if not self.multiscale_megapixels:
+            return 1.0
+        scale = np.sqrt(self.multiscale_megapixels * 1e6 / (shape[0] * shape[1]))
+        return float(scale) if scale < 0.9 else 1.0
+    
+    def cartoonize_multiscale(self, img, out=None):
+        """
+        Apply cartoonization with the smoothing and color fitting on a smaller image.
+        
+        The image is downscaled by multiscale_scale, smoothed with spatial
+        parameters scaled to match, and the palette is fitted there. The
+        smoothed image is brought back to full resolution with guided
+        upsampling, which follows the edges of the full-resolution image, and
+        mapped to the palette. Edges are detected at full resolution, so the
+        line art stays as crisp as in the single-scale pipeline.
+        
+        Args:
+            img: Input image
+            out: Optional uint8 array of the image's shape to write into
+            
+        Returns:
+            Cartoonized image
+        """
+        height, width = img.shape[:2]
+        scale = self.multiscale_scale(img.shape)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        key = self._image_key(img)
+        
+        # Detect edges at full resolution, independent of the color branch
+        edge_params = self.edge_parameters()
+        edges = self._run_branch('edge_detection', img,
+                                 lambda: self.edge_mask(img, params=edge_params),
+                                 self._edge_key(key, edge_params))
+        
+        with _joining(edges):
+            small = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+            params = scale_parameters({'bilateral_filter_d': self.bilateral_filter_d,
+                                       'bilateral_sigma_space': self.bilateral_sigma_space}, scale)
+            
+            # Smooth the small image
+            small_key = None if key is None else ('multiscale', self._bilateral_key(key), size)
+            small_filtered = self._run_stage('apply_bilateral_filter', small,
+                                             lambda: self._smooth(small, params['bilateral_filter_d'],
+                                                                  params['bilateral_sigma_space']),
+                                             small_key)
+            
+            # Bring the smoothed image back to full resolution along the image edges
+            upsample_key = None if key is None else ('upsample', small_key)
+            filtered = self._run_stage('upsample', small_filtered,
+                                       lambda: guided_upsample(small_filtered,
+                                                               cv2.cvtColor(small, cv2.COLOR_BGR2GRAY),
+                                                               cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)),
+                                       upsample_key)
+            
+            # Fit the palette on the small image and map the full-resolution pixels to it
+            color_quantized = self._run_stage(
+                'color_quantization', filtered,
+                lambda: self._apply_palette(filtered,
+                                            image_palette(self.color_quantization(small_filtered))),
+                self._quantization_key(upsample_key))
+            edges = edges.result()
+        
+        return self._run_stage('bitwise_and', color_quantized,
+                               lambda: self.apply_edges(color_quantized, edges, out))
+    
+    def _tile_halo(self):
+        """Number of overlapping pixels needed around each tile."""
+        if self.tile_halo is not None:
+            return self.tile_halo
+        bilateral_radius = smoothing_radius(self.smoothing_engine, self.bilateral_filter_d,
+                                            self.bilateral_sigma_space)
+        # Median blur, Sobel and non-maximum suppression, and the 2x2 dilation
+        edge_radius = self.line_size // 2 + 2 + 1
+        # Extra margin so hysteresis can trace edges that cross a tile border
+        return max(bilateral_radius, edge_radius) + 16
+    
+    def _smooth_tiles(self, img, tiles, out):
+        """
+        Smooth every tile into out and fit a palette for the whole image from the results.
+        
+        Returns:
+            The palette (the fixed palette when one is set)
+        """
+        histogram = self.quantization_mode in ('median_cut', 'octree')
+        if self.palette is None and not histogram and self.quantization_mode not in ('full', 'sampled'):
+            raise ValueError(f"Unknown quantization mode: {self.quantization_mode}")
+        total = img.shape[0] * img.shape[1]
+        rng = np.random.default_rng(self.random_seed)
+        counts, sums, samples = 0, 0, []
+        # The layered engine takes its levels from the whole image, like the palette
+        intensity_range = self._intensity_range(img, tiles) if self.smoothing_engine == 'layered' else None
+        for core, padded, inner in tiles:
+            block = img[padded]
+            origin = (padded[0].start, padded[1].start)
+            out[core] = self._run_stage('apply_bilateral_filter', block,
+                                        lambda: self._smooth(block, self.bilateral_filter_d,
+                                                             self.bilateral_sigma_space,
+                                                             intensity_range=intensity_range,
+                                                             origin=origin))[inner]
+            filtered = out[core]
+            if self.palette is not None:
+                continue
+            if histogram:
+                tile_counts, tile_sums = histogram_totals(filtered, self.histogram_bits)
+                counts, sums = counts + tile_counts, sums + tile_sums
+            else:
+                # Sample each tile in proportion to its area
+                area = filtered.shape[0] * filtered.shape[1]
+                count = max(1, int(np.ceil(self.sample_size * area / total)))
+                samples.append(sample_pixels(filtered, count, self.sample_method, rng))
+        
+        if self.palette is not None:
+            return self.palette
+        if histogram:
+            return self._histogram_palette(counts, sums)
+        return kmeans_palette(np.concatenate(samples), self.total_color_levels,
+                              self.kmeans_attempts, self.random_seed)
+    
+    def _intensity_range(self, img, tiles):
+        """Gray level range of a whole image, read tile by tile."""
+        low, high = 255, 0
+        for core, padded, inner in tiles:
+            tile_low, tile_high = cv2.minMaxLoc(cv2.cvtColor(img[core], cv2.COLOR_BGR2GRAY))[:2]
+            low, high = min(low, int(tile_low)), max(high, int(tile_high))
+        return low, high
+    
+    def stage_keys(self, key):
+        """
+        Stage cache keys of an image under the current parameters.
+        
+        Each key holds only the parameters its stage depends on, so parameter
+        sets with equal keys share that stage's result, e.g. in a parameter sweep.
+        
+        Args:
+            key: Content key of the input image, see stage_cache.image_key
+            
+        Returns:
+            Tuple (bilateral key, quantization key, edge key)
+        """
+        bilateral_key = self._bilateral_key(key)
+        return bilateral_key, self._quantization_key(bilateral_key), self._edge_key(key)
+    
+    def _image_key(self, img):
+        """Content key of an input image, or None without hashing it when caching is off."""
+        return image_key(img) if self.stage_cache.enabled else None
+    
+    def _bilateral_key(self, key):
+        """Cache key for the bilateral stage: the image plus the filter parameters."""
+        if key is None:
+            return None
+        return ('bilateral', key, self.smoothing_engine, self.bilateral_filter_d,
+                self.bilateral_sigma_color, self.bilateral_sigma_space)
+    
+    def _quantization_key(self, bilateral_key):
+        """Cache key for the quantization stage: its bilateral input plus the level count."""
+        if bilateral_key is None:
+            return None
+        palette = None if self.palette is None else self.palette.tobytes()
+        return ('quantize', bilateral_key, self.total_color_levels, self.quantization_mode,
+                self.sample_size, self.sample_method, self.kmeans_attempts, self.random_seed,
+                self.histogram_bits, palette)
+    
+    def _edge_key(self, key, params=None):
+        """Cache key for the edge stage: the image plus the edge parameters (current ones by default)."""
+        if key is None:
+            return None
+        return ('edges', key) + tuple(params or self.edge_parameters())
+    
+    def clear_cache(self):
+        """Discard all cached stage results and palettes."""
+        self.stage_cache.clear()
+        self.palette_cache.clear()
+    
     def update_parameters(self, line_size=None, blur_value=None, bilateral_filter_d=None,
                          bilateral_sigma_color=None, bilateral_sigma_space=None,
-                         edge_threshold1=None, edge_threshold2=None, total_color_levels=None):
+                         edge_threshold1=None, edge_threshold2=None, total_color_levels=None,
+                         quantization_mode=None, sample_size=None, sample_method=None,
+                         kmeans_attempts=None, random_seed=None, histogram_bits=None,
+                         tile_size=None, tile_halo=None, smoothing_engine=None, palette=None,
+                         multiscale_megapixels=None, concurrent_branches=None, num_threads=None):
         """
         Update the cartoonization parameters.
         
@@ -130,6 +994,24 @@ class Cartoonizer:
             edge_threshold1: First threshold for Canny edge detector
             edge_threshold2: Second threshold for Canny edge detector
             total_color_levels: Number of color levels for quantization
+            quantization_mode: 'full' to cluster every pixel or 'sampled' to fit on a subset
+            sample_size: Number of pixels the palette is fitted on in 'sampled' mode
+            sample_method: 'random' or 'stratified' pixel sampling
+            kmeans_attempts: Number of K-means restarts
+            random_seed: Seed for reproducible quantization, or None
+            histogram_bits: Bits per channel of the histogram and lookup table
+                used by the 'median_cut' and 'octree' modes
+            tile_size: Process images larger than this many pixels per side in tiles
+            tile_halo: Overlap around each tile in pixels (derived from the filter
+                sizes when not set)
+            smoothing_engine: 'bilateral', 'iterative' or 'layered'
+            palette: Fixed (k, 3) BGR palette applied to every image instead of
+                fitting one per image (see fit_palette and clear_palette)
+            multiscale_megapixels: Smooth and fit colors on a downscaled image of
+                about this size, for large images (takes precedence over tiling)
+            concurrent_branches: Run edge detection alongside the color branch
+            num_threads: OpenCV thread budget set before each call (0 or 1 for
+                single-threaded OpenCV, e.g. one per worker process)
         """
         if line_size is not None:
             self.line_size = line_size
@@ -147,3 +1029,39 @@ class Cartoonizer:
             self.edge_threshold2 = edge_threshold2
         if total_color_levels is not None:
             self.total_color_levels = total_color_levels
+        if quantization_mode is not None:
+            self.quantization_mode = quantization_mode
+        if sample_size is not None:
+            self.sample_size = sample_size
+        if sample_method is not None:
+            self.sample_method = sample_method
+        if kmeans_attempts is not None:
+            self.kmeans_attempts = kmeans_attempts
+        if random_seed is not None:
+            self.random_seed = random_seed
+        if histogram_bits is not None:
+            self.histogram_bits = histogram_bits
+        if tile_size is not None:
+            self.tile_size = tile_size
+        if tile_halo is not None:
+            self.tile_halo = tile_halo
+        if smoothing_engine is not None:
+            self.smoothing_engine = smoothing_engine
+        if palette is not None:
+            self.palette = np.float32(palette).reshape((-1, 3))
+        if multiscale_megapixels is not None:
+            self.multiscale_megapixels = multiscale_megapixels
+        if concurrent_branches is not None:
+            self.concurrent_branches = concurrent_branches
+        if num_threads is not None:
+            self.num_threads = num_threads
+    
+    def get_parameters(self):
+        """
+        Get the current cartoonization parameters.
+        
+        Returns:
+            Dictionary of every parameter accepted by update_parameters
+        """
+        return {name: getattr(self, name)
+                for name in inspect.signature(self.update_parameters).parameters}
\ No newline at end of file
@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+
+# Default titles of an original/cartoon comparison
+COMPARISON_TITLES = ('Original Image', 'Cartoonized Image')
+
+
+def fit_to_cell(img, cell_width, cell_height, background=255):
+    """
+    Scale an image to fit a cell, preserving its aspect ratio, and center it.
+
+    Args:
+        img: BGR or grayscale image
+        cell_width: Width of the cell in pixels
+        cell_height: Height of the cell in pixels
+        background: Gray level of the padding
+
+    Returns:
+        BGR image of exactly cell_height x cell_width
+    """
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    height, width = img.shape[:2]
+    scale = min(cell_width / width, cell_height / height)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if size != (width, height):
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        img = cv2.resize(img, size, interpolation=interpolation)
+    cell = np.full((cell_height, cell_width, 3), background, np.uint8)
+    y = (cell_height - size[1]) // 2
+    x = (cell_width - size[0]) // 2
+    cell[y:y + size[1], x:x + size[0]] = img
+    return cell
+
+
+def draw_title(canvas, text, x, y, width, height, font_scale=None, color=(0, 0, 0)):
+    """
+    Draw a title centered in a strip of a canvas, in place.
+
+    Args:
+        canvas: Image the title is drawn on
+        text: Title text
+        x, y: Top-left corner of the strip
+        width, height: Size of the strip
+        font_scale: OpenCV font scale (derived from the strip height by default)
+        color: BGR text color
+    """
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = font_scale or height / 40.0
+    thickness = max(1, round(font_scale * 1.5))
+    (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, thickness)
+    # Shrink long titles to fit the cell
+    if text_width > width - 8:
+        font_scale *= (width - 8) / text_width
+        thickness = max(1, round(font_scale * 1.5))
+        (text_width, text_height), _ = cv2.getTextSize(text, font, font_scale, thickness)
+    origin = (x + (width - text_width) // 2, y + (height + text_height) // 2)
+    cv2.putText(canvas, text, origin, font, font_scale, color, thickness, cv2.LINE_AA)
+
+
+def compose_grid(images, titles=None, columns=None, cell_width=None, title_height=40,
+                 gap=10, background=255):
+    """
+    Assemble images into a titled grid.
+
+    Every image is scaled to a common cell size (the size of the first image,
+    scaled to cell_width) and centered in its cell, with its title drawn in a
+    strip above it.
+
+    Args:
+        images: List of BGR or grayscale images
+        titles: Optional list of titles, one per image
+        columns: Number of grid columns (defaults to one row)
+        cell_width: Width of each cell in pixels (defaults to the first image's width)
+        title_height: Height of the title strips (0 for no titles)
+        gap: Spacing in pixels between and around the cells
+        background: Gray level of the background
+
+    Returns:
+        BGR grid image
+    """
+    columns = columns or len(images)
+    rows = -(-len(images) // columns)
+    first_height, first_width = images[0].shape[:2]
+    cell_width = cell_width or first_width
+    cell_height = max(1, round(first_height * cell_width / first_width))
+    if not titles:
+        title_height = 0
+
+    step_x = cell_width + gap
+    step_y = title_height + cell_height + gap
+    canvas = np.full((rows * step_y + gap, columns * step_x + gap, 3), background, np.uint8)
+    for i, img in enumerate(images):
+        row, column = divmod(i, columns)
+        x = gap + column * step_x
+        y = gap + row * step_y
+        if title_height:
+            draw_title(canvas, titles[i], x, y, cell_width, title_height)
+        top = y + title_height
+        canvas[top:top + cell_height, x:x + cell_width] = fit_to_cell(img, cell_width, cell_height,
+                                                                      background)
+    return canvas
+
+
+def save_comparison(img, cartoon, comparison_path, cell_width=600, titles=COMPARISON_TITLES):
+    """
+    Save a side-by-side comparison of an original and its cartoon.
+
+    Args:
+        img: Original image
+        cartoon: Cartoonized image
+        comparison_path: Path of the comparison image
+        cell_width: Width in pixels of each half of the comparison
+        titles: Titles drawn above the original and the cartoon
+    """
+    comparison = compose_grid([img, cartoon], titles, cell_width=cell_width)
+    if not cv2.imwrite(comparison_path, comparison):
+        raise IOError(f"could not write {comparison_path}")
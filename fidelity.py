@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from benchmark import CONFIGS, EXECUTION_CONFIGS, benchmark_inputs
+from cartoonizer import Cartoonizer
+from quantizers import image_palette
+
+# Faster configurations scored against the reference by default
+FAST_CONFIGS = {name: params for name, params in CONFIGS.items()
+                if name != 'reference' and name not in EXECUTION_CONFIGS}
+
+# Parameters shared by the reference and every configuration, so that runs are reproducible
+BASE_PARAMS = {'random_seed': 0}
+
+# Default pass thresholds, applied to the mean score of a configuration over all images
+THRESHOLDS = {
+    'min_psnr': 20.0,
+    'min_ssim': 0.80,
+    'max_palette_distance': 8.0,
+    'min_edge_iou': 0.80,
+}
+
+
+def psnr(reference, test):
+    """
+    Peak signal-to-noise ratio between two images.
+
+    Returns:
+        PSNR in dB (capped at 100 for identical images)
+    """
+    return min(cv2.PSNR(reference, test), 100.0)
+
+
+def ssim(reference, test, sigma=1.5):
+    """
+    Mean structural similarity of the grayscale versions of two images.
+
+    Follows Wang et al. (2004) with an 11x11 Gaussian window.
+
+    Args:
+        reference: Reference BGR image
+        test: Image compared against the reference
+        sigma: Standard deviation of the Gaussian window
+
+    Returns:
+        Mean SSIM, 1.0 for identical images
+    """
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    x = np.float32(cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY))
+    y = np.float32(cv2.cvtColor(test, cv2.COLOR_BGR2GRAY))
+
+    def blur(img):
+        return cv2.GaussianBlur(img, (11, 11), sigma)
+
+    mean_x, mean_y = blur(x), blur(y)
+    var_x = blur(x * x) - mean_x * mean_x
+    var_y = blur(y * y) - mean_y * mean_y
+    covariance = blur(x * y) - mean_x * mean_y
+    ssim_map = ((2 * mean_x * mean_y + c1) * (2 * covariance + c2)
+                / ((mean_x * mean_x + mean_y * mean_y + c1) * (var_x + var_y + c2)))
+    return float(ssim_map.mean())
+
+
+def line_mask(cartoon):
+    """Mask of the edge lines drawn by the cartoonizer, which are pure black."""
+    return ~cartoon.any(axis=2)
+
+
+def cartoon_palette(cartoon):
+    """Distinct fill colors of a cartoon, leaving out the black edge lines."""
+    return image_palette(cartoon[~line_mask(cartoon)][:, None])
+
+
+def palette_distance(reference_palette, test_palette):
+    """
+    Symmetric distance between two palettes in CIELAB.
+
+    Every color is matched to the nearest color of the other palette, and the
+    color differences (CIE76 delta E) are averaged over both palettes, so a
+    missing color and a spurious one both count.
+
+    Args:
+        reference_palette: (k, 3) uint8 BGR colors
+        test_palette: (m, 3) uint8 BGR colors
+
+    Returns:
+        Mean delta E (0 for identical palettes, about 2.3 is just noticeable)
+    """
+    if len(reference_palette) == 0 or len(test_palette) == 0:
+        return float('inf') if len(reference_palette) or len(test_palette) else 0.0
+
+    def lab(palette):
+        bgr = np.float32(palette).reshape((-1, 1, 3)) / 255.0
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2Lab).reshape((-1, 3))
+
+    a, b = lab(reference_palette), lab(test_palette)
+    distances = np.linalg.norm(a[:, None] - b[None], axis=2)
+    return float((distances.min(axis=1).sum() + distances.min(axis=0).sum())
+                 / (len(a) + len(b)))
+
+
+def edge_iou(reference, test):
+    """
+    Intersection over union of the edge lines of two cartoons.
+
+    Returns:
+        IoU between 0 and 1 (1.0 when neither image has lines)
+    """
+    reference_lines, test_lines = line_mask(reference), line_mask(test)
+    union = np.count_nonzero(reference_lines | test_lines)
+    if union == 0:
+        return 1.0
+    return np.count_nonzero(reference_lines & test_lines) / union
+
+
+def score(reference, test):
+    """
+    Score a cartoon against the reference cartoon of the same image.
+
+    Returns:
+        Dictionary with the psnr, ssim, palette_distance and edge_iou scores
+    """
+    return {
+        'psnr': psnr(reference, test),
+        'ssim': ssim(reference, test),
+        'palette_distance': palette_distance(cartoon_palette(reference), cartoon_palette(test)),
+        'edge_iou': edge_iou(reference, test),
+    }
+
+
+def timed_cartoonize(params, img, repeat=1):
+    """
+    Cartoonize an image with fresh Cartoonizer settings, without caching.
+
+    Returns:
+        Tuple (cartoon, seconds), with the minimum time over the repeats
+    """
+    cartoonizer = Cartoonizer(cache_bytes=0, palette_cache_entries=0)
+    cartoonizer.update_parameters(**dict(BASE_PARAMS, **params))
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cartoon = cartoonizer.cartoonize(img)
+        seconds = min(seconds, time.perf_counter() - start)
+    return cartoon, seconds
+
+
+def check_thresholds(scores, thresholds):
+    """
+    List the thresholds a configuration's scores do not meet.
+
+    Args:
+        scores: Dictionary of scores, see score
+        thresholds: Dictionary with min_ and max_ prefixed score names
+
+    Returns:
+        List of failure descriptions (empty when every threshold is met)
+    """
+    failures = []
+    for name, limit in thresholds.items():
+        if limit is None:
+            continue
+        bound, metric = name.split('_', 1)
+        value = scores[metric]
+        if (bound == 'min' and value < limit) or (bound == 'max' and value > limit):
+            failures.append(f"{metric} {value:.3f} {'<' if bound == 'min' else '>'} {limit:g}")
+    return failures
+
+
+def run_fidelity(images, configs, reference_params=None, thresholds=THRESHOLDS, repeat=1,
+                 verbose=True):
+    """
+    Score every configuration against the reference pipeline on every image.
+
+    Args:
+        images: Iterable of (name, loader) pairs, where loader returns the image
+        configs: Dictionary mapping configuration names to Cartoonizer parameters,
+            applied on top of the reference parameters so that only the
+            approximation differs from the reference
+        reference_params: Parameters of the reference (default parameters if None)
+        thresholds: Pass thresholds, see THRESHOLDS
+        repeat: Number of timed runs per cartoon (minimum is kept)
+        verbose: Print one line per measurement
+
+    Returns:
+        Dictionary with run metadata, per-image results and per-configuration
+        summaries with their mean scores, speedup and pass/fail status
+    """
+    reference_params = reference_params or {}
+    config_params = {name: {**reference_params, **params} for name, params in configs.items()}
+    results = []
+    for image_name, load in images:
+        img = load()
+        reference, reference_seconds = timed_cartoonize(reference_params, img, repeat)
+        for config_name, params in config_params.items():
+            cartoon, seconds = timed_cartoonize(params, img, repeat)
+            scores = score(reference, cartoon)
+            results.append({'config': config_name, 'image': image_name, 'scores': scores,
+                            'seconds': seconds, 'reference_seconds': reference_seconds,
+                            'speedup': reference_seconds / seconds if seconds > 0 else 0.0})
+            if verbose:
+                print(f"{image_name} [{config_name}]: x{results[-1]['speedup']:.2f}, "
+                      f"PSNR {scores['psnr']:.1f} dB, SSIM {scores['ssim']:.3f}, "
+                      f"palette dE {scores['palette_distance']:.2f}, "
+                      f"edge IoU {scores['edge_iou']:.3f}")
+        del img
+
+    summaries = {}
+    for config_name, params in configs.items():
+        config_results = [r for r in results if r['config'] == config_name]
+        if not config_results:
+            continue
+        metrics = config_results[0]['scores']
+        mean_scores = {metric: float(np.mean([r['scores'][metric] for r in config_results]))
+                       for metric in metrics}
+        worst_scores = {metric: float(max(r['scores'][metric] for r in config_results)
+                                      if metric == 'palette_distance'
+                                      else min(r['scores'][metric] for r in config_results))
+                        for metric in metrics}
+        total = sum(r['seconds'] for r in config_results)
+        reference_total = sum(r['reference_seconds'] for r in config_results)
+        failures = check_thresholds(mean_scores, thresholds)
+        summaries[config_name] = {
+            'params': params,
+            'effective_params': config_params[config_name],
+            'mean_scores': mean_scores,
+            'worst_scores': worst_scores,
+            'speedup': reference_total / total if total > 0 else 0.0,
+            'passed': not failures,
+            'failures': failures,
+        }
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+            'reference_params': reference_params,
+            'base_params': BASE_PARAMS,
+            'thresholds': thresholds,
+        },
+        'results': results,
+        'summaries': summaries,
+    }
+
+
+def main(argv=None):
+    """Command line entry point for the fidelity harness."""
+    parser = argparse.ArgumentParser(
+        description="Score faster configurations against the reference cartoonization.")
+    parser.add_argument('--dataset', default='dataset',
+                        help="Directory of real images ('' to skip, default: dataset)")
+    parser.add_argument('--max-megapixels', type=float, default=None,
+                        help="Skip dataset images larger than this")
+    parser.add_argument('--resolutions', type=float, nargs='*', default=[0.25, 1],
+                        help="Synthetic image sizes in megapixels (default: 0.25 1)")
+    parser.add_argument('--configs', nargs='*', default=list(FAST_CONFIGS),
+                        help=f"Configurations to score (default: {' '.join(FAST_CONFIGS)})")
+    parser.add_argument('--config-file', default=None,
+                        help="JSON file mapping extra configuration names to parameters")
+    parser.add_argument('--reference', default=None,
+                        help="JSON object of reference parameters (default: Cartoonizer defaults)")
+    parser.add_argument('--repeat', type=int, default=1, help="Timed runs per cartoon (minimum is kept)")
+    parser.add_argument('--min-psnr', type=float, default=THRESHOLDS['min_psnr'],
+                        help=f"Minimum mean PSNR in dB (default: {THRESHOLDS['min_psnr']:g})")
+    parser.add_argument('--min-ssim', type=float, default=THRESHOLDS['min_ssim'],
+                        help=f"Minimum mean SSIM (default: {THRESHOLDS['min_ssim']:g})")
+    parser.add_argument('--max-palette-distance', type=float,
+                        default=THRESHOLDS['max_palette_distance'],
+                        help="Maximum mean palette distance in CIELAB delta E "
+                             f"(default: {THRESHOLDS['max_palette_distance']:g})")
+    parser.add_argument('--min-edge-iou', type=float, default=THRESHOLDS['min_edge_iou'],
+                        help=f"Minimum mean edge IoU (default: {THRESHOLDS['min_edge_iou']:g})")
+    parser.add_argument('--output', default='fidelity.json', help="Results file (default: fidelity.json)")
+    args = parser.parse_args(argv)
+
+    available = dict(FAST_CONFIGS)
+    if args.config_file:
+        with open(args.config_file) as f:
+            available.update(json.load(f))
+    configs = {name: available[name] for name in args.configs}
+    thresholds = {'min_psnr': args.min_psnr, 'min_ssim': args.min_ssim,
+                  'max_palette_distance': args.max_palette_distance,
+                  'min_edge_iou': args.min_edge_iou}
+    reference_params = json.loads(args.reference) if args.reference else None
+
+    inputs = benchmark_inputs(args.dataset, args.resolutions, args.max_megapixels)
+    report = run_fidelity(inputs, configs, reference_params, thresholds, args.repeat)
+
+    for config_name, summary in report['summaries'].items():
+        status = "ok" if summary['passed'] else "FAIL (" + ", ".join(summary['failures']) + ")"
+        scores = summary['mean_scores']
+        print(f"[{config_name}] x{summary['speedup']:.2f} speedup, PSNR {scores['psnr']:.1f} dB, "
+              f"SSIM {scores['ssim']:.3f}, palette dE {scores['palette_distance']:.2f}, "
+              f"edge IoU {scores['edge_iou']:.3f}: {status}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Fidelity results saved to {args.output}")
+    return 0 if all(s['passed'] for s in report['summaries'].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+import io
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# Output formats: file extension and the cv2.imwrite flag set by the quality option
+# (quality 0-100 for JPEG and WebP, compression level 0-9 for PNG)
+WRITE_FORMATS = {
+    'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+
+# Reduced decoding flags by downscaling factor, largest first; JPEG decoders
+# skip most of the work at these factors, other formats are resized after decoding
+REDUCED_COLOR_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                       (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# JPEG start-of-frame markers, which hold the image size
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_size(path):
+    """
+    Read the size of a JPEG, PNG or WebP image from its header, without decoding it.
+
+    The size is the one stored in the file, before any EXIF rotation.
+
+    Args:
+        path: Path of the image
+
+    Returns:
+        Tuple (width, height), or None for other formats or unreadable headers
+    """
+    try:
+        with open(path, 'rb') as f:
+            return _header_size(f)
+    except OSError:
+        return None
+
+
+def encoded_image_size(data):
+    """
+    Read the size of an encoded JPEG, PNG or WebP image from its header, without decoding it.
+
+    Args:
+        data: Encoded image bytes
+
+    Returns:
+        Tuple (width, height), or None for other formats or unreadable headers
+    """
+    return _header_size(io.BytesIO(data))
+
+
+def _header_size(f):
+    """Parse the image size from the header of an open binary file, see image_size."""
+    try:
+        head = f.read(30)
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+            return _webp_size(head)
+        if not head.startswith(b'\xff\xd8'):
+            return None
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] in (0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xFF):
+                # Markers without a payload (0xFF is fill before a marker)
+                if marker[1] == 0xFF:
+                    f.seek(-1, os.SEEK_CUR)
+                continue
+            length = struct.unpack('>H', f.read(2))[0]
+            if marker[1] in _JPEG_SOF_MARKERS:
+                height, width = struct.unpack('>xHH', f.read(5))
+                return width, height
+            f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def _webp_size(head):
+    """Parse the canvas size from the first 30 bytes of a WebP file."""
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and head[20] == 0x2F:
+        bits = struct.unpack('<I', head[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        return int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+    return None
+
+
+def reduction_factor(size, max_size):
+    """
+    Largest reduced-decoding factor that keeps an image at least max_size.
+
+    Args:
+        size: Tuple (width, height) of the full image
+        max_size: Longest side in pixels, or a (width, height) box the image is
+            fitted into
+
+    Returns:
+        1, 2, 4 or 8
+    """
+    box = (max_size, max_size) if isinstance(max_size, int) else max_size
+    # Sorted sides, so an EXIF rotation of the image cannot make the result too small
+    scale = min(max(box) / max(size), min(box) / min(size))
+    for factor, _ in REDUCED_COLOR_FLAGS:
+        if factor * scale <= 1:
+            return factor
+    return 1
+
+
+def fit_size(img, max_size):
+    """
+    Downscale an image so that it fits max_size, preserving its aspect ratio.
+
+    Args:
+        img: Input image
+        max_size: Longest side in pixels, or a (width, height) box
+
+    Returns:
+        The image itself if it already fits, otherwise a resized copy
+    """
+    height, width = img.shape[:2]
+    box = (max_size, max_size) if isinstance(max_size, int) else max_size
+    scale = min(box[0] / width, box[1] / height)
+    if scale >= 1:
+        return img
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def read_reduced(path, max_size):
+    """
+    Decode a color image at the smallest reduced resolution that is still at least max_size.
+
+    JPEG images are decoded at 1/2, 1/4 or 1/8 scale, which is several times
+    faster than decoding every pixel.
+
+    Args:
+        path: Path of the image
+        max_size: Longest side in pixels, or a (width, height) box, that the caller needs
+
+    Returns:
+        Tuple (image, factor) with the BGR image (None if the file cannot be
+        decoded) and the factor its sides were divided by
+    """
+    size = image_size(path)
+    factor = reduction_factor(size, max_size) if size else 1
+    return cv2.imread(path, dict(REDUCED_COLOR_FLAGS).get(factor, cv2.IMREAD_COLOR)), factor
+
+
+def read_image(path, max_size=None, fit=False):
+    """
+    Decode a color image, at reduced resolution when a smaller size is enough.
+
+    Args:
+        path: Path of the image
+        max_size: Longest side in pixels, or a (width, height) box, that the
+            caller needs; None decodes at full resolution
+        fit: Also downscale the result to fit max_size exactly
+
+    Returns:
+        BGR image, or None if the file cannot be decoded (like cv2.imread)
+    """
+    if max_size is None:
+        return cv2.imread(path)
+    img, _ = read_reduced(path, max_size)
+    if img is not None and fit:
+        img = fit_size(img, max_size)
+    return img
+
+
+def output_path(path, output_format=None):
+    """
+    Path of an output file in a given format.
+
+    Args:
+        path: Path whose extension is replaced
+        output_format: Key of WRITE_FORMATS, or None to keep the extension
+
+    Returns:
+        Output path
+    """
+    if output_format is None:
+        return path
+    extension, _ = _write_format(output_format)
+    return os.path.splitext(path)[0] + extension
+
+
+def encode_params(path, quality=None):
+    """
+    cv2.imwrite parameters for the format of a path.
+
+    Args:
+        path: Output path, whose extension selects the format
+        quality: Quality (0-100) for JPEG and WebP, compression level (0-9)
+            for PNG, or None for OpenCV's defaults
+
+    Returns:
+        List of cv2.imwrite parameters
+    """
+    if quality is None:
+        return []
+    _, flag = _write_format(os.path.splitext(path)[1].lstrip('.'))
+    return [flag, int(quality)]
+
+
+def _write_format(output_format):
+    """Look up an output format, by name or extension."""
+    try:
+        return WRITE_FORMATS[output_format.lower()]
+    except KeyError:
+        raise ValueError(f"Unsupported output format: {output_format}") from None
+
+
+def write_image(path, img, quality=None):
+    """
+    Encode and write an image, raising on failure.
+
+    Args:
+        path: Output path, whose extension selects the format
+        img: Image to write
+        quality: Format-specific quality, see encode_params
+
+    Returns:
+        The output path
+    """
+    if not cv2.imwrite(path, img, encode_params(path, quality)):
+        raise IOError(f"could not write {path}")
+    return path
+
+
+class ImageWriter:
+    """
+    Encode and write images on a pool of threads.
+
+    cv2.imwrite releases the GIL, so encoding overlaps with the processing of
+    the next image. At most max_pending writes are queued at once; submit
+    blocks beyond that, which bounds the memory held by images waiting to be
+    written.
+    """
+
+    def __init__(self, workers=2, max_pending=8, quality=None):
+        """
+        Initialize the writer.
+
+        Args:
+            workers: Number of encoding threads
+            max_pending: Maximum number of writes queued or running
+            quality: Default format-specific quality, see encode_params
+        """
+        self.quality = quality
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-writer')
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, path, img, quality=None):
+        """
+        Queue an image for writing.
+
+        The image must not be modified until the write is done.
+
+        Args:
+            path: Output path, whose extension selects the format
+            img: Image to write
+            quality: Format-specific quality (defaults to the writer's)
+
+        Returns:
+            Future resolving to the output path, or raising IOError
+        """
+        return self.call(write_image, path, img, self.quality if quality is None else quality)
+
+    def call(self, function, *args):
+        """
+        Run any writing function, e.g. a comparison writer, on the pool.
+
+        Returns:
+            Future of the function's result
+        """
+        self.slots.acquire()
+        try:
+            future = self.pool.submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def close(self, wait=True):
+        """Stop the pool, by default after finishing the queued writes."""
+        self.pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,80 @@
+from collections import namedtuple
+
+# Passed to Cartoonizer observers after every stage: the stage name, its wall
+# time in seconds, the input shape, the bytes of the stage output and whether
+# the output came from the stage cache
+StageEvent = namedtuple('StageEvent', ['stage', 'seconds', 'shape', 'nbytes', 'cached'])
+
+# Short stage names used in formatted reports
+STAGE_LABELS = {
+    'apply_bilateral_filter': 'bilateral',
+    'upsample': 'upsample',
+    'color_quantization': 'quantization',
+    'edge_detection': 'edges',
+    'bitwise_and': 'combine',
+}
+
+
+class TimingReport:
+    """
+    An observer that collects stage events and summarizes them per stage.
+
+    Register it with Cartoonizer.add_observer, or use Cartoonizer.instrument()
+    which does so for the duration of a with block.
+    """
+
+    def __init__(self):
+        """Initialize an empty report."""
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def per_stage(self):
+        """
+        Aggregate the collected events by stage, in first-seen order.
+
+        Returns:
+            Dictionary mapping stage names to dictionaries with the number of
+            calls, cache hits, total seconds and total output bytes
+        """
+        stages = {}
+        for event in self.events:
+            totals = stages.setdefault(event.stage, {'calls': 0, 'cache_hits': 0,
+                                                     'seconds': 0.0, 'nbytes': 0})
+            totals['calls'] += 1
+            totals['cache_hits'] += int(event.cached)
+            totals['seconds'] += event.seconds
+            totals['nbytes'] += event.nbytes
+        return stages
+
+    def total_seconds(self):
+        """Total time spent in all recorded stages."""
+        return sum(event.seconds for event in self.events)
+
+    def format(self):
+        """
+        Format the per-stage timings on one line, e.g. for a status bar.
+
+        Returns:
+            String such as "bilateral 0.052s, quantization 0.031s (cached), ..."
+        """
+        return format_stages(self.per_stage())
+
+
+def format_stages(stages):
+    """
+    Format aggregated stage timings on one line.
+
+    Args:
+        stages: Dictionary as returned by TimingReport.per_stage
+
+    Returns:
+        String such as "bilateral 0.052s, quantization 0.031s (cached), ..."
+    """
+    parts = []
+    for stage, totals in stages.items():
+        label = STAGE_LABELS.get(stage, stage)
+        cached = " (cached)" if totals['cache_hits'] == totals['calls'] else ""
+        parts.append(f"{label} {totals['seconds']:.3f}s{cached}")
+    return ", ".join(parts)
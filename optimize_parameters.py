@@ -1,68 +1,113 @@
-import cv2
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-from cartoonizer import Cartoonizer
+from cartoonizer import save_preset
+from batch_processor import list_images, process_batch
+from comparison import save_comparison
+from image_io import read_image
+from parameter_sweep import expand_grid, run_sweep
 
-def optimize_parameters():
+# Parameter combinations tested by optimize_parameters and tune_parameters
+PARAMETER_GRID = {
+    'bilateral_filter_d': [5, 9, 13],
+    ('bilateral_sigma_color', 'bilateral_sigma_space'): [(50, 50), (75, 75), (100, 100)],
+    ('edge_threshold1', 'edge_threshold2'): [(30, 100), (50, 150), (70, 200)],
+    'total_color_levels': [4, 8, 12],
+}
+
+def optimize_parameters(dataset_dir='dataset', output_dir='optimized_results',
+                        contact_sheet=False, workers=None, max_size=None):
     """
     Test different parameter combinations to find optimal settings for cartoonization.
-    """
-    # Create cartoonizer instance
-    cartoonizer = Cartoonizer()
     
-    # Get list of images in dataset directory
-    dataset_dir = 'dataset'
-    image_files = [f for f in os.listdir(dataset_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
-    
-    # Create output directory
-    output_dir = 'optimized_results'
-    os.makedirs(output_dir, exist_ok=True)
+    Stages shared between combinations (9 bilateral settings, 3 edge maps and
+    27 quantizations for the 81 combinations) are computed only once.
     
+    Args:
+        dataset_dir: Directory containing the input images
+        output_dir: Directory the results are written to
+        contact_sheet: Write a single contact sheet instead of one image per combination
+        workers: Number of threads (defaults to the CPU count)
+        max_size: Run the sweep on the test image downscaled to at most this many
+            pixels per side (JPEGs are decoded at reduced resolution)
+        
+    Returns:
+        List of sweep index entries, one per combination
+    """
     # Select a test image (using the first image in the dataset)
-    test_image_path = os.path.join(dataset_dir, image_files[0])
-    img = cv2.imread(test_image_path)
+    test_image_path = list_images(dataset_dir)[0]
+    img = read_image(test_image_path, max_size, fit=True)
     
     # Parameter combinations to test
-    bilateral_d_values = [5, 9, 13]
-    bilateral_sigma_values = [50, 75, 100]
-    edge_threshold_values = [(30, 100), (50, 150), (70, 200)]
-    color_levels_values = [4, 8, 12]
+    grid = PARAMETER_GRID
+    
+    def param_name(params):
+        return (f"d{params['bilateral_filter_d']}_sigma{params['bilateral_sigma_color']}"
+                f"_edge{params['edge_threshold1']}_{params['edge_threshold2']}"
+                f"_colors{params['total_color_levels']}")
+    
+    # Test all combinations, sharing the stages they have in common
+    entries = run_sweep(img, grid, output_dir, workers=workers, contact_sheet=contact_sheet,
+                        name_fn=param_name)
     
-    # Test different parameter combinations
-    for d in bilateral_d_values:
-        for sigma in bilateral_sigma_values:
-            for edge_thresholds in edge_threshold_values:
-                for color_levels in color_levels_values:
-                    # Update parameters
-                    cartoonizer.update_parameters(
-                        bilateral_filter_d=d,
-                        bilateral_sigma_color=sigma,
-                        bilateral_sigma_space=sigma,
-                        edge_threshold1=edge_thresholds[0],
-                        edge_threshold2=edge_thresholds[1],
-                        total_color_levels=color_levels
-                    )
-                    
-                    # Apply cartoonization
-                    cartoon = cartoonizer.cartoonize(img)
-                    
-                    # Save the result
-                    param_str = f"d{d}_sigma{sigma}_edge{edge_thresholds[0]}_{edge_thresholds[1]}_colors{color_levels}"
-                    output_path = os.path.join(output_dir, f"param_{param_str}.jpg")
-                    cv2.imwrite(output_path, cartoon)
-                    
-                    print(f"Tested parameters: {param_str}")
+    print(f"Parameter optimization completed. Results saved to '{output_dir}' directory.")
+    return entries
+
+def tune_parameters(dataset_dir='dataset', preset_path='preset.json', objective='color_fidelity',
+                    budget_seconds=300.0, grid=PARAMETER_GRID, max_images=3):
+    """
+    Find good parameters automatically instead of inspecting every combination.
     
-    print("Parameter optimization completed. Results saved to 'optimized_results' directory.")
+    Successive halving scores all combinations on downscaled images and only
+    the best ones at full resolution, within a time budget (see
+    auto_tuner.successive_halving). The winner is saved as a preset that
+    batch_processor.py --preset and load_preset read back.
+    
+    Args:
+        dataset_dir: Directory containing the images to tune on
+        preset_path: Path of the preset file written
+        objective: Name in auto_tuner.OBJECTIVES, or a callable (img, cartoon, seconds) -> score
+        budget_seconds: Time budget of the search
+        grid: Parameter grid, see parameter_sweep.expand_grid
+        max_images: Number of dataset images to tune on
+        
+    Returns:
+        Search result as returned by successive_halving
+    """
+    # Imported here: the tuner pulls in the fidelity and benchmark tools
+    from auto_tuner import successive_halving
+    
+    images = [img for img in map(read_image, list_images(dataset_dir)[:max_images])
+              if img is not None]
+    result = successive_halving(images, expand_grid(grid), objective, budget_seconds)
+    save_preset(result['params'], preset_path,
+                {'objective': result['objective'], 'score': result['score']})
+    print(f"Best parameters: {result['params']}. Preset saved to '{preset_path}'.")
+    return result
 
-def test_all_images():
+def test_all_images(dataset_dir='dataset', output_dir='final_results', workers=None,
+                    incremental=False, output_format=None, quality=None, max_size=None):
     """
     Test cartoonization on all images in the dataset with optimized parameters.
+    
+    Images are processed in parallel; unreadable files are reported and skipped
+    instead of aborting the run. In incremental mode, images already processed
+    with the same content and parameters are not processed again.
+    
+    Args:
+        dataset_dir: Directory containing the input images
+        output_dir: Directory the results are written to
+        workers: Number of worker processes (defaults to the CPU count)
+        incremental: Skip images that are up to date in the output manifest
+            instead of processing every image
+        output_format: 'jpg', 'png' or 'webp' for every output (None keeps the input format)
+        quality: Quality (0-100) for JPEG and WebP, compression level (0-9) for PNG
+        max_size: Downscale the inputs to at most this many pixels per side
+        
+    Returns:
+        Batch summary as produced by batch_processor.summarize
     """
-    # Create cartoonizer instance with optimized parameters
-    cartoonizer = Cartoonizer()
-    cartoonizer.update_parameters(
+    # Optimized parameters
+    params = dict(
         line_size=7,
         bilateral_filter_d=9,
         bilateral_sigma_color=75,
@@ -72,57 +117,25 @@ def test_all_images():
         total_color_levels=8
     )
     
-    # Get list of images in dataset directory
-    dataset_dir = 'dataset'
-    image_files = [f for f in os.listdir(dataset_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
-    
-    # Create output directory
-    output_dir = 'final_results'
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Process each image
-    for image_file in image_files:
-        # Read image
-        image_path = os.path.join(dataset_dir, image_file)
-        img = cv2.imread(image_path)
-        
-        # Apply cartoonization
-        cartoon = cartoonizer.cartoonize(img)
-        
-        # Save the result
-        output_path = os.path.join(output_dir, f"cartoon_{image_file}")
-        cv2.imwrite(output_path, cartoon)
-        
-        # Create comparison image
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        cartoon_rgb = cv2.cvtColor(cartoon, cv2.COLOR_BGR2RGB)
-        
-        plt.figure(figsize=(12, 6))
-        
-        plt.subplot(1, 2, 1)
-        plt.imshow(img_rgb)
-        plt.title('Original Image')
-        plt.axis('off')
-        
-        plt.subplot(1, 2, 2)
-        plt.imshow(cartoon_rgb)
-        plt.title('Cartoonized Image')
-        plt.axis('off')
-        
-        plt.tight_layout()
-        
-        # Save the comparison
-        comparison_path = os.path.join(output_dir, f"comparison_{image_file}")
-        plt.savefig(comparison_path)
-        plt.close()
-        
-        print(f"Processed {image_file} - Result saved to {output_path}")
+    # Process each image and save it with a comparison
+    summary = process_batch(list_images(dataset_dir), output_dir, params, workers,
+                            comparison_writer=save_comparison,
+                            summary_path=os.path.join(output_dir, 'summary.json'),
+                            manifest_path=(os.path.join(output_dir, 'manifest.json')
+                                           if incremental else None),
+                            output_format=output_format, quality=quality, max_size=max_size)
     
-    print("All images processed. Results saved to 'final_results' directory.")
+    print(f"All images processed ({summary['succeeded']} succeeded, {summary['skipped']} up to date, "
+          f"{summary['failed']} failed). "
+          f"Results saved to '{output_dir}' directory.")
+    return summary
 
 if __name__ == "__main__":
     # Uncomment to run parameter optimization
     # optimize_parameters()
     
+    # Or to tune the parameters automatically within a time budget
+    # tune_parameters(budget_seconds=300)
+    
     # Test all images with optimized parameters
     test_all_images()
@@ -0,0 +1,267 @@
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+
+import cv2
+import numpy as np
+from cartoonizer import Cartoonizer
+from image_io import ImageWriter
+from stage_cache import image_key
+
+
+def expand_grid(grid):
+    """
+    Expand a parameter grid into the list of all combinations.
+
+    A key may also be a tuple of parameter names whose values are tuples, to
+    vary several parameters together, e.g.
+    {('edge_threshold1', 'edge_threshold2'): [(30, 100), (50, 150)]}.
+
+    Args:
+        grid: Dictionary mapping parameter names to lists of values
+
+    Returns:
+        List of dictionaries of Cartoonizer parameters
+    """
+    names = list(grid)
+    combinations = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = {}
+        for name, value in zip(names, values):
+            if isinstance(name, tuple):
+                params.update(zip(name, value))
+            else:
+                params[name] = value
+        combinations.append(params)
+    return combinations
+
+
+def build_sweep_graph(img, combinations, base_params=None):
+    """
+    Build the dependency graph of stage computations for a sweep.
+
+    Stages are keyed like the Cartoonizer stage cache, by the image and only
+    the parameters each stage depends on, so combinations sharing a stage
+    input share a single node.
+
+    Args:
+        img: Input image
+        combinations: List of parameter dictionaries
+        base_params: Parameters applied before each combination
+
+    Returns:
+        Tuple (nodes, outputs): nodes maps each key to a (function, dependency keys)
+        pair, where the function is called with the dependency results; outputs
+        lists the key of the final cartoon of each combination
+    """
+    key = image_key(img)
+    nodes = {}
+    outputs = []
+    for index, params in enumerate(combinations):
+        cartoonizer = Cartoonizer(cache_bytes=0)
+        cartoonizer.update_parameters(**(base_params or {}))
+        cartoonizer.update_parameters(**params)
+
+        bilateral_key, quantization_key, edge_key = cartoonizer.stage_keys(key)
+        nodes.setdefault(bilateral_key, (partial(cartoonizer.apply_bilateral_filter, img), ()))
+        nodes.setdefault(quantization_key, (cartoonizer.color_quantization, (bilateral_key,)))
+        nodes.setdefault(edge_key, (partial(cartoonizer.edge_mask, img), ()))
+
+        output_key = ('cartoon', index)
+        nodes[output_key] = (cartoonizer.apply_edges, (quantization_key, edge_key))
+        outputs.append(output_key)
+    return nodes, outputs
+
+
+def execute_graph(nodes, outputs, on_output, workers=None):
+    """
+    Run a stage graph, computing independent nodes in parallel.
+
+    A node is submitted as soon as all of its dependencies are available, and
+    each intermediate result is released once every node using it has run, so
+    memory holds only the results still needed. OpenCV releases the GIL, so
+    a thread pool runs stages concurrently.
+
+    Args:
+        nodes: Graph as returned by build_sweep_graph
+        outputs: Keys of the output nodes; their results are passed to on_output
+            instead of being kept
+        on_output: Callable (key, result) invoked in the calling thread
+        workers: Number of threads (defaults to the CPU count)
+    """
+    consumers = {key: 0 for key in nodes}
+    waiting = {}
+    for key, (_, deps) in nodes.items():
+        waiting[key] = len(deps)
+        for dep in deps:
+            consumers[dep] += 1
+    dependents = {key: [] for key in nodes}
+    for key, (_, deps) in nodes.items():
+        for dep in deps:
+            dependents[dep].append(key)
+    output_keys = set(outputs)
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        def submit(key):
+            func, deps = nodes[key]
+            future = pool.submit(func, *(results[dep] for dep in deps))
+            running[future] = key
+
+        running = {}
+        for key, count in waiting.items():
+            if count == 0:
+                submit(key)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                result = future.result()
+                if key in output_keys:
+                    on_output(key, result)
+                else:
+                    results[key] = result
+                for dep in nodes[key][1]:
+                    consumers[dep] -= 1
+                    if consumers[dep] == 0:
+                        del results[dep]
+                for dependent in dependents[key]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        submit(dependent)
+
+
+def default_name(params):
+    """Build a file-name friendly label from a parameter dictionary."""
+    return "_".join(f"{name}{value}" for name, value in params.items())
+
+
+def make_contact_sheet(thumbnails, labels, columns=None, label_height=24):
+    """
+    Arrange thumbnails in a labelled grid.
+
+    Args:
+        thumbnails: List of images of equal size
+        labels: Caption drawn under each thumbnail
+        columns: Number of grid columns (defaults to a square-ish grid)
+        label_height: Height in pixels of the caption strip
+
+    Returns:
+        Tuple (sheet, positions) with the contact sheet image and the (row, column)
+        of each thumbnail
+    """
+    columns = columns or int(np.ceil(np.sqrt(len(thumbnails))))
+    rows = int(np.ceil(len(thumbnails) / columns))
+    cell_height, cell_width = thumbnails[0].shape[:2]
+    cell_height += label_height
+    sheet = np.full((rows * cell_height, columns * cell_width, 3), 255, np.uint8)
+    positions = []
+    for i, (thumbnail, label) in enumerate(zip(thumbnails, labels)):
+        row, column = divmod(i, columns)
+        y, x = row * cell_height, column * cell_width
+        sheet[y:y + thumbnail.shape[0], x:x + thumbnail.shape[1]] = thumbnail
+        cv2.putText(sheet, label, (x + 4, y + cell_height - 8), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.35, (0, 0, 0), 1, cv2.LINE_AA)
+        positions.append((row, column))
+    return sheet, positions
+
+
+def write_index(entries, output_dir, name='index'):
+    """
+    Write the sweep index as both JSON and CSV.
+
+    Args:
+        entries: List of dictionaries with at least a 'params' dictionary
+        output_dir: Directory the index files are written to
+        name: Base file name of the index files
+
+    Returns:
+        Tuple with the JSON and CSV paths
+    """
+    json_path = os.path.join(output_dir, f"{name}.json")
+    with open(json_path, 'w') as f:
+        json.dump(entries, f, indent=2)
+
+    param_names = list(dict.fromkeys(p for entry in entries for p in entry['params']))
+    other_names = [k for k in entries[0] if k != 'params'] if entries else []
+    csv_path = os.path.join(output_dir, f"{name}.csv")
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(other_names + param_names)
+        for entry in entries:
+            writer.writerow([entry.get(k) for k in other_names]
+                            + [entry['params'].get(p) for p in param_names])
+    return json_path, csv_path
+
+
+def run_sweep(img, grid, output_dir, base_params=None, workers=None, contact_sheet=False,
+              thumbnail_width=256, name_fn=default_name, verbose=True):
+    """
+    Cartoonize an image for every combination of a parameter grid.
+
+    Each distinct stage input is computed once and shared by all the
+    combinations that need it. Results are written as one JPEG per
+    combination, or as a single contact sheet, together with an index.
+    Results are encoded on writer threads while the sweep carries on.
+
+    Args:
+        img: Input image
+        grid: Parameter grid, see expand_grid
+        output_dir: Directory the results are written to
+        base_params: Parameters applied before each combination
+        workers: Number of threads (defaults to the CPU count)
+        contact_sheet: Write one contact sheet instead of a file per combination
+        thumbnail_width: Width of the contact sheet thumbnails
+        name_fn: Callable building a label from a parameter dictionary
+        verbose: Print progress
+
+    Returns:
+        List of index entries, one per combination
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    combinations = expand_grid(grid)
+    nodes, outputs = build_sweep_graph(img, combinations, base_params)
+    names = [name_fn(params) for params in combinations]
+    entries = [{'index': i, 'name': names[i], 'params': params}
+               for i, params in enumerate(combinations)]
+    thumbnails = [None] * len(combinations)
+    thumbnail_size = (thumbnail_width,
+                      max(1, round(img.shape[0] * thumbnail_width / img.shape[1])))
+
+    writes = []
+
+    def on_output(key, cartoon):
+        index = key[1]
+        if contact_sheet:
+            thumbnails[index] = cv2.resize(cartoon, thumbnail_size, interpolation=cv2.INTER_AREA)
+        else:
+            output_path = os.path.join(output_dir, f"param_{names[index]}.jpg")
+            writes.append(writer.submit(output_path, cartoon))
+            entries[index]['output'] = output_path
+        if verbose:
+            print(f"Tested parameters: {names[index]}")
+
+    start = time.perf_counter()
+    with ImageWriter() as writer:
+        execute_graph(nodes, outputs, on_output, workers)
+
+        if contact_sheet:
+            sheet, positions = make_contact_sheet(thumbnails, names)
+            sheet_path = os.path.join(output_dir, 'contact_sheet.jpg')
+            writes.append(writer.submit(sheet_path, sheet))
+            for entry, (row, column) in zip(entries, positions):
+                entry.update(output=sheet_path, row=row, column=column)
+        write_index(entries, output_dir)
+    for future in writes:
+        # Raise the first write error, if any
+        future.result()
+
+    if verbose:
+        stages = len(nodes) - len(outputs)
+        print(f"Computed {stages} stage results for {len(combinations)} combinations "
+              f"(instead of {3 * len(combinations)}) in {time.perf_counter() - start:.1f}s")
+    return entries
@@ -0,0 +1,464 @@
+import json
+
+import cv2
+import numpy as np
+
+
+def sample_pixels(data, sample_size, method='random', rng=None):
+    """
+    Select a subset of pixels to fit a palette on.
+
+    Args:
+        data: Pixel array of shape (height, width, 3)
+        sample_size: Number of pixels to select (at most)
+        method: 'random' for uniform sampling or 'stratified' for one jittered
+            pixel per cell of a regular grid covering the image
+        rng: numpy Generator used for the random choices
+
+    Returns:
+        float32 array of shape (n, 3) with the sampled pixels
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    height, width = data.shape[:2]
+    total = height * width
+    if sample_size is None or sample_size >= total:
+        return np.float32(data).reshape((-1, 3))
+
+    if method == 'random':
+        index = rng.choice(total, size=sample_size, replace=False)
+        return np.float32(data.reshape((-1, 3))[index])
+    if method == 'stratified':
+        # Cells of total / sample_size pixels, square where the image allows it;
+        # on thin images the cells span the short side and stretch along the long one
+        area = total / sample_size
+        short, long = sorted((height, width))
+        short_step = max(1, min(int(np.sqrt(area)), short))
+        long_step = max(1, min(int(round(area / short_step)), long))
+        row_step, col_step = (short_step, long_step) if height <= width else (long_step, short_step)
+        rows = np.arange(0, height - row_step + 1, row_step)
+        cols = np.arange(0, width - col_step + 1, col_step)
+        rows = rows[:, None] + rng.integers(0, row_step, size=(len(rows), len(cols)))
+        cols = cols[None, :] + rng.integers(0, col_step, size=(len(rows), len(cols)))
+        samples = np.float32(data[rows, cols]).reshape((-1, 3))
+        if len(samples) > sample_size:
+            # Rounding the steps down can leave a few cells too many
+            samples = samples[np.sort(rng.choice(len(samples), size=sample_size, replace=False))]
+        return samples
+    raise ValueError(f"Unknown sample method: {method}")
+
+
+def kmeans_palette(samples, levels, attempts=10, seed=None):
+    """
+    Fit a palette with K-means clustering.
+
+    Args:
+        samples: float32 array of shape (n, 3)
+        levels: Number of palette colors, reduced to n when there are fewer samples
+        attempts: Number of K-means restarts
+        seed: Seed for OpenCV's random generator, or None for nondeterministic output
+
+    Returns:
+        float32 array of shape (min(levels, n), 3) with the cluster centers
+    """
+    if len(samples) == 0:
+        raise ValueError("Cannot fit a palette on zero samples")
+    levels = min(levels, len(samples))
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.001)
+    if seed is not None:
+        cv2.setRNGSeed(seed)
+    _, _, center = cv2.kmeans(samples, levels, None, criteria, attempts,
+                              cv2.KMEANS_RANDOM_CENTERS)
+    return center
+
+
+def palette_labels(pixels, palette, chunk_size=1 << 20):
+    """
+    Find the nearest palette color of every pixel.
+
+    Squared distances are expanded as |x|^2 - 2 x.c + |c|^2, so each chunk of
+    pixels costs a single matrix product.
+
+    Args:
+        pixels: Array of shape (n, 3)
+        palette: Array of shape (k, 3) with the palette colors
+        chunk_size: Number of pixels processed per step, bounding temporary memory
+
+    Returns:
+        Tuple (labels, distances) with the int32 index of the nearest color and
+        the squared distance to it for every pixel
+    """
+    palette = np.float32(palette)
+    norms = np.einsum('ij,ij->i', palette, palette)
+    labels = np.empty(len(pixels), np.int32)
+    distances = np.empty(len(pixels), np.float32)
+    for start in range(0, len(pixels), chunk_size):
+        chunk = np.float32(pixels[start:start + chunk_size])
+        scores = norms - 2.0 * (chunk @ palette.T)
+        best = np.argmin(scores, axis=1)
+        labels[start:start + chunk_size] = best
+        distances[start:start + chunk_size] = (np.take_along_axis(scores, best[:, None], 1)[:, 0]
+                                               + np.einsum('ij,ij->i', chunk, chunk))
+    return labels, distances
+
+
+def assign_to_palette(data, palette, chunk_size=1 << 20, out=None):
+    """
+    Map every pixel to its nearest palette color.
+
+    Squared distances are expanded as |c|^2 - 2 x.c (the |x|^2 term does not
+    change the argmin), so each chunk of pixels costs a single matrix product.
+
+    Args:
+        data: Pixel array of shape (height, width, 3)
+        palette: Array of shape (k, 3) with the palette colors
+        chunk_size: Number of pixels processed per step, bounding temporary memory
+        out: Optional contiguous uint8 array of the same shape as data to write into
+
+    Returns:
+        uint8 image of the same shape as data
+    """
+    pixels = data.reshape((-1, 3))
+    palette = np.float32(palette)
+    palette_u8 = np.uint8(np.clip(np.rint(palette), 0, 255))
+    norms = np.einsum('ij,ij->i', palette, palette)
+    result = np.empty(pixels.shape, np.uint8) if out is None else out.reshape(pixels.shape)
+    for start in range(0, len(pixels), chunk_size):
+        chunk = np.float32(pixels[start:start + chunk_size])
+        scores = norms - 2.0 * (chunk @ palette.T)
+        np.take(palette_u8, np.argmin(scores, axis=1), axis=0,
+                out=result[start:start + chunk_size])
+    return result.reshape(data.shape)
+
+
+def refine_palette(samples, palette, max_iter=5, eps=0.5):
+    """
+    Refine an existing palette with a single warm-started K-means run.
+
+    The samples are labelled with their nearest palette color and K-means
+    continues from there, so a palette that is already close converges in a
+    few iterations without random restarts.
+
+    Args:
+        samples: float32 array of shape (n, 3)
+        palette: Array of shape (k, 3) used as the starting centers
+        max_iter: Maximum number of K-means iterations
+        eps: Stop once the centers move less than this
+
+    Returns:
+        float32 array of shape (k, 3) with the refined centers
+    """
+    return warm_start_kmeans(samples, palette, max_iter, eps)[1]
+
+
+def warm_start_kmeans(samples, palette, max_iter=5, eps=0.5):
+    """
+    Run K-means from an existing palette, as refine_palette, keeping the labels.
+
+    Args:
+        samples: float32 array of shape (n, 3)
+        palette: Array of shape (k, 3) used as the starting centers
+        max_iter: Maximum number of K-means iterations
+        eps: Stop once the centers move less than this
+
+    Returns:
+        Tuple (labels, centers) with the int32 (n, 1) labels and the float32
+        (k, 3) refined centers
+    """
+    labels, _ = palette_labels(samples, palette)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, max_iter, eps)
+    _, labels, center = cv2.kmeans(samples, len(palette), labels.reshape((-1, 1)), criteria, 1,
+                                   cv2.KMEANS_USE_INITIAL_LABELS)
+    return labels, center
+
+
+def resize_palette(palette, levels, samples):
+    """
+    Grow or shrink a palette to a number of colors, as a K-means starting point.
+
+    Shrinking repeatedly merges the two closest colors. Growing repeatedly
+    adds the sample farthest from the current colors, which is where the
+    palette represents the image worst.
+
+    Args:
+        palette: Array of shape (k, 3)
+        levels: Number of colors wanted
+        samples: float32 array of shape (n, 3) of pixels of the image
+
+    Returns:
+        float32 array of shape (levels, 3)
+    """
+    palette = [np.float32(color) for color in palette]
+    while len(palette) > levels:
+        colors = np.array(palette)
+        distances = np.sum((colors[:, None] - colors[None]) ** 2, axis=2)
+        distances[np.diag_indices(len(colors))] = np.inf
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        merged = (palette[i] + palette[j]) / 2
+        palette = [color for k, color in enumerate(palette) if k not in (i, j)] + [merged]
+    while len(palette) < levels:
+        _, distances = palette_labels(samples, np.array(palette))
+        palette.append(np.float32(samples[np.argmax(distances)]))
+    return np.array(palette, np.float32)
+
+
+def histogram_index(img, bits=5):
+    """
+    Compute each pixel's bin in a reduced-bit 3D color histogram.
+
+    Args:
+        img: uint8 image of shape (height, width, 3)
+        bits: Bits kept per channel, giving (2**bits)**3 bins
+
+    Returns:
+        int32 array of shape (height, width) with the bin index of each pixel
+    """
+    shift = 8 - bits
+    reduced = img >> shift
+    return ((reduced[..., 0].astype(np.int32) << (2 * bits))
+            | (reduced[..., 1].astype(np.int32) << bits)
+            | reduced[..., 2])
+
+
+def histogram_totals(img, bits=5):
+    """
+    Accumulate pixel counts and color sums over a reduced-bit color histogram.
+
+    The totals of several images or tiles can be added together before
+    calling histogram_bins, which allows a histogram to be built piecewise.
+
+    Args:
+        img: uint8 image of shape (height, width, 3)
+        bits: Bits kept per channel
+
+    Returns:
+        Tuple (counts, sums) of arrays with (2**bits)**3 entries: the pixel
+        count of each bin and the per-channel sum of its pixel colors
+    """
+    index = histogram_index(img, bits).ravel()
+    size = 1 << (3 * bits)
+    counts = np.bincount(index, minlength=size)
+    pixels = img.reshape((-1, 3))
+    sums = np.stack([np.bincount(index, weights=pixels[:, c], minlength=size)
+                     for c in range(3)], axis=1)
+    return counts, sums
+
+
+def histogram_bins(counts, sums):
+    """
+    Reduce histogram totals to their non-empty bins.
+
+    Args:
+        counts: Pixel count of every bin, as returned by histogram_totals
+        sums: Color sums of every bin, as returned by histogram_totals
+
+    Returns:
+        Tuple (bins, counts, means) for the non-empty bins: their indices, pixel
+        counts and the mean color of the pixels falling into each of them
+    """
+    bins = np.flatnonzero(counts)
+    return bins, counts[bins], sums[bins] / counts[bins, None]
+
+
+def color_histogram(img, bits=5):
+    """
+    Build a reduced-bit color histogram in one pass over the image.
+
+    Args:
+        img: uint8 image of shape (height, width, 3)
+        bits: Bits kept per channel
+
+    Returns:
+        Tuple (bins, counts, means) as returned by histogram_bins
+    """
+    return histogram_bins(*histogram_totals(img, bits))
+
+
+def _bin_coords(bins, bits):
+    """Split histogram bin indices into per-channel coordinates."""
+    mask = (1 << bits) - 1
+    return np.stack([(bins >> (2 * bits)) & mask, (bins >> bits) & mask, bins & mask], axis=1)
+
+
+def _weighted_means(groups, counts, means, n_groups):
+    """Average bin colors within each group, weighted by pixel count."""
+    weight = np.bincount(groups, weights=counts, minlength=n_groups)
+    totals = np.stack([np.bincount(groups, weights=counts * means[:, c], minlength=n_groups)
+                       for c in range(3)], axis=1)
+    return np.float32(totals / np.maximum(weight, 1)[:, None])
+
+
+def median_cut_palette(counts, means, levels):
+    """
+    Derive a palette by recursive median cut of the color histogram.
+
+    The box holding the most pixels times its longest side is split along that
+    side at the pixel-weighted median until there are levels boxes.
+
+    Args:
+        counts: Pixel count of each non-empty histogram bin
+        means: Mean color of each non-empty histogram bin
+        levels: Number of palette colors
+
+    Returns:
+        float32 array of shape (k, 3) with k <= levels palette colors
+    """
+    boxes = [np.arange(len(counts))]
+    while len(boxes) < levels:
+        best, best_score, best_axis = None, 0.0, 0
+        for i, box in enumerate(boxes):
+            if len(box) < 2:
+                continue
+            extent = means[box].max(axis=0) - means[box].min(axis=0)
+            axis = int(np.argmax(extent))
+            score = counts[box].sum() * extent[axis]
+            if score > best_score:
+                best, best_score, best_axis = i, score, axis
+        if best is None:
+            break
+        box = boxes.pop(best)
+        box = box[np.argsort(means[box, best_axis], kind='stable')]
+        cumulative = np.cumsum(counts[box])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2.0)) + 1
+        split = min(max(split, 1), len(box) - 1)
+        boxes.extend([box[:split], box[split:]])
+
+    groups = np.empty(len(counts), np.int64)
+    for i, box in enumerate(boxes):
+        groups[box] = i
+    return _weighted_means(groups, counts, means, len(boxes))
+
+
+def octree_palette(bins, counts, means, levels, bits=5):
+    """
+    Derive a palette by octree reduction of the color histogram.
+
+    Histogram bins are the leaves of an octree over the color cube. Going up
+    one tree level at a time, the nodes covering the fewest pixels are merged
+    into single leaves until at most levels leaves remain.
+
+    Args:
+        bins: Indices of the non-empty histogram bins
+        counts: Pixel count of each non-empty bin
+        means: Mean color of each non-empty bin
+        levels: Maximum number of palette colors
+        bits: Bits per channel used to build the histogram
+
+    Returns:
+        float32 array of shape (k, 3) with k <= levels palette colors
+    """
+    coords = _bin_coords(bins, bits)
+    # Each leaf is identified by (depth, node code); all bins start as their own leaf
+    leaf_depth = np.full(len(bins), bits)
+    leaf_code = bins.astype(np.int64)
+    for depth in range(bits - 1, -1, -1):
+        leaves, groups = np.unique(np.stack([leaf_depth, leaf_code], axis=1),
+                                   axis=0, return_inverse=True)
+        groups = groups.ravel()
+        excess = len(leaves) - levels
+        if excess <= 0:
+            break
+        shift = bits - depth
+        parent = (((coords[:, 0] >> shift) << (2 * depth))
+                  | ((coords[:, 1] >> shift) << depth) | (coords[:, 2] >> shift))
+        parents, parent_groups = np.unique(parent, return_inverse=True)
+        parent_groups = parent_groups.ravel()
+        # Distinct leaves under each parent: merging a parent removes children - 1 leaves
+        children = np.bincount(parent_groups[np.unique(groups, return_index=True)[1]],
+                               minlength=len(parents))
+        weight = np.bincount(parent_groups, weights=counts, minlength=len(parents))
+        order = np.argsort(weight, kind='stable')
+        saved = np.cumsum(children[order] - 1)
+        n_merge = int(np.searchsorted(saved, excess)) + 1
+        merged = np.zeros(len(parents), bool)
+        merged[order[:n_merge]] = True
+        selected = merged[parent_groups]
+        leaf_depth[selected] = depth
+        leaf_code[selected] = parent[selected]
+
+    _, groups = np.unique(np.stack([leaf_depth, leaf_code], axis=1),
+                          axis=0, return_inverse=True)
+    groups = groups.ravel()
+    return _weighted_means(groups, counts, means, groups.max() + 1)
+
+
+def palette_lut(palette, bits=5):
+    """
+    Precompute the nearest palette color for every histogram bin.
+
+    Args:
+        palette: Array of shape (k, 3) with the palette colors
+        bits: Bits per channel of the lookup table
+
+    Returns:
+        uint8 array of shape ((2**bits)**3, 3) indexed by histogram bin
+    """
+    size = 1 << bits
+    scale = 1 << (8 - bits)
+    grid = np.indices((size, size, size)).reshape(3, -1).T
+    centers = np.float32(grid * scale + (scale - 1) / 2.0)
+    return assign_to_palette(centers, palette)
+
+
+def apply_lut(img, lut, bits=5, out=None):
+    """
+    Map an image through a palette lookup table with a single fancy index.
+
+    Args:
+        img: uint8 image of shape (height, width, 3)
+        lut: Lookup table produced by palette_lut
+        bits: Bits per channel of the lookup table
+        out: Optional uint8 array of the same shape as img to write into
+
+    Returns:
+        uint8 image of the same shape as img
+    """
+    return np.take(lut, histogram_index(img, bits), axis=0, out=out)
+
+
+def save_palette(palette, path):
+    """
+    Write a palette to a JSON file.
+
+    Args:
+        palette: Array of shape (k, 3) with BGR palette colors
+        path: Path of the palette file
+    """
+    colors = np.clip(np.rint(np.float32(palette)), 0, 255).astype(int).tolist()
+    with open(path, 'w') as f:
+        json.dump({'order': 'BGR', 'colors': colors}, f, indent=2)
+
+
+def load_palette(path):
+    """
+    Read a palette written by save_palette.
+
+    Args:
+        path: Path of the palette file
+
+    Returns:
+        float32 array of shape (k, 3) with BGR palette colors
+    """
+    with open(path) as f:
+        data = json.load(f)
+    palette = np.float32(data['colors']).reshape((-1, 3))
+    if data.get('order', 'BGR') == 'RGB':
+        palette = palette[:, ::-1].copy()
+    return palette
+
+
+def image_palette(img):
+    """
+    List the distinct colors of an image, e.g. of a quantized image.
+
+    Args:
+        img: uint8 image of shape (height, width, 3)
+
+    Returns:
+        uint8 array of shape (k, 3) with the distinct colors
+    """
+    pixels = img.reshape((-1, 3))
+    codes = ((pixels[:, 0].astype(np.int32) << 16) | (pixels[:, 1].astype(np.int32) << 8)
+             | pixels[:, 2])
+    codes = np.unique(codes)
+    return np.stack([codes >> 16, (codes >> 8) & 255, codes & 255], axis=1).astype(np.uint8)
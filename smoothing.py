@@ -0,0 +1,233 @@
+import cv2
+import numpy as np
+
+SMOOTHING_ENGINES = ('bilateral', 'iterative', 'layered')
+
+
+def _kernel_radius(d, sigma_space):
+    """Radius of cv2.bilateralFilter's window for a diameter (derived from sigma when d <= 0)."""
+    return d // 2 if d > 0 else int(round(sigma_space * 1.5))
+
+
+def _effective_sigma(d, sigma_space):
+    """
+    Spatial standard deviation of cv2.bilateralFilter's truncated kernel.
+
+    With the usual settings sigma_space is much larger than the window, so the
+    kernel is close to a flat disk whose spread is set by the diameter alone.
+    """
+    radius = max(_kernel_radius(d, sigma_space), 1)
+    return min(sigma_space, np.sqrt(((2 * radius + 1) ** 2 - 1) / 12.0))
+
+
+def iterative_bilateral(img, d, sigma_color, sigma_space, pass_d=5):
+    """
+    Approximate a wide bilateral filter with repeated small-diameter passes.
+
+    The cost of cv2.bilateralFilter grows with the window area, while the
+    spatial variance of repeated passes adds up, so (r / r0)^2 passes of
+    radius r0 cover a radius r window at a fraction of the cost. The color
+    sigma is reduced with the number of passes to keep the overall range
+    smoothing comparable.
+
+    Args:
+        img: Input image
+        d: Diameter of the bilateral filter being approximated
+        sigma_color: Filter sigma in the color space
+        sigma_space: Filter sigma in the coordinate space
+        pass_d: Diameter of each pass
+
+    Returns:
+        Filtered image
+    """
+    radius = _kernel_radius(d, sigma_space)
+    pass_radius = pass_d // 2
+    if radius <= pass_radius:
+        return cv2.bilateralFilter(img, d, sigma_color, sigma_space)
+    passes = iterative_passes(d, sigma_space, pass_d)
+    pass_sigma_color = sigma_color / passes ** 0.25
+    filtered = img
+    for _ in range(passes):
+        filtered = cv2.bilateralFilter(filtered, pass_d, pass_sigma_color, sigma_space)
+    return filtered
+
+
+def iterative_passes(d, sigma_space, pass_d=5):
+    """Number of passes iterative_bilateral uses to cover a diameter d window."""
+    radius = _kernel_radius(d, sigma_space)
+    pass_radius = pass_d // 2
+    return max(1, int(round(radius ** 2 / pass_radius ** 2)))
+
+
+def layered_downsample(d, sigma_space):
+    """Downsampling factor layered_bilateral uses for the spatial blur."""
+    return max(2, int(_effective_sigma(d, sigma_space) / 1.5))
+
+
+def layered_bilateral(img, d, sigma_color, sigma_space, range_scale=2.0, intensity_range=None,
+                      origin=(0, 0), band=256):
+    """
+    Approximate a bilateral filter with piecewise-linear intensity layers.
+
+    Following Durand and Dorsey, the range kernel is evaluated for a small
+    set of intensity levels of the grayscale guide. For each level the image
+    weighted by that kernel is blurred spatially at reduced resolution, and
+    every pixel interpolates between the two levels surrounding its own
+    intensity. The number of levels depends on sigma_color only and the
+    spatial blur runs on a downsampled grid, so the cost does not grow with
+    the kernel diameter. The interpolation runs in bands of rows, so
+    full-resolution temporary memory does not grow with the number of levels.
+
+    The levels and the downsampling grid are set by intensity_range and
+    origin, so tiles of an image given the image's range and their own
+    position are filtered like the whole image.
+
+    Args:
+        img: Input image
+        d: Diameter of the bilateral filter being approximated
+        sigma_color: Filter sigma in the color space
+        sigma_space: Filter sigma in the coordinate space
+        range_scale: cv2.bilateralFilter sums the color difference over the
+            three channels, so the grayscale range sigma is sigma_color divided
+            by this factor (between 1 and 3; larger is more accurate but
+            needs more levels)
+        intensity_range: Tuple (low, high) of the gray levels spanned by the
+            levels (defaults to the range of img)
+        origin: Tuple (row, column) of img's top-left pixel in the whole image
+        band: Number of output rows interpolated at a time
+
+    Returns:
+        Filtered image
+    """
+    height, width = img.shape[:2]
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    sigma_range = max(sigma_color / range_scale, 1.0)
+    sigma_spatial = _effective_sigma(d, sigma_space)
+
+    low, high = intensity_range or (int(gray.min()), int(gray.max()))
+    high = max(high, low + 1)
+    count = max(2, int(np.ceil((high - low) / sigma_range)) + 1)
+    levels = np.linspace(low, high, count)
+    spacing = max(levels[1] - levels[0], 1e-6)
+
+    # Pad to whole cells of a downsampling grid aligned to the image's coordinates
+    factor = layered_downsample(d, sigma_space)
+    top, left = origin[0] % factor, origin[1] % factor
+    bottom, right = -(top + height) % factor, -(left + width) % factor
+    padded = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_REPLICATE)
+    padded_gray = cv2.copyMakeBorder(gray, top, bottom, left, right, cv2.BORDER_REPLICATE)
+    size = (padded.shape[1] // factor, padded.shape[0] // factor)
+    small = np.float32(cv2.resize(padded, size, interpolation=cv2.INTER_AREA))
+    small_gray = cv2.resize(padded_gray, size, interpolation=cv2.INTER_AREA)
+
+    # Range weights of every pixel for each level, blurred spatially on the small grid
+    intensity = np.arange(256, dtype=np.float32)
+    layers = []
+    for level in levels:
+        lut = np.exp(-(intensity - level) ** 2 / (2 * sigma_range ** 2)).astype(np.float32)
+        weights = cv2.LUT(small_gray, lut)
+        numerator = cv2.GaussianBlur(small * weights[..., None], (0, 0), sigma_spatial / factor)
+        denominator = cv2.GaussianBlur(weights, (0, 0), sigma_spatial / factor)
+        layers.append(numerator / np.maximum(denominator, 1e-6)[..., None])
+
+    result = np.empty(img.shape, np.uint8)
+    flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP
+    for row in range(0, height, band):
+        rows = min(band, height - row)
+        band_gray = gray[row:row + rows]
+        band_low, band_high = int(band_gray.min()), int(band_gray.max())
+        # Maps output pixel centers to small grid cell centers, as cv2.resize does
+        transform = np.float32([[1 / factor, 0, (left + 0.5) / factor - 0.5],
+                                [0, 1 / factor, (top + row + 0.5) / factor - 0.5]])
+        accumulated = np.zeros((rows, width, img.shape[2]), np.float32)
+        for level, layer in zip(levels, layers):
+            if level <= band_low - spacing or level >= band_high + spacing:
+                # No pixel of the band interpolates from this level
+                continue
+            hat = np.maximum(0, 1 - np.abs(intensity - level) / spacing).astype(np.float32)
+            upsampled = cv2.warpAffine(layer, transform, (width, rows), flags=flags,
+                                       borderMode=cv2.BORDER_REPLICATE)
+            accumulated += upsampled * cv2.LUT(band_gray, hat)[..., None]
+        result[row:row + rows] = np.clip(accumulated + 0.5, 0, 255)
+    return result
+
+
+def guided_upsample(small, small_guide, guide, radius=1, eps=1e-3, band=512):
+    """
+    Upsample a filtered image, following the edges of a full-resolution guide.
+
+    A guided filter (He et al.) is fitted at low resolution: every pixel of
+    the small image is modelled as a per-channel linear function a * I + b of
+    the small grayscale guide I. The coefficients are smooth, so they are
+    upsampled bilinearly and applied to the full-resolution guide, which
+    restores sharp edges where plain interpolation would blur them. The full
+    resolution work runs in bands of rows, so temporary memory does not grow
+    with the image.
+
+    Args:
+        small: Filtered low-resolution image
+        small_guide: Grayscale guide at the resolution of small
+        guide: Grayscale guide at the output resolution
+        radius: Radius of the guided filter windows at low resolution
+        eps: Regularization (on a 0-1 intensity scale); larger values smooth more
+        band: Number of output rows processed at a time
+
+    Returns:
+        uint8 image with the size of guide and the channels of small
+    """
+    guide_small = np.float32(small_guide) * (1 / 255.0)
+    source = np.float32(small) * (1 / 255.0)
+    size = (2 * radius + 1, 2 * radius + 1)
+
+    def box(x):
+        return cv2.boxFilter(x, -1, size, borderType=cv2.BORDER_REFLECT)
+
+    mean_guide = box(guide_small)
+    mean_source = box(source)
+    covariance = box(guide_small[..., None] * source) - mean_guide[..., None] * mean_source
+    variance = box(guide_small * guide_small) - mean_guide * mean_guide
+    a = covariance / (variance + eps)[..., None]
+    b = mean_source - a * mean_guide[..., None]
+    a = box(a)
+    b = box(b) * 255.0
+
+    height, width = guide.shape[:2]
+    scale_x = small.shape[1] / width
+    scale_y = small.shape[0] / height
+    result = np.empty((height, width, small.shape[2]), np.uint8)
+    for top in range(0, height, band):
+        rows = min(band, height - top)
+        # Maps output pixel centers to input pixel centers, as cv2.resize does
+        transform = np.float32([[scale_x, 0, 0.5 * scale_x - 0.5],
+                                [0, scale_y, (top + 0.5) * scale_y - 0.5]])
+        flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP
+        band_a = cv2.warpAffine(a, transform, (width, rows), flags=flags,
+                                borderMode=cv2.BORDER_REPLICATE)
+        band_b = cv2.warpAffine(b, transform, (width, rows), flags=flags,
+                                borderMode=cv2.BORDER_REPLICATE)
+        band_guide = cv2.cvtColor(guide[top:top + rows], cv2.COLOR_GRAY2BGR)
+        output = cv2.multiply(band_a, band_guide, dtype=cv2.CV_32F)
+        cv2.add(output, band_b, dst=output)
+        cv2.max(output, 0, dst=output)
+        result[top:top + rows] = cv2.convertScaleAbs(output)
+    return result
+
+
+def smoothing_radius(engine, d, sigma_space):
+    """
+    Support radius in pixels of a smoothing engine, used to size tile halos.
+
+    Args:
+        engine: Name of the smoothing engine
+        d: Bilateral filter diameter
+        sigma_space: Filter sigma in the coordinate space
+
+    Returns:
+        Radius beyond which input pixels do not affect the output
+    """
+    if engine == 'iterative':
+        return iterative_passes(d, sigma_space) * 2
+    if engine == 'layered':
+        factor = layered_downsample(d, sigma_space)
+        return int(np.ceil(4 * _effective_sigma(d, sigma_space))) + 2 * factor
+    return _kernel_radius(d, sigma_space)
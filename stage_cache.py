@@ -0,0 +1,199 @@
+import hashlib
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def image_key(img):
+    """
+    Compute a content key for an image.
+
+    The key combines the shape, dtype and a hash of the pixel data, so two
+    arrays holding the same pixels share cached stage results while an image
+    modified in place gets a new key.
+
+    Args:
+        img: Input image
+
+    Returns:
+        Hashable key identifying the image content
+    """
+    data = np.ascontiguousarray(img)
+    digest = hashlib.blake2b(data.data, digest_size=16).hexdigest()
+    return (data.shape, data.dtype.str, digest)
+
+
+class StageCache:
+    """
+    A bounded least-recently-used cache for intermediate pipeline results.
+
+    Entries are evicted in LRU order once either the entry count or the total
+    number of cached bytes exceeds its limit.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_entries=64):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes: Maximum total size of cached arrays in bytes
+            max_entries: Maximum number of cached entries
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self):
+        """Whether any result can be cached with the current limits."""
+        return self.max_bytes > 0 and self.max_entries > 0
+
+    def get(self, key):
+        """
+        Look up a cached result and mark it as recently used.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached array, or None if the key is not cached
+        """
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Store a result, evicting older entries if the limits are exceeded.
+
+        The stored array is marked read-only so callers cannot corrupt the
+        cached copy. Arrays larger than the byte limit are not cached.
+
+        Args:
+            key: Cache key
+            value: Array to cache
+
+        Returns:
+            The stored array
+        """
+        if value.nbytes > self.max_bytes or self.max_entries <= 0:
+            return value
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key).nbytes
+        value.setflags(write=False)
+        self._entries[key] = value
+        self.current_bytes += value.nbytes
+        while self.current_bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+        return value
+
+    def clear(self):
+        """Remove all cached entries and reset the counters."""
+        self._entries.clear()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+class PaletteCache:
+    """
+    A small cache of recent K-means palettes, looked up by image similarity.
+
+    Entries are matched on a tiny thumbnail of the image the palette was
+    fitted on, so a palette is found again for the same image and for close
+    variants of it, such as the image filtered with neighbouring bilateral
+    parameters or rendered at preview resolution.
+    """
+
+    def __init__(self, max_entries=8, tolerance=4.0, thumbnail_size=16):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of palettes kept (0 disables the cache)
+            tolerance: Largest mean absolute thumbnail difference, in gray
+                levels, for two images to be considered similar
+            thumbnail_size: Side of the square thumbnails compared
+        """
+        self.max_entries = max_entries
+        self.tolerance = tolerance
+        self.thumbnail_size = thumbnail_size
+        self._entries = []
+        self.hits = 0
+        self.misses = 0
+
+    def signature(self, img):
+        """
+        Compute the thumbnail an image is matched on.
+
+        Args:
+            img: uint8 image
+
+        Returns:
+            float32 thumbnail
+        """
+        size = (self.thumbnail_size, self.thumbnail_size)
+        return np.float32(cv2.resize(img, size, interpolation=cv2.INTER_AREA))
+
+    def get(self, signature, levels):
+        """
+        Find the palette of the most similar recent image.
+
+        Among the similar images, a palette with the requested number of
+        colors is preferred, then the closest level count.
+
+        Args:
+            signature: Thumbnail from signature()
+            levels: Number of colors wanted
+
+        Returns:
+            float32 array of shape (k, 3), or None if no recent image is similar
+        """
+        best, best_rank = None, None
+        for thumbnail, palette in self._entries:
+            distance = float(np.mean(np.abs(thumbnail - signature)))
+            if distance > self.tolerance:
+                continue
+            rank = (abs(len(palette) - levels), distance)
+            if best_rank is None or rank < best_rank:
+                best, best_rank = palette, rank
+        if best is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return best
+
+    def put(self, signature, palette):
+        """
+        Remember a palette, evicting the oldest entries beyond max_entries.
+
+        Args:
+            signature: Thumbnail from signature()
+            palette: Array of shape (k, 3) fitted on the image
+        """
+        if self.max_entries <= 0:
+            return
+        # A new palette of the same size for the same image replaces the old one
+        self._entries = [(thumbnail, old) for thumbnail, old in self._entries
+                         if len(old) != len(palette)
+                         or np.mean(np.abs(thumbnail - signature)) > self.tolerance]
+        self._entries.append((signature, np.float32(palette)))
+        del self._entries[:-self.max_entries]
+
+    def clear(self):
+        """Remove all cached palettes and reset the counters."""
+        self._entries = []
+        self.hits = 0
+        self.misses = 0
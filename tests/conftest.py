@@ -0,0 +1,30 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_image(height=96, width=128, seed=0):
+    """
+    Draw a small synthetic test image: flat shapes with sharp edges over a
+    gradient, plus mild noise, so every stage has something to work on.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.dstack([x * 255 // max(1, width - 1), y * 255 // max(1, height - 1),
+                     np.full((height, width), 96)]).astype(np.uint8)
+    cv2.rectangle(img, (width // 8, height // 8), (width // 2, height // 2), (40, 180, 220), -1)
+    cv2.circle(img, (3 * width // 4, 2 * height // 3), max(2, min(height, width) // 5),
+               (200, 60, 30), -1)
+    noise = rng.integers(-6, 7, img.shape)
+    return np.uint8(np.clip(img.astype(np.int16) + noise, 0, 255))
+
+
+@pytest.fixture
+def image():
+    return make_image()
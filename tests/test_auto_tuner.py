@@ -0,0 +1,74 @@
+import sys
+import time
+
+from auto_tuner import successive_halving
+from cartoonizer import Cartoonizer
+from conftest import make_image
+
+CANDIDATES = [{'total_color_levels': levels} for levels in range(2, 11)]
+
+
+def constant_score(img, cartoon, seconds):
+    return 0.0
+
+
+def test_default_spatial_parameters_are_scaled(monkeypatch):
+    seen = []
+
+    def cartoonize(self, img):
+        seen.append((img.shape[:2], self.bilateral_filter_d, self.line_size,
+                     self.bilateral_sigma_space))
+        return img
+
+    monkeypatch.setattr(Cartoonizer, 'cartoonize', cartoonize)
+    img = make_image(600, 800)
+    successive_halving([img], CANDIDATES, constant_score, min_megapixels=0.05, verbose=False)
+
+    small = [s for s in seen if s[0] != (600, 800)]
+    full = [s for s in seen if s[0] == (600, 800)]
+    assert small and full
+    # Candidates leave the spatial parameters at their defaults, which must follow the scale
+    assert all(d < 9 and line_size < 7 and line_size % 2 == 1 and sigma < 75
+               for _, d, line_size, sigma in small)
+    assert all(entry[1:] == (9, 7, 75) for entry in full)
+
+
+
+def test_base_params_overlapping_the_search_space(monkeypatch):
+    seen = []
+
+    def cartoonize(self, img):
+        seen.append(self.line_size)
+        return img
+
+    monkeypatch.setattr(Cartoonizer, 'cartoonize', cartoonize)
+    candidates = [{'line_size': 3}, {'line_size': 9}]
+    result = successive_halving([make_image()], candidates, constant_score,
+                                base_params={'random_seed': 0, 'line_size': 5}, verbose=False)
+    # Candidates override the fixed parameters they share a name with
+    assert set(seen) == {3, 9}
+    assert result['params']['line_size'] in (3, 9)
+
+def test_budget_is_checked_before_each_evaluation(monkeypatch):
+    # Evaluations take 1 second per megapixel: 0.16 s in the first rung, 0.48 s in the last
+    def cartoonize(self, img):
+        time.sleep(img.shape[0] * img.shape[1] / 1e6)
+        return img
+
+    monkeypatch.setattr(Cartoonizer, 'cartoonize', cartoonize)
+    img = make_image(600, 800)
+    budget = 2.2
+    result = successive_halving([img], CANDIDATES, constant_score, budget, min_megapixels=0.05,
+                                verbose=False)
+    # The first rung fits and a single full-resolution candidate after it; a second would not
+    assert result['elapsed_seconds'] <= budget
+    assert result['evaluations'] == len(CANDIDATES) + 1
+    assert result['params'] == dict(random_seed=0, **result['history'][-1]['params'])
+
+
+def test_tune_parameters_imports_the_tuner_lazily(monkeypatch):
+    monkeypatch.delitem(sys.modules, 'auto_tuner', raising=False)
+    monkeypatch.delitem(sys.modules, 'optimize_parameters', raising=False)
+    import optimize_parameters
+    assert optimize_parameters.tune_parameters
+    assert 'auto_tuner' not in sys.modules
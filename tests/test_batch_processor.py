@@ -0,0 +1,87 @@
+import os
+
+import cv2
+import pytest
+
+import batch_processor
+from batch_processor import (fit_batch_palette, iter_batch, process_batch, thread_budget,
+                             watch_directory)
+from conftest import make_image
+
+
+def crash_on_second(img, cartoon, path):
+    """Comparison writer killing its worker process on one image, like an OOM kill."""
+    if os.path.basename(path) == 'comparison_1.png':
+        os._exit(1)
+
+
+@pytest.fixture
+def images(tmp_path):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    paths = []
+    for i in range(4):
+        path = str(input_dir / f'{i}.png')
+        cv2.imwrite(path, make_image(48, 64, seed=i))
+        paths.append(path)
+    return paths
+
+
+PARAMS = {'quantization_mode': 'median_cut'}
+
+
+def test_inline_batch_writes_outputs_in_order(images, tmp_path):
+    bad = str(tmp_path / 'input' / 'bad.png')
+    with open(bad, 'wb') as f:
+        f.write(b'not an image')
+    records = list(iter_batch(images + [bad], str(tmp_path / 'out'), PARAMS, workers=1))
+    assert [r['input'] for r in records] == images + [bad]
+    assert [r['status'] for r in records] == ['ok'] * 4 + ['error']
+    for record in records[:4]:
+        assert cv2.imread(record['output']).shape == (48, 64, 3)
+
+
+def test_worker_crash_fails_only_affected_images(images, tmp_path):
+    summary = process_batch(images, str(tmp_path / 'out'), PARAMS, workers=2, max_in_flight=1,
+                            comparison_writer=crash_on_second, verbose=False)
+    statuses = [r['status'] for r in summary['images']]
+    assert statuses == ['ok', 'error', 'ok', 'ok']
+    assert 'BrokenProcessPool' in summary['images'][1]['error']
+
+
+def test_watch_directory_keeps_one_pool(images, tmp_path, monkeypatch):
+    executors = []
+
+    class CountingExecutor(batch_processor.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            executors.append(self)
+            super().__init__(*args, **kwargs)
+
+    # Two images arrive before the first poll, two more before the second
+    listings = iter([images[:2], images])
+    monkeypatch.setattr(batch_processor, 'ProcessPoolExecutor', CountingExecutor)
+    monkeypatch.setattr(batch_processor, 'list_images', lambda directory: next(listings))
+    processed = watch_directory(str(tmp_path / 'input'), str(tmp_path / 'out'), PARAMS, workers=2,
+                                interval=0, settle_seconds=0, max_polls=2, verbose=False)
+    assert processed == 4
+    assert len(executors) == 1
+
+
+def test_fit_batch_palette_honors_max_size(images, monkeypatch):
+    sizes = []
+    read_image = batch_processor.read_image
+
+    def spy(path, max_size=None, fit=False):
+        img = read_image(path, max_size, fit)
+        sizes.append(max(img.shape[:2]))
+        return img
+
+    monkeypatch.setattr(batch_processor, 'read_image', spy)
+    palette = fit_batch_palette(images, PARAMS, max_size=32)
+    assert palette.shape == (8, 3)
+    assert sizes and max(sizes) <= 32
+
+
+def test_thread_budget_splits_cores():
+    assert thread_budget(4, 8) == 2
+    assert thread_budget(16, 8) == 1
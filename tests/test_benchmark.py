@@ -0,0 +1,38 @@
+import pytest
+
+import benchmark
+from benchmark import CONFIGS, benchmark_image, compare_to_baseline, make_cartoonizer, run_benchmarks
+from conftest import make_image
+
+
+@pytest.mark.parametrize('config', ['reference', 'multiscale', 'tiled', 'reused_buffers'])
+def test_benchmark_runs_modes_through_cartoonize(config):
+    img = make_image(120, 160)
+    params = dict(CONFIGS[config])
+    if config == 'multiscale':
+        params['multiscale_megapixels'] = 0.005
+    elif config == 'tiled':
+        params['tile_size'] = 64
+    result = benchmark_image(make_cartoonizer(params), img, repeat=2)
+    assert {'apply_bilateral_filter', 'color_quantization', 'edge_detection',
+            'bitwise_and'} <= set(result['stages'])
+    if config == 'multiscale':
+        assert 'upsample' in result['stages']
+    assert result['total_seconds'] > 0 and result['peak_traced_bytes'] > img.nbytes
+
+
+def test_peak_rss_is_optional(monkeypatch):
+    monkeypatch.setattr(benchmark, 'resource', None)
+    report = run_benchmarks([('tiny', lambda: make_image(32, 48))], {'reference': {}},
+                            verbose=False)
+    assert report['meta']['peak_rss_kb'] is None
+
+
+def test_compare_to_baseline_flags_slowdowns():
+    def run(seconds):
+        return {'results': [{'config': 'reference', 'image': 'a', 'total_seconds': seconds,
+                             'stages': {'edge_detection': seconds}}]}
+
+    comparison, = compare_to_baseline(run(1.2), run(1.0), threshold=0.1)
+    assert comparison['regression'] and comparison['stage_ratios']['edge_detection'] == pytest.approx(1.2)
+    assert not compare_to_baseline(run(1.05), run(1.0), threshold=0.1)[0]['regression']
@@ -0,0 +1,89 @@
+import threading
+
+import numpy as np
+import pytest
+
+import cartoonizer as cartoonizer_module
+from cartoonizer import Cartoonizer
+from conftest import make_image
+from stage_cache import image_key
+
+
+class Failure(Exception):
+    pass
+
+
+def fail_on(stage, edges_started=None):
+    """Observer raising after a stage, once the edge branch is running if an event is given."""
+    def observer(event):
+        if event.stage == stage:
+            if edges_started is not None:
+                edges_started.wait(5)
+            raise Failure(stage)
+    return observer
+
+
+class SlowEdges:
+    """Holds the edge branch until released, so it outlives the color branch."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+
+@pytest.fixture
+def slow_edges(monkeypatch):
+    slow_edges = SlowEdges()
+    gray_edge_mask = Cartoonizer._gray_edge_mask
+
+    def slow(self, *args):
+        slow_edges.started.set()
+        slow_edges.release.wait(5)
+        return gray_edge_mask(self, *args)
+
+    monkeypatch.setattr(Cartoonizer, '_gray_edge_mask', slow)
+    return slow_edges
+
+
+@pytest.mark.parametrize('multiscale', [False, True])
+def test_failed_color_branch_does_not_poison_edge_cache(slow_edges, multiscale):
+    img = make_image(120, 160)
+    cartoonizer = Cartoonizer()
+    if multiscale:
+        cartoonizer.update_parameters(multiscale_megapixels=0.005)
+    stage = 'upsample' if multiscale else 'apply_bilateral_filter'
+    observer = fail_on(stage, slow_edges.started)
+    cartoonizer.add_observer(observer)
+    # Let the edge branch go once the failing call is already unwinding
+    threading.Timer(0.2, slow_edges.release.set).start()
+    with pytest.raises(Failure):
+        cartoonizer.cartoonize(img)
+    cartoonizer.remove_observer(observer)
+    cartoonizer.update_parameters(line_size=15, edge_threshold1=10)
+    slow_edges.release.set()
+    cartoonizer_module.branch_pool().submit(lambda: None).result()
+
+    cached = cartoonizer.stage_cache.get(('edges', image_key(img), 7, 50, 150))
+    expected = Cartoonizer(cache_bytes=0).edge_mask(img)
+    assert cached is not None
+    np.testing.assert_array_equal(cached, expected)
+
+
+def test_failed_batch_chunk_joins_its_edge_branch(slow_edges):
+    images = np.stack([make_image(48, 64, seed=i) for i in range(2)])
+    cartoonizer = Cartoonizer()
+    cartoonizer.add_observer(fail_on('color_quantization', slow_edges.started))
+    threading.Timer(0.2, slow_edges.release.set).start()
+    with pytest.raises(Failure):
+        cartoonizer.cartoonize_batch(images)
+    # The edge branch finished before the exception reached the caller
+    assert cartoonizer.counters['stage_seconds'].get('edge_detection', 0) > 0
+
+
+@pytest.mark.parametrize('concurrent', [True, False])
+def test_concurrent_branches_match_sequential(image, concurrent):
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(random_seed=0, concurrent_branches=concurrent)
+    reference = Cartoonizer(cache_bytes=0)
+    reference.update_parameters(random_seed=0, concurrent_branches=False)
+    np.testing.assert_array_equal(cartoonizer.cartoonize(image), reference.cartoonize(image))
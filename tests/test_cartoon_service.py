@@ -0,0 +1,125 @@
+import http.client
+import json
+import socket
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from cartoon_service import CartoonService, RequestError, make_server, parse_parameters
+from conftest import make_image
+
+
+def encode(img, extension='.png'):
+    return cv2.imencode(extension, img)[1].tobytes()
+
+
+@pytest.fixture
+def serve():
+    """Start a service and an HTTP server in front of it; yields a factory."""
+    running = []
+
+    def start(workers=1, queue_size=2, max_megapixels=50.0, **server_options):
+        service = CartoonService(workers, queue_size, max_megapixels=max_megapixels)
+        service.start()
+        server = make_server(service, port=0, **server_options)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        running.append((service, server))
+        return service, server
+
+    yield start
+    for service, server in running:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+
+def post(server, body, query=''):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=10)
+    connection.request('POST', '/cartoonize' + query, body)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+@pytest.mark.parametrize('query', ['line_size=8', 'line_size="7"', 'line_size=7.0',
+                                   'bilateral_filter_d=99', 'kmeans_attempts=1000',
+                                   'concurrent_branches=1', 'smoothing_engine=fast',
+                                   'palette=[[0,0]]'])
+def test_invalid_parameters_are_rejected(query):
+    name, value = query.split('=')
+    with pytest.raises(RequestError):
+        parse_parameters([(name, value)], {name})
+
+
+def test_valid_parameters_are_parsed():
+    query = [('line_size', '9'), ('bilateral_sigma_color', '60.5'), ('random_seed', 'null'),
+             ('quantization_mode', 'sampled'), ('palette', '[[0, 0, 0], [255, 255, 255]]')]
+    params = parse_parameters(query, {name for name, _ in query})
+    assert params['line_size'] == 9 and params['random_seed'] is None
+
+
+def test_service_cartoonizes_over_http(serve):
+    _, server = serve()
+    status, body = post(server, encode(make_image()), '?total_color_levels=4&random_seed=0')
+    assert status == 200
+    assert cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR).shape == (96, 128, 3)
+
+    status, body = post(server, encode(make_image()), '?line_size=8')
+    assert status == 400 and b'odd' in body
+
+
+@pytest.mark.parametrize('extension', ['.png', '.jpg', '.webp'])
+def test_oversized_image_is_rejected_before_decoding(extension, monkeypatch):
+    service = CartoonService(workers=0, max_megapixels=1.0)
+    service.start()
+
+    def imdecode(*args):
+        raise AssertionError("oversized image was decoded")
+
+    data = encode(np.zeros((1000, 1200, 3), np.uint8), extension)
+    monkeypatch.setattr(cv2, 'imdecode', imdecode)
+    with pytest.raises(RequestError, match='too large'):
+        service.submit(data)
+
+
+def test_full_queue_rejects_before_reading_upload(serve):
+    service, server = serve(workers=0, queue_size=1)
+    service.submit(encode(make_image()))
+    # Announce a large upload but never send it: reading it would block the handler
+    with socket.create_connection(('127.0.0.1', server.server_port), timeout=5) as client:
+        client.sendall(b'POST /cartoonize HTTP/1.1\r\nHost: localhost\r\n'
+                       b'Content-Length: 1000000\r\n\r\n')
+        response = client.recv(4096)
+    assert response.startswith(b'HTTP/1.0 429')
+    assert service.metrics.counts['rejected_full'] == 1
+
+
+def test_started_job_wait_is_bounded(serve, monkeypatch):
+    release = threading.Event()
+    service, server = serve(request_timeout=0.1, processing_timeout=0.2)
+    cartoonize = service._cartoonize
+
+    def slow(*args):
+        release.wait(5)
+        return cartoonize(*args)
+
+    monkeypatch.setattr(service, '_cartoonize', slow)
+    try:
+        status, body = post(server, encode(make_image()))
+    finally:
+        release.set()
+    assert status == 504
+    assert service.metrics.counts['timed_out'] == 1
+
+
+def test_connection_slots_are_released(serve):
+    _, server = serve(max_connections=1)
+    for _ in range(3):
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=5)
+        connection.request('GET', '/health')
+        response = connection.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read()) == {'status': 'ok'}
+        connection.close()
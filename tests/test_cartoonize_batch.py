@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from cartoonizer import Cartoonizer
+from conftest import make_image
+
+
+@pytest.fixture
+def images():
+    return np.stack([make_image(48, 64, seed=i) for i in range(5)])
+
+
+@pytest.mark.parametrize('params', [{}, {'quantization_mode': 'median_cut'},
+                                    {'palette': [[0, 0, 0], [255, 255, 255], [40, 180, 220]]}])
+def test_batch_matches_cartoonize(images, params):
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(random_seed=0, **params)
+    expected = np.stack([cartoonizer.cartoonize(img) for img in images])
+    np.testing.assert_array_equal(cartoonizer.cartoonize_batch(images, chunk_size=2), expected)
+
+
+def test_batch_between_memory_maps(images, tmp_path):
+    source = str(tmp_path / 'images.npy')
+    np.save(source, images)
+    out = np.lib.format.open_memmap(str(tmp_path / 'cartoons.npy'), mode='w+',
+                                    dtype=np.uint8, shape=images.shape)
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(quantization_mode='octree')
+    result = cartoonizer.cartoonize_batch(np.load(source, mmap_mode='r'), out, chunk_size=3)
+    assert result is out
+    np.testing.assert_array_equal(out, cartoonizer.cartoonize_batch(images))
+
+
+@pytest.mark.parametrize('bad', [np.zeros((4, 8, 3), np.uint8), np.zeros((1, 4, 8, 3), np.float32),
+                                 np.zeros((1, 4, 8, 4), np.uint8)])
+def test_batch_rejects_other_arrays(bad):
+    with pytest.raises(ValueError):
+        Cartoonizer(cache_bytes=0).cartoonize_batch(bad)
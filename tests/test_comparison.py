@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+
+from comparison import compose_grid, fit_to_cell, save_comparison
+
+
+def flat(height, width, color):
+    return np.full((height, width, 3), color, np.uint8)
+
+
+def test_fit_to_cell_centers_and_pads():
+    cell = fit_to_cell(flat(20, 40, (0, 0, 255)), 40, 40)
+    assert cell.shape == (40, 40, 3)
+    # Scaled to the full width, with the padding split above and below
+    assert (cell[10:30] == (0, 0, 255)).all()
+    assert (cell[:10] == 255).all() and (cell[30:] == 255).all()
+    assert fit_to_cell(np.zeros((10, 10), np.uint8), 5, 5).shape == (5, 5, 3)
+
+
+def test_grid_layout_and_size():
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (0, 0, 0), (128, 128, 128)]
+    images = [flat(30, 40, color) for color in colors[:4]] + [flat(60, 80, colors[4])]
+    grid = compose_grid(images, columns=3, gap=10)
+    # 3 columns and 2 rows of 40x30 cells, no title strips without titles
+    assert grid.shape == (2 * (30 + 10) + 10, 3 * (40 + 10) + 10, 3)
+    for i, color in enumerate(colors):
+        row, column = divmod(i, 3)
+        x, y = 10 + column * 50, 10 + row * 40
+        assert (grid[y:y + 30, x:x + 40] == color).all()
+    # The unused sixth cell stays background
+    assert (grid[50:80, 110:150] == 255).all()
+
+
+def test_titles_are_drawn_above_their_image():
+    images = [flat(30, 40, (0, 0, 255)), flat(30, 40, (255, 0, 0))]
+    titled = compose_grid(images, ['A', 'B'], title_height=20, gap=10)
+    untitled = compose_grid(images, gap=10)
+    assert titled.shape == (10 + 20 + 30 + 10, 2 * 50 + 10, 3)
+    for x in (10, 60):
+        strip = titled[10:30, x:x + 40]
+        assert (strip < 128).any()
+        assert (titled[30:60, x:x + 40] == images[x // 50][0, 0]).all()
+    # Different titles draw differently
+    assert not np.array_equal(titled[10:30, 10:50], titled[10:30, 60:100])
+    assert untitled.shape == (10 + 30 + 10, 2 * 50 + 10, 3)
+
+
+def test_save_comparison_puts_the_original_first(tmp_path):
+    path = str(tmp_path / 'comparison.png')
+    save_comparison(flat(30, 40, (0, 0, 255)), flat(30, 40, (255, 0, 0)), path, cell_width=40)
+    saved = cv2.imread(path)
+    assert saved.shape == (10 + 40 + 30 + 10, 2 * 50 + 10, 3)
+    assert (saved[50:80, 10:50] == (0, 0, 255)).all()
+    assert (saved[50:80, 60:100] == (255, 0, 0)).all()
@@ -0,0 +1,38 @@
+import numpy as np
+
+from cartoonizer import Cartoonizer
+from conftest import make_image
+from fidelity import THRESHOLDS, check_thresholds, run_fidelity, score
+
+
+def test_identical_cartoons_score_perfectly(image):
+    cartoon = Cartoonizer(cache_bytes=0).cartoonize(image)
+    scores = score(cartoon, cartoon.copy())
+    assert scores['psnr'] == 100.0
+    assert np.isclose(scores['ssim'], 1.0)
+    assert scores['palette_distance'] == 0.0
+    assert scores['edge_iou'] == 1.0
+    assert check_thresholds(scores, THRESHOLDS) == []
+
+
+def test_thresholds_report_each_failure():
+    scores = {'psnr': 30.0, 'ssim': 0.5, 'palette_distance': 12.0, 'edge_iou': 0.9}
+    failures = check_thresholds(scores, THRESHOLDS)
+    assert len(failures) == 2
+    assert failures[0].startswith('ssim') and failures[1].startswith('palette_distance')
+    # Thresholds set to None are not checked
+    assert check_thresholds(scores, dict(THRESHOLDS, min_ssim=None, max_palette_distance=None)) == []
+
+
+def test_configs_run_on_top_of_the_reference():
+    images = [('synthetic', lambda: make_image(48, 64))]
+    reference = {'total_color_levels': 4}
+    report = run_fidelity(images, {'same': {}, 'more_colors': {'total_color_levels': 12}},
+                          reference, verbose=False)
+    same = report['summaries']['same']
+    # A config without parameters of its own reproduces the reference exactly
+    assert same['effective_params'] == reference
+    assert same['passed'] and same['mean_scores']['psnr'] == 100.0
+    assert report['summaries']['more_colors']['effective_params'] == {'total_color_levels': 12}
+    assert report['summaries']['more_colors']['mean_scores']['psnr'] < 100.0
+    assert [r['config'] for r in report['results']] == ['same', 'more_colors']
@@ -0,0 +1,152 @@
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('tkinter')
+pytest.importorskip('PIL.ImageTk')
+
+import cartoon_gui
+from cartoon_gui import CartoonGUI
+from cartoonizer import Cartoonizer
+from conftest import make_image
+from stage_cache import image_key
+from viewport import DisplayPyramid
+
+
+def start_worker():
+    """Run the GUI's render worker without a window."""
+    gui = CartoonGUI.__new__(CartoonGUI)
+    gui.cartoonizer = Cartoonizer()
+    gui.current_image_path = None
+    gui.original_image = None
+    gui.render_generation = 1
+    gui.pending_job = None
+    gui.render_condition = threading.Condition()
+    gui.render_results = queue.Queue()
+    threading.Thread(target=gui.render_worker, daemon=True).start()
+    return gui
+
+
+def submit(gui, generation, image, params):
+    with gui.render_condition:
+        gui.pending_job = (generation, 'full', image, params)
+        gui.render_condition.notify()
+
+
+def test_cancel_then_update_renders_fresh_edges(monkeypatch):
+    img = make_image(120, 160)
+    first = {'line_size': 7, 'edge_threshold1': 50, 'random_seed': 0}
+    second = {'line_size': 15, 'edge_threshold1': 10, 'random_seed': 0}
+
+    # Keep the first job's edge branch running until it has been cancelled
+    started, release = threading.Event(), threading.Event()
+    gray_edge_mask = Cartoonizer._gray_edge_mask
+
+    def slow(self, *args):
+        started.set()
+        release.wait(5)
+        return gray_edge_mask(self, *args)
+
+    monkeypatch.setattr(Cartoonizer, '_gray_edge_mask', slow)
+    gui = start_worker()
+
+    def move_slider(event):
+        # The user changes a parameter while the first render is smoothing
+        if event.stage == 'apply_bilateral_filter' and gui.render_generation == 1:
+            started.wait(5)
+            gui.render_generation = 2
+            submit(gui, 2, img, second)
+            threading.Timer(0.2, release.set).start()
+
+    gui.cartoonizer.add_observer(move_slider)
+    submit(gui, 1, img, first)
+    generation, kind, cartoon, timing = gui.render_results.get(timeout=30)
+
+    assert generation == 2
+    reference = Cartoonizer(cache_bytes=0)
+    reference.update_parameters(**second)
+    np.testing.assert_array_equal(cartoon, reference.cartoonize(img))
+    # The cancelled job's edges are cached under its own parameters
+    cached = gui.cartoonizer.stage_cache.get(('edges', image_key(img), 7, 50, 150))
+    np.testing.assert_array_equal(cached, Cartoonizer(cache_bytes=0).edge_mask(img))
+
+
+class FakeRoot:
+    """Records the callbacks scheduled with after() instead of running a Tk loop."""
+
+    def __init__(self):
+        self.scheduled = {}
+
+    def after(self, ms, callback):
+        self.scheduled[len(self.scheduled) + 1] = callback
+        return len(self.scheduled)
+
+    def after_cancel(self, callback_id):
+        self.scheduled.pop(callback_id, None)
+
+
+class FakeStatus:
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+
+def fake_gui():
+    """A GUI with a half-size preview, whose render jobs are run by finish_job."""
+    img = make_image()
+    gui = CartoonGUI.__new__(CartoonGUI)
+    gui.root = FakeRoot()
+    gui.status_var = FakeStatus()
+    gui.original_image = img
+    gui.original_pyramid = DisplayPyramid(img)
+    gui.preview_image, gui.preview_scale = img[::2, ::2], 0.5
+    gui.current_image_path = None
+    gui.cartoon_image = None
+    gui.cartoon_generation = None
+    gui.render_generation = 1
+    gui.pending_job = None
+    gui.pending_save_path = None
+    gui.render_condition = threading.Condition()
+    gui.render_results = queue.Queue()
+    gui.debounce_id = gui.full_render_id = None
+    gui.full_render_delay_ms = 700
+    gui.slider_params = {'total_color_levels': 8}
+    gui.get_slider_params = lambda: dict(gui.slider_params)
+    gui.display_cartoon = gui.display_original = lambda image=None: None
+    return gui
+
+
+def finish_job(gui):
+    """Fake worker: complete the pending job with a cartoon identifying its parameters."""
+    generation, kind, image, params = gui.pending_job
+    gui.pending_job = None
+    cartoon = np.full(image.shape, params['total_color_levels'], np.uint8)
+    gui.render_results.put((generation, kind, cartoon, 'timing'))
+    gui.poll_render_results()
+
+
+def test_save_survives_a_slider_move(tmp_path, monkeypatch):
+    path = str(tmp_path / 'cartoon.png')
+    monkeypatch.setattr(cartoon_gui.filedialog, 'asksaveasfilename', lambda **options: path)
+    gui = fake_gui()
+    gui.save_cartoon()
+    assert gui.pending_job[1] == 'full'
+
+    # The slider moves before the full render finishes: the save job is superseded
+    gui.slider_params['total_color_levels'] = 4
+    gui.process_cartoon()
+    finish_job(gui)
+    assert gui.pending_job is None and not os.path.exists(path)
+
+    # The full render scheduled after the preview is the one saved
+    gui.root.scheduled[gui.full_render_id]()
+    finish_job(gui)
+    assert gui.pending_save_path is None
+    assert (cv2.imread(path) == 4).all()
+    assert gui.status_var.value == 'Saved: cartoon.png'
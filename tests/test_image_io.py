@@ -0,0 +1,57 @@
+import os
+
+import cv2
+import pytest
+
+from conftest import make_image
+from image_io import (ImageWriter, image_size, output_path, read_image, read_reduced,
+                      reduction_factor)
+
+
+@pytest.fixture
+def jpeg(tmp_path):
+    path = str(tmp_path / 'large.jpg')
+    cv2.imwrite(path, cv2.resize(make_image(), (1600, 1200)))
+    return path
+
+
+@pytest.mark.parametrize('extension', ['.jpg', '.png', '.webp'])
+def test_image_size_reads_the_header(tmp_path, extension):
+    path = str(tmp_path / ('image' + extension))
+    cv2.imwrite(path, make_image(37, 53))
+    assert image_size(path) == (53, 37)
+
+
+def test_image_size_of_other_formats_is_unknown(tmp_path):
+    path = str(tmp_path / 'image.bmp')
+    cv2.imwrite(path, make_image())
+    assert image_size(path) is None
+    assert image_size(str(tmp_path / 'missing.jpg')) is None
+
+
+@pytest.mark.parametrize('max_size, factor', [(1600, 1), (800, 2), (400, 4), (150, 8), (100, 8),
+                                              ((400, 400), 4)])
+def test_reduction_factor_keeps_at_least_max_size(max_size, factor):
+    assert reduction_factor((1600, 1200), max_size) == factor
+
+
+def test_read_reduced_decodes_at_reduced_size(jpeg):
+    img, factor = read_reduced(jpeg, 400)
+    assert factor == 4 and img.shape == (300, 400, 3)
+    assert read_image(jpeg, 300, fit=True).shape == (225, 300, 3)
+    assert read_image(jpeg).shape == (1200, 1600, 3)
+
+
+def test_image_writer_writes_in_the_background(tmp_path):
+    img = make_image()
+    with ImageWriter(workers=2, max_pending=2) as writer:
+        futures = [writer.submit(output_path(str(tmp_path / f'{i}.png'), 'jpg'), img, quality=90)
+                   for i in range(4)]
+    paths = [future.result() for future in futures]
+    assert [os.path.basename(p) for p in paths] == ['0.jpg', '1.jpg', '2.jpg', '3.jpg']
+    assert all(cv2.imread(p).shape == img.shape for p in paths)
+
+    with ImageWriter() as writer:
+        failed = writer.submit(str(tmp_path / 'missing' / 'out.png'), img)
+    with pytest.raises(IOError):
+        failed.result()
@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from cartoonizer import Cartoonizer
+from conftest import make_image
+from instrumentation import format_stages
+
+
+def run_with_timeout(function, seconds=30):
+    """Run a function on a thread, failing if it does not return in time (e.g. a deadlock)."""
+    errors = []
+
+    def target():
+        try:
+            function()
+        except BaseException as exc:
+            errors.append(exc)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    assert not thread.is_alive(), "call did not return"
+    if errors:
+        raise errors[0]
+
+
+def test_report_collects_every_stage(image):
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    with cartoonizer.instrument() as report:
+        cartoonizer.cartoonize(image)
+    stages = report.per_stage()
+    assert set(stages) == {'apply_bilateral_filter', 'color_quantization', 'edge_detection',
+                           'bitwise_and'}
+    assert all(totals['calls'] == 1 for totals in stages.values())
+    assert 'bilateral' in format_stages(stages)
+    assert not cartoonizer.observers
+
+
+@pytest.mark.parametrize('concurrent', [True, False])
+def test_observers_may_call_back_into_the_cartoonizer(image, concurrent):
+    cartoonizer = Cartoonizer()
+    cartoonizer.update_parameters(concurrent_branches=concurrent, quantization_mode='median_cut')
+    nested = []
+
+    def observer(event):
+        # Re-entrant call from inside a stage notification
+        if not nested:
+            nested.append(event.stage)
+            cartoonizer.cartoonize(make_image(16, 16))
+
+    cartoonizer.add_observer(observer)
+    run_with_timeout(lambda: cartoonizer.cartoonize(image))
+    assert nested and cartoonizer.counters['calls'] == 2
+
+
+def test_counters_are_consistent_across_threads():
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(quantization_mode='median_cut')
+    images = [make_image(24, 32, seed=i) for i in range(4)]
+
+    def work(img):
+        for _ in range(5):
+            cartoonizer.cartoonize(img)
+
+    threads = [threading.Thread(target=work, args=(img,)) for img in images]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cartoonizer.counters['calls'] == 20
+    assert cartoonizer.counters['total_seconds'] > 0
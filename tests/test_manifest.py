@@ -0,0 +1,81 @@
+import os
+
+import cv2
+import numpy as np
+
+from batch_processor import (load_manifest, parameter_fingerprint, plan_incremental,
+                             process_batch, save_manifest)
+from conftest import make_image
+
+PARAMS = {'quantization_mode': 'median_cut'}
+
+
+def write_inputs(directory, count=3):
+    directory.mkdir()
+    paths = []
+    for i in range(count):
+        path = str(directory / f'{i}.png')
+        cv2.imwrite(path, make_image(40, 56, seed=i))
+        paths.append(path)
+    return paths
+
+
+def test_fingerprint_covers_effective_parameters():
+    assert parameter_fingerprint({}) == parameter_fingerprint({'line_size': 7})
+    assert parameter_fingerprint({}) != parameter_fingerprint({'line_size': 9})
+    # Execution settings do not change the output
+    assert parameter_fingerprint({}) == parameter_fingerprint({'num_threads': 1,
+                                                               'concurrent_branches': False})
+    assert parameter_fingerprint({}) != parameter_fingerprint({}, output_format='png')
+    palette = np.float32([[0, 0, 0], [255, 255, 255]])
+    assert parameter_fingerprint({'palette': palette}) != parameter_fingerprint({})
+
+
+def test_manifest_round_trip(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    assert load_manifest(path) == {}
+    entries = {'/a.png': {'digest': 'x', 'size': 1, 'mtime_ns': 2, 'fingerprint': 'f',
+                          'output': '/out.png'}}
+    save_manifest(entries, path)
+    assert load_manifest(path) == entries
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_incremental_batch_skips_unchanged_images(tmp_path):
+    paths = write_inputs(tmp_path / 'input')
+    output_dir = str(tmp_path / 'out')
+    manifest = str(tmp_path / 'manifest.json')
+
+    first = process_batch(paths, output_dir, PARAMS, workers=1, verbose=False,
+                          manifest_path=manifest)
+    assert (first['succeeded'], first['skipped']) == (3, 0)
+
+    # One input changes, one output is deleted
+    cv2.imwrite(paths[0], make_image(40, 56, seed=10))
+    os.remove(first['images'][1]['output'])
+    second = process_batch(paths, output_dir, PARAMS, workers=1, verbose=False,
+                           manifest_path=manifest)
+    processed = {os.path.basename(r['input']) for r in second['images'] if r['status'] == 'ok'}
+    assert processed == {'0.png', '1.png'} and second['skipped'] == 1
+
+    # Other parameters make every image stale
+    third = process_batch(paths, output_dir, dict(PARAMS, line_size=9), workers=1,
+                          verbose=False, manifest_path=manifest)
+    assert (third['succeeded'], third['skipped']) == (3, 0)
+
+
+def test_plan_reuses_digest_of_untouched_files(tmp_path, monkeypatch):
+    paths = write_inputs(tmp_path / 'input', 1)
+    output_dir = str(tmp_path / 'out')
+    manifest = str(tmp_path / 'manifest.json')
+    process_batch(paths, output_dir, PARAMS, workers=1, verbose=False, manifest_path=manifest)
+
+    import batch_processor
+
+    def fail(path, chunk_size=None):
+        raise AssertionError("unchanged file re-hashed")
+
+    monkeypatch.setattr(batch_processor, 'file_digest', fail)
+    pending, up_to_date, _ = plan_incremental(paths, load_manifest(manifest),
+                                              parameter_fingerprint(PARAMS))
+    assert (pending, up_to_date) == ([], paths)
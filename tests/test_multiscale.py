@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from cartoonizer import Cartoonizer
+from conftest import make_image
+from fidelity import score
+
+PARAMS = {'quantization_mode': 'median_cut', 'random_seed': 0}
+
+
+def cartoonizer(**params):
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(**PARAMS, **params)
+    return cartoonizer
+
+
+def test_multiscale_stays_close_to_full_resolution():
+    img = make_image(480, 640)
+    multiscale = cartoonizer(multiscale_megapixels=0.1)
+    assert multiscale.multiscale_scale(img.shape) == pytest.approx(np.sqrt(0.1 / 0.3072))
+    scores = score(cartoonizer().cartoonize(img), multiscale.cartoonize(img))
+    # Smoothing and palette fitting at a third of the pixels; edges stay at full resolution
+    assert scores['psnr'] >= 28.0
+    assert scores['ssim'] >= 0.95
+    assert scores['palette_distance'] <= 2.0
+    assert scores['edge_iou'] == 1.0
+
+
+@pytest.mark.parametrize('height, width, enabled', [(400, 300, False), (600, 500, True)])
+def test_multiscale_switches_on_above_the_size_threshold(height, width, enabled, monkeypatch):
+    # Reaching 0.1 MP shrinks the sides of a 0.12 MP image by only 9%, of a 0.3 MP one by 42%
+    img = make_image(height, width)
+    multiscale = cartoonizer(multiscale_megapixels=0.1)
+    calls = []
+    cartoonize_multiscale = Cartoonizer.cartoonize_multiscale
+
+    def spy(self, *args):
+        calls.append(args[0].shape)
+        return cartoonize_multiscale(self, *args)
+
+    monkeypatch.setattr(Cartoonizer, 'cartoonize_multiscale', spy)
+    result = multiscale.cartoonize(img)
+    assert bool(calls) == enabled
+    assert (multiscale.multiscale_scale(img.shape) < 1.0) == enabled
+    if not enabled:
+        np.testing.assert_array_equal(result, cartoonizer().cartoonize(img))
+
+
+def test_multiscale_is_off_by_default():
+    assert Cartoonizer().multiscale_scale((4000, 6000, 3)) == 1.0
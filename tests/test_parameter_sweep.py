@@ -0,0 +1,55 @@
+import json
+
+import numpy as np
+
+from cartoonizer import Cartoonizer
+from parameter_sweep import build_sweep_graph, execute_graph, expand_grid, run_sweep
+
+GRID = {
+    'bilateral_filter_d': [5, 9],
+    'total_color_levels': [4, 8],
+    ('edge_threshold1', 'edge_threshold2'): [(30, 100), (50, 150)],
+}
+BASE_PARAMS = {'random_seed': 0}
+
+
+def test_expand_grid_varies_tuple_keys_together():
+    combinations = expand_grid(GRID)
+    assert len(combinations) == 8
+    assert {(p['edge_threshold1'], p['edge_threshold2']) for p in combinations} == {(30, 100), (50, 150)}
+
+
+def test_sweep_outputs_match_cartoonize(image):
+    combinations = expand_grid(GRID)
+    nodes, outputs = build_sweep_graph(image, combinations, BASE_PARAMS)
+    results = {}
+    execute_graph(nodes, outputs, lambda key, cartoon: results.__setitem__(key[1], cartoon),
+                  workers=2)
+
+    assert sorted(results) == list(range(len(combinations)))
+    for index, params in enumerate(combinations):
+        cartoonizer = Cartoonizer(cache_bytes=0)
+        cartoonizer.update_parameters(**BASE_PARAMS)
+        cartoonizer.update_parameters(**params)
+        np.testing.assert_array_equal(results[index], cartoonizer.cartoonize(image))
+
+
+def test_shared_stages_are_computed_once(image, tmp_path, monkeypatch):
+    calls = {'apply_bilateral_filter': 0, 'color_quantization': 0, 'edge_mask': 0}
+    for name in calls:
+        method = getattr(Cartoonizer, name)
+
+        def counted(self, *args, method=method, name=name):
+            calls[name] += 1
+            return method(self, *args)
+
+        monkeypatch.setattr(Cartoonizer, name, counted)
+
+    entries = run_sweep(image, GRID, str(tmp_path), BASE_PARAMS, workers=2, contact_sheet=True,
+                        thumbnail_width=64, verbose=False)
+    # 2 filter diameters, times 2 level counts for quantization, and 2 edge threshold pairs
+    assert calls == {'apply_bilateral_filter': 2, 'color_quantization': 4, 'edge_mask': 2}
+    assert len(entries) == 8
+    with open(tmp_path / 'index.json') as f:
+        assert [entry['index'] for entry in json.load(f)] == list(range(8))
+    assert (tmp_path / 'contact_sheet.jpg').exists()
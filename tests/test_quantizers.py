@@ -0,0 +1,123 @@
+import json
+
+import numpy as np
+import pytest
+
+from cartoonizer import Cartoonizer
+from conftest import make_image
+from quantizers import (apply_lut, color_histogram, histogram_totals, kmeans_palette,
+                        load_palette, median_cut_palette, octree_palette, palette_lut,
+                        sample_pixels, save_palette)
+
+# Four well-separated colors, each near the center of its 5-bit histogram bin
+COLORS = np.uint8([[3, 3, 3], [251, 3, 3], [3, 251, 123], [123, 123, 251]])
+
+
+def four_color_image():
+    return np.repeat(np.repeat(COLORS.reshape((2, 2, 3)), 16, axis=0), 16, axis=1)
+
+
+@pytest.mark.parametrize('method', ['random', 'stratified'])
+def test_sample_pixels_come_from_image(image, method):
+    samples = sample_pixels(image, 500, method, np.random.default_rng(0))
+    assert samples.dtype == np.float32 and samples.shape[1] == 3
+    assert 250 <= len(samples) <= 1000
+    colors = {tuple(c) for c in image.reshape((-1, 3))}
+    assert all(tuple(np.uint8(s)) in colors for s in samples)
+
+
+@pytest.mark.parametrize('shape', [(4000, 8), (8, 4000), (1, 5000), (5000, 1), (1, 101)])
+def test_stratified_sampling_of_thin_images(shape):
+    img = np.random.default_rng(0).integers(0, 256, shape + (3,), dtype=np.uint8)
+    samples = sample_pixels(img, 100, 'stratified', np.random.default_rng(0))
+    assert 50 <= len(samples) <= 100
+
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(quantization_mode='sampled', sample_method='stratified',
+                                  sample_size=100, random_seed=0)
+    assert cartoonizer.color_quantization(img).shape == img.shape
+
+
+@pytest.mark.parametrize('method', ['random', 'stratified'])
+def test_sampled_mode_uses_few_colors(image, method):
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(quantization_mode='sampled', sample_method=method,
+                                  sample_size=1000, random_seed=0)
+    quantized = cartoonizer.color_quantization(image)
+    assert len(np.unique(quantized.reshape((-1, 3)), axis=0)) <= cartoonizer.total_color_levels
+
+
+def test_kmeans_palette_with_fewer_samples_than_levels():
+    samples = np.float32([[0, 0, 0], [255, 255, 255], [0, 0, 255]])
+    palette = kmeans_palette(samples, 8, seed=0)
+    assert palette.shape == (3, 3)
+    assert sorted(map(tuple, palette)) == sorted(map(tuple, samples))
+    with pytest.raises(ValueError):
+        kmeans_palette(np.zeros((0, 3), np.float32), 8)
+
+    # A 2x2 image has fewer pixels than the default 8 levels, also when warm-starting
+    img = make_image(2, 2)
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(quantization_mode='sampled')
+    for _ in range(2):
+        assert cartoonizer.color_quantization(img).shape == img.shape
+
+
+def test_histogram_totals_count_every_pixel(image):
+    counts, sums = histogram_totals(image)
+    assert counts.sum() == image.shape[0] * image.shape[1]
+    np.testing.assert_allclose(sums.sum(axis=0), image.reshape((-1, 3)).sum(axis=0))
+
+
+@pytest.mark.parametrize('levels', [2, 4, 8])
+def test_histogram_palettes_recover_flat_colors(levels):
+    bins, counts, means = color_histogram(four_color_image())
+    for palette in (median_cut_palette(counts, means, levels),
+                    octree_palette(bins, counts, means, levels)):
+        assert palette.dtype == np.float32 and len(palette) <= levels
+        if levels >= 4:
+            assert {tuple(c) for c in np.uint8(palette)} == {tuple(c) for c in COLORS}
+
+
+def test_palette_lut_maps_pixels_to_nearest_color(image):
+    palette = np.float32(COLORS)
+    mapped = apply_lut(image, palette_lut(palette))
+    assert {tuple(c) for c in mapped.reshape((-1, 3))} <= {tuple(c) for c in COLORS}
+    np.testing.assert_array_equal(apply_lut(four_color_image(), palette_lut(palette)),
+                                  four_color_image())
+
+
+@pytest.mark.parametrize('mode', ['median_cut', 'octree'])
+def test_histogram_modes_use_few_colors(image, mode):
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(quantization_mode=mode, total_color_levels=6)
+    quantized = cartoonizer.color_quantization(image)
+    assert quantized.shape == image.shape
+    assert len(np.unique(quantized.reshape((-1, 3)), axis=0)) <= 6
+
+
+def test_palette_file_round_trip(tmp_path):
+    path = str(tmp_path / 'palette.json')
+    save_palette(np.float32(COLORS) + 0.2, path)
+    np.testing.assert_array_equal(load_palette(path), np.float32(COLORS))
+
+    with open(path, 'w') as f:
+        json.dump({'order': 'RGB', 'colors': COLORS[:, ::-1].tolist()}, f)
+    np.testing.assert_array_equal(load_palette(path), np.float32(COLORS))
+
+
+@pytest.mark.parametrize('mode', ['sampled', 'median_cut'])
+def test_shared_palette_is_applied_to_every_image(mode):
+    images = [make_image(seed=seed) for seed in range(3)]
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(quantization_mode=mode, total_color_levels=5, random_seed=0)
+    palette = cartoonizer.fit_palette(images)
+    assert palette.shape == (5, 3)
+
+    cartoonizer.update_parameters(palette=palette)
+    colors = {tuple(c) for c in np.uint8(np.rint(palette))}
+    for img in images:
+        quantized = cartoonizer.color_quantization(img)
+        assert {tuple(c) for c in quantized.reshape((-1, 3))} <= colors
+    cartoonizer.clear_palette()
+    assert cartoonizer.palette is None
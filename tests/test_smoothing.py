@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+import pytest
+
+from conftest import make_image
+from smoothing import guided_upsample, iterative_bilateral, layered_bilateral, smoothing_radius
+
+
+@pytest.mark.parametrize('engine', [iterative_bilateral, layered_bilateral])
+def test_approximations_stay_close_to_bilateral(engine):
+    img = make_image(120, 160)
+    exact = cv2.bilateralFilter(img, 15, 75, 75)
+    approximate = engine(img, 15, 75, 75)
+    assert approximate.shape == img.shape and approximate.dtype == np.uint8
+    assert np.abs(approximate.astype(int) - exact).mean() < 6
+
+
+def test_layered_does_not_depend_on_band_height():
+    img = make_image(150, 170)
+    np.testing.assert_array_equal(layered_bilateral(img, 15, 75, 75, band=16),
+                                  layered_bilateral(img, 15, 75, 75, band=1000))
+
+
+@pytest.mark.parametrize('top, left', [(0, 0), (37, 53), (41, 19)])
+def test_layered_crop_matches_whole_image(top, left):
+    img = make_image(200, 240)
+    d, sigma_color, sigma_space = 21, 75, 75
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    intensity_range = (int(gray.min()), int(gray.max()))
+    whole = layered_bilateral(img, d, sigma_color, sigma_space)
+
+    halo = smoothing_radius('layered', d, sigma_space)
+    crop = img[top:top + 120, left:left + 150]
+    filtered = layered_bilateral(crop, d, sigma_color, sigma_space,
+                                 intensity_range=intensity_range, origin=(top, left))
+    # Away from the crop's own borders, except where they are the image's
+    inner_top = 0 if top == 0 else halo
+    inner_left = 0 if left == 0 else halo
+    np.testing.assert_array_equal(filtered[inner_top:-halo, inner_left:-halo],
+                                  whole[top + inner_top:top + 120 - halo,
+                                        left + inner_left:left + 150 - halo])
+
+
+def test_guided_upsample_restores_size():
+    img = make_image(90, 120)
+    small = cv2.resize(img, (40, 30), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    upsampled = guided_upsample(small, cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), gray, band=16)
+    assert upsampled.shape == img.shape
+    assert np.abs(upsampled.astype(int) - img).mean() < 20
@@ -0,0 +1,155 @@
+import cv2
+import numpy as np
+import pytest
+
+import cartoonizer as cartoonizer_module
+from cartoonizer import Cartoonizer
+from stage_cache import PaletteCache, StageCache, image_key
+
+
+def test_image_key_follows_content(image):
+    copy = image.copy()
+    assert image_key(copy) == image_key(image)
+    copy[0, 0, 0] ^= 1
+    assert image_key(copy) != image_key(image)
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    cache = StageCache(max_bytes=250, max_entries=2)
+    cache.put('a', np.zeros(100, np.uint8))
+    cache.put('b', np.zeros(100, np.uint8))
+    cache.get('a')
+    cache.put('c', np.zeros(100, np.uint8))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+    cache.put('d', np.zeros(200, np.uint8))
+    assert len(cache) == 1 and cache.current_bytes == 200
+    # Larger than the whole budget: returned but not stored
+    cache.put('e', np.zeros(300, np.uint8))
+    assert cache.get('e') is None
+
+
+def test_cached_results_are_read_only():
+    cache = StageCache()
+    value = cache.put('a', np.zeros(4, np.uint8))
+    with pytest.raises(ValueError):
+        value[0] = 1
+
+
+def test_repeated_call_hits_cache_and_matches(image):
+    cartoonizer = Cartoonizer()
+    cartoonizer.update_parameters(random_seed=0)
+    first = cartoonizer.cartoonize(image)
+    second = cartoonizer.cartoonize(image)
+    assert cartoonizer.counters['cache_hits'] == 3
+    np.testing.assert_array_equal(first, second)
+
+    uncached = Cartoonizer(cache_bytes=0)
+    uncached.update_parameters(random_seed=0)
+    np.testing.assert_array_equal(uncached.cartoonize(image), first)
+
+
+def test_parameter_change_recomputes_only_dependent_stages(image):
+    cartoonizer = Cartoonizer()
+    cartoonizer.update_parameters(random_seed=0)
+    cartoonizer.cartoonize(image)
+    cartoonizer.update_parameters(edge_threshold1=20)
+    with cartoonizer.instrument() as report:
+        cartoonizer.cartoonize(image)
+    stages = report.per_stage()
+    assert stages['apply_bilateral_filter']['cache_hits'] == 1
+    assert stages['color_quantization']['cache_hits'] == 1
+    assert stages['edge_detection']['cache_hits'] == 0
+
+
+@pytest.mark.parametrize('multiscale', [False, True])
+def test_disabled_cache_skips_hashing(image, monkeypatch, multiscale):
+    def fail(img):
+        raise AssertionError("image hashed with caching disabled")
+
+    monkeypatch.setattr(cartoonizer_module, 'image_key', fail)
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    if multiscale:
+        cartoonizer.update_parameters(multiscale_megapixels=0.005)
+    cartoonizer.cartoonize(image)
+    assert cartoonizer.counters['cache_misses'] == 0
+
+
+def shifted(img, offset):
+    """The image with every value shifted, far outside the palette cache tolerance."""
+    return np.uint8(np.clip(img.astype(np.int16) + offset, 0, 255))
+
+
+@pytest.fixture
+def warm_starts(monkeypatch):
+    """Record the starting palettes of warm-started K-means runs."""
+    seeds = []
+    warm_start_kmeans = cartoonizer_module.warm_start_kmeans
+
+    def spy(samples, palette, max_iter=5, eps=0.5):
+        seeds.append(np.array(palette))
+        return warm_start_kmeans(samples, palette, max_iter, eps)
+
+    monkeypatch.setattr(cartoonizer_module, 'warm_start_kmeans', spy)
+    return seeds
+
+
+def test_near_duplicate_image_seeds_kmeans(image, warm_starts):
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.color_quantization(image)
+    assert cartoonizer.palette_cache.misses == 1 and not warm_starts
+    fitted = cartoonizer.palette_cache._entries[0][1].copy()
+
+    noise = np.random.default_rng(1).integers(-2, 3, image.shape)
+    near = np.uint8(np.clip(image.astype(np.int16) + noise, 0, 255))
+    quantized = cartoonizer.color_quantization(near)
+    assert cartoonizer.palette_cache.hits == 1
+    assert len(warm_starts) == 1
+    np.testing.assert_array_equal(warm_starts[0], fitted)
+    assert len(np.unique(quantized.reshape((-1, 3)), axis=0)) <= cartoonizer.total_color_levels
+
+
+def test_different_image_misses(image, warm_starts):
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.color_quantization(image)
+    cartoonizer.color_quantization(shifted(image, 80))
+    assert cartoonizer.palette_cache.hits == 0 and cartoonizer.palette_cache.misses == 2
+    assert not warm_starts
+
+
+def test_palette_cache_evicts_oldest(image):
+    cartoonizer = Cartoonizer(cache_bytes=0, palette_cache_entries=2)
+    images = [shifted(image, offset) for offset in (-100, 0, 100)]
+    for img in images:
+        cartoonizer.color_quantization(img)
+    cache = cartoonizer.palette_cache
+    assert len(cache._entries) == 2
+    levels = cartoonizer.total_color_levels
+    assert cache.get(cache.signature(images[0]), levels) is None
+    assert cache.get(cache.signature(images[2]), levels) is not None
+
+
+def test_palette_cache_keeps_one_palette_per_size(image):
+    cache = PaletteCache()
+    signature = cache.signature(image)
+    cache.put(signature, np.zeros((4, 3)))
+    cache.put(signature, np.ones((4, 3)))
+    cache.put(signature, np.zeros((6, 3)))
+    assert len(cache._entries) == 2
+    np.testing.assert_array_equal(cache.get(signature, 4), np.ones((4, 3)))
+
+
+def test_disabled_palette_cache_matches_cold_start(image, warm_starts):
+    near = image.copy()
+    near[0, 0] ^= 1
+    disabled = Cartoonizer(cache_bytes=0, palette_cache_entries=0)
+    cv2.setRNGSeed(0)
+    disabled.color_quantization(image)
+    cv2.setRNGSeed(0)
+    result = disabled.color_quantization(near)
+
+    cold = Cartoonizer(cache_bytes=0)
+    cv2.setRNGSeed(0)
+    np.testing.assert_array_equal(result, cold.color_quantization(near))
+    assert not warm_starts and len(disabled.palette_cache._entries) == 0
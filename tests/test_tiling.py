@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from cartoonizer import Cartoonizer
+from conftest import make_image
+from tiling import iter_tiles
+
+
+def test_tiles_cover_image_once():
+    coverage = np.zeros((70, 95), np.int32)
+    for core, padded, inner in iter_tiles(70, 95, 32, 5):
+        coverage[core] += 1
+        assert coverage[padded][inner].shape == coverage[core].shape
+    assert (coverage == 1).all()
+
+
+@pytest.mark.parametrize('engine', ['bilateral', 'iterative', 'layered'])
+def test_tiled_matches_untiled_with_shared_palette(engine):
+    img = make_image(400, 520)
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(smoothing_engine=engine, random_seed=0)
+    cartoonizer.update_parameters(palette=cartoonizer.fit_palette([img]))
+    untiled = cartoonizer.cartoonize(img)
+    cartoonizer.update_parameters(tile_size=128)
+    tiled = cartoonizer.cartoonize(img)
+    assert np.any(tiled != untiled, axis=2).mean() < 0.0005
+
+
+@pytest.mark.parametrize('mode', ['sampled', 'median_cut'])
+def test_each_tile_is_smoothed_once(mode):
+    img = make_image(200, 260)
+    cartoonizer = Cartoonizer(cache_bytes=0)
+    cartoonizer.update_parameters(tile_size=64, quantization_mode=mode, random_seed=0)
+    with cartoonizer.instrument() as report:
+        cartoon = cartoonizer.cartoonize(img)
+    tiles = len(list(iter_tiles(200, 260, 64, 0)))
+    assert report.per_stage()['apply_bilateral_filter']['calls'] == tiles
+    assert len(np.unique(cartoon.reshape((-1, 3)), axis=0)) <= cartoonizer.total_color_levels + 1
@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+import pytest
+
+from cartoonizer import Cartoonizer
+from conftest import make_image
+from video_cartoonizer import VideoCartoonizer, cartoonize_video
+
+
+def moving_frames(count, height=48, width=64):
+    """Frames of one scene with a square moving across it."""
+    frames = []
+    for i in range(count):
+        frame = make_image(height, width, seed=i)
+        cv2.rectangle(frame, (4 * i, 30), (4 * i + 10, 40), (250, 250, 250), -1)
+        frames.append(frame)
+    return frames
+
+
+def video_cartoonizer(**params):
+    cartoonizer = Cartoonizer(cache_bytes=0, reuse_buffers=True)
+    cartoonizer.update_parameters(random_seed=0, **params)
+    return VideoCartoonizer(cartoonizer)
+
+
+def test_palette_is_reused_within_a_scene_and_refit_on_a_cut():
+    video = video_cartoonizer()
+    frames = moving_frames(4)
+    cartoons = list(video.process_stream(frames))
+    assert video.frames == 4 and video.refits == 1
+    assert all(cartoon.shape == frames[0].shape for cartoon in cartoons)
+    palette = video.palette.copy()
+
+    # A scene cut to entirely different colors needs a new palette
+    cut = np.zeros_like(frames[0])
+    cut[:, :32], cut[:, 32:] = (0, 0, 255), (255, 0, 0)
+    video.process_frame(cut)
+    assert video.refits == 2
+    assert not np.allclose(video.palette, palette)
+
+    video.reset()
+    video.process_frame(frames[0])
+    assert video.refits == 1
+
+
+def test_new_level_count_refits():
+    video = video_cartoonizer()
+    frame = make_image(48, 64)
+    video.process_frame(frame)
+    video.cartoonizer.update_parameters(total_color_levels=4)
+    video.process_frame(frame)
+    assert video.refits == 2 and len(video.palette) == 4
+
+
+def test_returned_frames_do_not_share_buffers():
+    video = video_cartoonizer()
+    first, second = moving_frames(2)
+    a = video.process_frame(first)
+    kept = a.copy()
+    video.process_frame(second)
+    np.testing.assert_array_equal(a, kept)
+
+
+def test_cartoonize_video_keeps_frame_count_order_and_size(tmp_path):
+    input_path, output_path = str(tmp_path / 'input.avi'), str(tmp_path / 'output.avi')
+    writer = cv2.VideoWriter(input_path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+    if not writer.isOpened():
+        pytest.skip("no MJPG video writer")
+    for frame in moving_frames(6):
+        writer.write(frame)
+    writer.release()
+
+    stats = cartoonize_video(input_path, output_path, video_cartoonizer().cartoonizer,
+                             fourcc='MJPG', queue_size=2)
+    assert stats['frames'] == 6
+
+    def read_all(path):
+        capture = cv2.VideoCapture(path)
+        frames = []
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+        capture.release()
+        return frames
+
+    # The same frames cartoonized one after another, without the pipeline
+    expected = list(video_cartoonizer().process_stream(read_all(input_path)))
+    outputs = read_all(output_path)
+    assert len(outputs) == 6
+    assert all(output.shape == (48, 64, 3) for output in outputs)
+    for i, output in enumerate(outputs):
+        errors = [np.abs(output.astype(int) - e).mean() for e in expected]
+        assert int(np.argmin(errors)) == i
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from viewport import MAX_ZOOM, DisplayPyramid, Viewport
+
+IMAGE_SIZE = (800, 600)
+VIEW_SIZE = (400, 300)
+
+
+def test_fit_centers_the_whole_image():
+    viewport = Viewport()
+    viewport.fit(IMAGE_SIZE, VIEW_SIZE)
+    assert viewport.zoom == pytest.approx(0.5)
+    assert viewport.origin(VIEW_SIZE) == pytest.approx((0.0, 0.0))
+
+
+def test_zoom_keeps_the_point_under_the_pointer():
+    viewport = Viewport()
+    viewport.fit(IMAGE_SIZE, VIEW_SIZE)
+    x, y = 100, 80
+    left, top = viewport.origin(VIEW_SIZE)
+    point = (left + x / viewport.zoom, top + y / viewport.zoom)
+
+    viewport.zoom_at(3.0, x, y, IMAGE_SIZE, VIEW_SIZE)
+    left, top = viewport.origin(VIEW_SIZE)
+    assert viewport.zoom == pytest.approx(1.5)
+    assert (left + x / viewport.zoom, top + y / viewport.zoom) == pytest.approx(point)
+    assert not viewport.fitted
+
+
+def test_zoom_and_pan_are_clamped():
+    viewport = Viewport()
+    viewport.fit(IMAGE_SIZE, VIEW_SIZE)
+    viewport.zoom_at(1000.0, 0, 0, IMAGE_SIZE, VIEW_SIZE)
+    assert viewport.zoom == MAX_ZOOM
+    # Zooming out stops at the fitted view
+    viewport.zoom_at(1e-6, 0, 0, IMAGE_SIZE, VIEW_SIZE)
+    assert viewport.zoom == pytest.approx(0.5)
+
+    viewport.pan(-1e6, 1e6, IMAGE_SIZE)
+    assert viewport.center == (IMAGE_SIZE[0], 0.0)
+
+
+def test_render_at_full_resolution_matches_the_image(image):
+    view = DisplayPyramid(image).render(1.0, 0, 0, image.shape[1], image.shape[0])
+    np.testing.assert_array_equal(view, image[..., ::-1])
+
+
+def test_render_of_a_preview_uses_full_resolution_coordinates(image):
+    # A half-size preview rendered at zoom 0.5 shows the preview pixels one to one
+    preview = image[::2, ::2]
+    view = DisplayPyramid(preview, scale=0.5).render(0.5, 0, 0, preview.shape[1], preview.shape[0])
+    np.testing.assert_array_equal(view, preview[..., ::-1])
+
+
+def test_zoomed_out_render_uses_a_smaller_level(image):
+    pyramid = DisplayPyramid(image)
+    view = pyramid.render(0.25, 0, 0, image.shape[1] // 4, image.shape[0] // 4)
+    assert view.shape == (image.shape[0] // 4, image.shape[1] // 4, 3)
+    assert len(pyramid.levels) == 3
+
+
+def test_zoomed_in_render_shows_square_pixels(image):
+    view = DisplayPyramid(image).render(4.0, 10, 20, 16, 8)
+    expected = np.repeat(np.repeat(image[20:22, 10:14, ::-1], 4, axis=0), 4, axis=1)
+    np.testing.assert_array_equal(view, expected)
+
+
+def test_render_outside_the_image_is_background(image):
+    view = DisplayPyramid(image).render(1.0, 10000, 10000, 8, 8, background=(1, 2, 3))
+    assert (view == (1, 2, 3)).all()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from cartoonizer import Cartoonizer
+from conftest import make_image
+
+MODES = [{}, {'quantization_mode': 'sampled', 'sample_size': 2000},
+         {'quantization_mode': 'octree'}, {'palette': [[0, 0, 0], [90, 160, 220], [200, 60, 30]]}]
+
+
+def reference(img, params):
+    cartoonizer = Cartoonizer(cache_bytes=0, palette_cache_entries=0)
+    cartoonizer.update_parameters(random_seed=0, **params)
+    return cartoonizer.cartoonize(img)
+
+
+@pytest.mark.parametrize('reuse_buffers', [False, True])
+@pytest.mark.parametrize('params', MODES)
+def test_out_is_filled_in_place(image, params, reuse_buffers):
+    cartoonizer = Cartoonizer(cache_bytes=0, reuse_buffers=reuse_buffers)
+    cartoonizer.update_parameters(random_seed=0, **params)
+    out = np.full(image.shape, 7, np.uint8)
+    result = cartoonizer.cartoonize(image, out)
+    assert result is out
+    np.testing.assert_array_equal(out, reference(image, params))
+
+
+@pytest.mark.parametrize('params', MODES)
+def test_reused_buffers_do_not_leak_between_sizes(params):
+    large, small = make_image(120, 160, seed=1), make_image(48, 64, seed=2)
+    cartoonizer = Cartoonizer(cache_bytes=0, reuse_buffers=True)
+    cartoonizer.update_parameters(random_seed=0, **params)
+    results = [cartoonizer.cartoonize(img) for img in (large, small, large, small)]
+    for img, result in zip((large, small, large, small), results):
+        np.testing.assert_array_equal(result, reference(img, params))
+    assert cartoonizer.workspace
+    cartoonizer.release_workspace()
+    assert not cartoonizer.workspace
+
+
+def test_results_do_not_alias_reused_buffers(image):
+    cartoonizer = Cartoonizer(cache_bytes=0, reuse_buffers=True)
+    cartoonizer.update_parameters(random_seed=0)
+    first = cartoonizer.cartoonize(image)
+    kept = first.copy()
+    cartoonizer.cartoonize(255 - image)
+    np.testing.assert_array_equal(first, kept)
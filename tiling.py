@@ -0,0 +1,28 @@
+def iter_tiles(height, width, tile_size, halo):
+    """
+    Split an image into tiles surrounded by an overlapping halo.
+
+    Filters whose support fits in the halo produce the same values in a tile's
+    core as they would on the whole image. At the image borders the halo is
+    clipped, so the filters see the same border as on the whole image.
+
+    Args:
+        height: Image height
+        width: Image width
+        tile_size: Side length of the tile cores
+        halo: Number of extra pixels read on each side of a core
+
+    Yields:
+        Tuples (core, padded, inner) of slice pairs: the core region in image
+        coordinates, the padded region to read in image coordinates, and the
+        core region relative to the padded one
+    """
+    for y0 in range(0, height, tile_size):
+        y1 = min(y0 + tile_size, height)
+        py0, py1 = max(y0 - halo, 0), min(y1 + halo, height)
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            px0, px1 = max(x0 - halo, 0), min(x1 + halo, width)
+            yield ((slice(y0, y1), slice(x0, x1)),
+                   (slice(py0, py1), slice(px0, px1)),
+                   (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0)))
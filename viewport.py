@@ -0,0 +1,163 @@
+import math
+
+import cv2
+import numpy as np
+
+# Zoom limits, in display pixels per full-resolution pixel
+MIN_ZOOM = 0.01
+MAX_ZOOM = 16.0
+
+
+class DisplayPyramid:
+    """
+    RGB display copies of an image at halving resolutions, built on demand.
+
+    The BGR to RGB conversion and each downscaled level are computed once,
+    the first time a view needs them, so panning and zooming only resample
+    the visible region of the closest level.
+    """
+
+    def __init__(self, img, scale=1.0):
+        """
+        Initialize the pyramid.
+
+        Args:
+            img: BGR image
+            scale: Resolution of img relative to the full-resolution image,
+                e.g. the scale of a preview (coordinates passed to render are
+                full-resolution pixels)
+        """
+        self.source = img
+        self.scale = scale
+        self.levels = []
+
+    def level(self, index):
+        """
+        RGB copy of the image downscaled by 2 ** index, clamped to the smallest level.
+
+        Returns:
+            Tuple (level index, RGB image)
+        """
+        if not self.levels:
+            self.levels.append(cv2.cvtColor(self.source, cv2.COLOR_BGR2RGB))
+        while len(self.levels) <= index:
+            previous = self.levels[-1]
+            height, width = previous.shape[:2]
+            if min(width, height) <= 1:
+                break
+            size = ((width + 1) // 2, (height + 1) // 2)
+            self.levels.append(cv2.resize(previous, size, interpolation=cv2.INTER_AREA))
+        index = min(index, len(self.levels) - 1)
+        return index, self.levels[index]
+
+    def render(self, zoom, left, top, width, height, background=(0, 0, 0)):
+        """
+        Render a view of the image.
+
+        Only the region inside the view is resampled, from the smallest
+        pyramid level with at least the displayed resolution. Zoomed-in
+        views show the pixels as sharp squares.
+
+        Args:
+            zoom: Display pixels per full-resolution pixel
+            left, top: Full-resolution coordinates of the view's top-left corner
+            width, height: Size of the view in display pixels
+            background: RGB color outside the image
+
+        Returns:
+            uint8 RGB array of shape (height, width, 3)
+        """
+        source_zoom = zoom / self.scale
+        index = max(0, int(math.floor(math.log2(1.0 / source_zoom)))) if source_zoom < 1 else 0
+        index, img = self.level(index)
+        level_zoom = source_zoom * 2 ** index
+        # Top-left corner of the view and pixel size in level coordinates
+        x0 = left * self.scale / 2 ** index
+        y0 = top * self.scale / 2 ** index
+        step = 1.0 / level_zoom
+
+        # Crop the visible region (plus a pixel of margin for interpolation)
+        level_height, level_width = img.shape[:2]
+        crop_left = min(max(int(math.floor(x0)) - 1, 0), level_width)
+        crop_top = min(max(int(math.floor(y0)) - 1, 0), level_height)
+        crop_right = min(max(int(math.ceil(x0 + width * step)) + 1, 0), level_width)
+        crop_bottom = min(max(int(math.ceil(y0 + height * step)) + 1, 0), level_height)
+        if crop_right <= crop_left or crop_bottom <= crop_top:
+            return np.full((height, width, 3), background, np.uint8)
+        crop = img[crop_top:crop_bottom, crop_left:crop_right]
+
+        # Maps display pixel centers to crop pixel centers
+        transform = np.float32([[step, 0, x0 - crop_left + 0.5 * step - 0.5],
+                                [0, step, y0 - crop_top + 0.5 * step - 0.5]])
+        interpolation = cv2.INTER_NEAREST if level_zoom >= 2 else cv2.INTER_LINEAR
+        return cv2.warpAffine(crop, transform, (width, height),
+                              flags=interpolation | cv2.WARP_INVERSE_MAP,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=background)
+
+
+class Viewport:
+    """
+    Zoom and pan state of a view onto a full-resolution image.
+
+    Until the user zooms or pans, the view fits the whole image and follows
+    changes of the view size.
+    """
+
+    def __init__(self):
+        """Initialize a view fitting the image."""
+        self.zoom = 1.0
+        self.center = (0.0, 0.0)
+        self.fitted = True
+
+    def fit(self, image_size, view_size):
+        """
+        Fit the whole image in the view.
+
+        Args:
+            image_size: Tuple (width, height) of the full-resolution image
+            view_size: Tuple (width, height) of the view in display pixels
+        """
+        self.zoom = max(MIN_ZOOM, min(view_size[0] / image_size[0], view_size[1] / image_size[1]))
+        self.center = (image_size[0] / 2, image_size[1] / 2)
+        self.fitted = True
+
+    def origin(self, view_size):
+        """Full-resolution coordinates of the view's top-left corner."""
+        return (self.center[0] - view_size[0] / (2 * self.zoom),
+                self.center[1] - view_size[1] / (2 * self.zoom))
+
+    def zoom_at(self, factor, x, y, image_size, view_size):
+        """
+        Zoom by a factor, keeping the image point under (x, y) in place.
+
+        Args:
+            factor: Zoom factor (above 1 zooms in)
+            x, y: Display coordinates of the zoom center, e.g. the mouse pointer
+            image_size: Tuple (width, height) of the full-resolution image
+            view_size: Tuple (width, height) of the view in display pixels
+        """
+        left, top = self.origin(view_size)
+        point = (left + x / self.zoom, top + y / self.zoom)
+        fit_zoom = min(view_size[0] / image_size[0], view_size[1] / image_size[1])
+        self.zoom = min(max(self.zoom * factor, min(fit_zoom, 1.0), MIN_ZOOM), MAX_ZOOM)
+        left, top = point[0] - x / self.zoom, point[1] - y / self.zoom
+        self.center = (left + view_size[0] / (2 * self.zoom), top + view_size[1] / (2 * self.zoom))
+        self.fitted = False
+        self.clamp(image_size)
+
+    def pan(self, dx, dy, image_size):
+        """
+        Move the image by (dx, dy) display pixels, e.g. while dragging it.
+
+        Args:
+            dx, dy: Displacement in display pixels
+            image_size: Tuple (width, height) of the full-resolution image
+        """
+        self.center = (self.center[0] - dx / self.zoom, self.center[1] - dy / self.zoom)
+        self.fitted = False
+        self.clamp(image_size)
+
+    def clamp(self, image_size):
+        """Keep the view's center on the image."""
+        self.center = (min(max(self.center[0], 0.0), image_size[0]),
+                       min(max(self.center[1], 0.0), image_size[1]))